@@ -1,5 +1,6 @@
-import google.generativeai as genai
 import config
+import asyncio
+import contextvars
 import re
 import random
 import time
@@ -8,17 +9,122 @@ import json
 import os
 from datetime import datetime
 from document_handler import DocumentHandler
+from fair_scheduler import HouseKeyBusyError, get_house_scheduler
+from key_pool import ApiKeyPool, make_model
+from circuit_breaker import CircuitOpenError, RetryPolicy, classify_error, is_auth_error
+from conversation_context import RollingContext
+from lexicon import Lexicon
+from local_responder import LocalResponder
+from prompt_builder import PromptBuilder, estimate_tokens
+from response_cache import get_response_cache, is_cacheable
+from session_log import SessionLog, load_responses
 import glob
 import pickle
+import threading
+from functools import partial
 from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
 try:
     from db_handler import MongoDBHandler
     DB_HANDLER_AVAILABLE = True
 except ImportError:
     DB_HANDLER_AVAILABLE = False
 
+# The Gemini client blocks, so model calls run here instead of on the event
+# loop; the pool size caps concurrent calls for the whole process
+model_executor = ThreadPoolExecutor(max_workers=config.GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+
+class ModelBusyError(CircuitOpenError):
+    """Raised when a call waited too long for a free model_executor slot (not the key's fault)"""
+
+class KeyValidationCache:
+    """Process-wide record of which Gemini keys are known to be good or bad"""
+    
+    def __init__(self, valid_ttl=None, invalid_ttl=None):
+        self.valid_ttl = valid_ttl or config.GEMINI_KEY_VALID_TTL
+        self.invalid_ttl = invalid_ttl or config.GEMINI_KEY_INVALID_TTL
+        self.entries = {}  # sha256 of key -> (valid, expires_at)
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def _fingerprint(api_key):
+        # Never keep raw keys around in memory longer than needed
+        return hashlib.sha256(api_key.encode()).hexdigest()
+    
+    def get(self, api_key):
+        """True/False if the key's status is known and fresh, else None"""
+        fingerprint = self._fingerprint(api_key)
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                return None
+            valid, expires_at = entry
+            if time.time() >= expires_at:
+                del self.entries[fingerprint]
+                return None
+            return valid
+    
+    def mark(self, api_key, valid):
+        ttl = self.valid_ttl if valid else self.invalid_ttl
+        with self.lock:
+            self.entries[self._fingerprint(api_key)] = (valid, time.time() + ttl)
+    
+    def invalidate(self, api_key):
+        with self.lock:
+            self.entries.pop(self._fingerprint(api_key), None)
+
+key_validation_cache = KeyValidationCache()
+
+def _mark_started(future):
+    if not future.done():
+        future.set_result(True)
+
+def _run_call(call, loop, started, cancelled):
+    """Worker side of a model call: report when it actually starts, skip it if given up on"""
+    if cancelled.is_set():
+        return None
+    loop.call_soon_threadsafe(_mark_started, started)
+    return call()
+
+def _stream_content(model, prompt, loop, on_chunk, cancelled, request_options=None, context=None):
+    """Blocking streamed call that hands each chunk's text to the loop as it arrives
+
+    Stops reading once `cancelled` is set, so an abandoned call can't keep
+    feeding chunks to a later attempt. Chunks are handled in `context`, the
+    caller's context, as if on_chunk had been called from the caller.
+    """
+    response = model.generate_content(prompt, stream=True, request_options=request_options)
+    for chunk in response:
+        if cancelled.is_set():
+            break
+        loop.call_soon_threadsafe(on_chunk, chunk.text, context=context)
+    return response
+
+def validate_api_key(api_key):
+    """Check a key, making a live test call only if its status isn't cached"""
+    if not api_key or len(api_key) < 10:
+        return False
+    
+    known = key_validation_cache.get(api_key)
+    if known is not None:
+        return known
+    
+    try:
+        # Try a simple generation with minimal tokens to validate the key
+        make_model(api_key).generate_content("Hello")
+        valid = True
+    except Exception as e:
+        print(f"API key validation error: {e}")
+        # Only remember rejections; a network blip says nothing about the key
+        if not is_auth_error(e):
+            return False
+        valid = False
+    
+    key_validation_cache.mark(api_key, valid)
+    return valid
+
 class GeminiAI:
-    def __init__(self, super_context, api_key=None, user_id=None):
+    def __init__(self, super_context, api_key=None, user_id=None, api_keys=None):
         self.super_context = super_context
         self.api_key_valid = False
         self.user_id = user_id
@@ -29,21 +135,34 @@ class GeminiAI:
         else:
             self.api_key = config.GEMINI_API_KEY
         
-        # Track if we're using the free tier API key
-        self.using_free_tier = (self.api_key == config.FREE_TIER_API_KEY)
-            
-        # Validate API key before configuring
-        if self._validate_api_key():
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+        # Validation is lazy: keys known to be bad are rejected here, any
+        # other key is trusted until the first real call proves otherwise.
+        # The user's other stored keys join the pool to share the load; the
+        # shared house key is only used when the user has no key of their own.
+        own_keys = [key for key in [self.api_key] + list(api_keys or [])
+                    if key != config.FREE_TIER_API_KEY and self._key_usable(key)]
+        if own_keys:
+            keys = own_keys
+        else:
+            keys = [self.api_key] if self._key_usable(self.api_key) else []
+        self.key_pool = ApiKeyPool(keys)
+        
+        # Track if we're on the free tier API key (usage is counted per call in _generate)
+        self.using_free_tier = any(member.api_key == config.FREE_TIER_API_KEY for member in self.key_pool.members)
+        if self.key_pool:
             self.api_key_valid = True
         else:
             print(f"WARNING: Invalid Gemini API key - bot will use fallback responses")
-            self.model = None
         
         # Extract name and role from super_context
         self.persona_name, self.persona_role = self._extract_persona_from_context(super_context)
         
+        # Reply prompt compiled once for this persona; only the slots change per message
+        self.prompt_builder = PromptBuilder(self.persona_name, self.persona_role)
+        
+        # Recent messages verbatim plus a background-refreshed summary of older ones
+        self.context_window = RollingContext(summarize=self._summarize_history)
+        
         # Create document handler
         self.document_handler = DocumentHandler()
         
@@ -51,8 +170,20 @@ class GeminiAI:
         self.learning_manager = LearningManager()
         self.use_learning = True  # Toggle for learning feature
         
-        # Response tracking for analytics
-        self.response_log = []
+        # Answers to repeated questions, shared with other sessions of this persona
+        self.response_cache = get_response_cache()
+        
+        # Greetings, acknowledgments and emoji-only messages skip the model
+        self.local_responder = LocalResponder()
+        
+        # Model calls currently waiting on the executor (cancelled on stop)
+        self.pending_calls = set()
+        self.call_timeout = config.GEMINI_CALL_TIMEOUT
+        self.queue_max_wait = config.GEMINI_QUEUE_MAX_WAIT
+        self.candidates_generated = 0
+        self.candidates_exhausted = 0  # calls where every candidate was rejected
+        self.retry_policy = RetryPolicy()
+        
         self.session_start_time = datetime.now()
         
         # Add missing last_responses attribute
@@ -72,6 +203,9 @@ class GeminiAI:
             "❗", "❓", "⁉️", "‼️", "💭", "💬", "📢", "👇", "👈", "👉", "👋"
         ]
         
+        # Response tracking for analytics (recent entries in memory, all of them on disk)
+        self.session_log = SessionLog(super_context, self.emojis, started_at=self.session_start_time)
+        
         # Enhanced conversation memory
         self.conversation_topic = super_context
         self.last_substantive_topic = super_context
@@ -111,25 +245,148 @@ class GeminiAI:
             # Tech-related
             "naukri", "job", "kaam", "paisa", "salary", "interview", "company"
         ]
+        
+        self.question_words = [
+            'what', 'how', 'why', 'when', 'where', 'who', 'which', 
+            'mean', 'meaning', 'explain', 'tell me', 'definition'
+        ]
+        self.identity_patterns = [
+            "who are you", "who is this", "who r u", "who u", "your name", 
+            "what's your name", "whats ur name", "introduce yourself", "who am i talking to",
+            "aap kaun ho", "tum kaun ho", "apka naam", "tumhara naam", "kon hai tu"
+        ]
+        
+        # One compiled matcher for every signal list above; each message is
+        # scanned once and the result shared by all detectors
+        self.lexicon = Lexicon({
+            'farewell': self.farewells,
+            'greeting': self.greetings,
+            'acknowledgment': self.empty_responses,
+            'joke': self.joke_signals,
+            'agreement': self.agreement_signals,
+            'disagreement': self.disagreement_signals,
+            'question': self.question_words,
+            'identity': self.identity_patterns,
+            'hinglish': self.hinglish_patterns
+        })
 
-    def _validate_api_key(self):
-        """Validate the API key format and attempt a simple test call"""
-        if not self.api_key or len(self.api_key) < 10:
+    @staticmethod
+    def _key_usable(api_key):
+        """Check the key format and the shared validation cache (no API call)"""
+        if not api_key or len(api_key) < 10:
             return False
-            
+        return key_validation_cache.get(api_key) is not False
+
+    async def _generate(self, prompt, priority="normal", on_chunk=None, candidate_count=1, cancelled=None):
+        """Run a model call on the executor with a deadline, on the pool's best key
+
+        With on_chunk the call is streamed and on_chunk gets each piece of
+        text on the event loop as it arrives; the returned response still
+        holds the full text. `cancelled` (a threading.Event) is set if the
+        call is given up on, which stops the stream. candidate_count > 1
+        asks for several alternative responses in the one call (not streamed).
+        """
+        cancelled = cancelled or threading.Event()
+        member = self.key_pool.acquire()
+        if member.api_key == config.FREE_TIER_API_KEY:
+            # The house key is shared by every free-tier user; wait for our turn
+            try:
+                await get_house_scheduler().acquire(self.user_id or "anonymous", priority,
+                                                    cost=estimate_tokens(len(prompt.encode())))
+            except (HouseKeyBusyError, asyncio.CancelledError):
+                member.breaker.abandon()
+                raise
+            # Only calls that actually go out on the house key count against the free tier
+            if self.user_id:
+                config.increment_api_usage(self.user_id)
+        loop = asyncio.get_running_loop()
+        # The client's own deadline, so an abandoned call can't hold a worker thread forever
+        request_options = {"timeout": self.call_timeout}
+        if candidate_count > 1:
+            call = partial(member.model.generate_content, prompt, request_options=request_options,
+                           generation_config={"candidate_count": candidate_count})
+        elif on_chunk is None:
+            call = partial(member.model.generate_content, prompt, request_options=request_options)
+        else:
+            call = partial(_stream_content, member.model, prompt, loop, on_chunk, cancelled, request_options,
+                           contextvars.copy_context())
+        started = loop.create_future()
+        future = loop.run_in_executor(model_executor, _run_call, call, loop, started, cancelled)
+        self.pending_calls.add(future)
+        started_at = None
         try:
-            # Configure genai temporarily for validation
-            genai.configure(api_key=self.api_key)
-            
-            # Try a simple generation with minimal tokens to validate the key
-            test_model = genai.GenerativeModel('gemini-1.5-flash')
-            response = test_model.generate_content("Hello")
-            
-            # If we get here, the key is valid
-            return True
+            # Waiting for a free worker is local saturation, not the key's latency:
+            # the deadline, stats and breaker only cover the remote call
+            await asyncio.wait({started, future}, timeout=self.queue_max_wait,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not started.done():
+                if future.cancelled():
+                    raise asyncio.CancelledError()
+                cancelled.set()
+                future.cancel()
+                member.breaker.abandon()
+                raise ModelBusyError(f"No free model worker within {self.queue_max_wait}s")
+            started_at = member.stats.begin()
+            response = await asyncio.wait_for(future, timeout=self.call_timeout)
+        except asyncio.TimeoutError:
+            cancelled.set()
+            member.stats.end(started_at, "timeout")
+            member.breaker.record_failure("timeout")
+            raise TimeoutError(f"Gemini call timed out after {self.call_timeout}s")
+        except asyncio.CancelledError:
+            cancelled.set()
+            # Shutting down isn't the key's fault
+            if started_at is not None:
+                member.stats.cancel()
+            member.breaker.abandon()
+            raise
+        except ModelBusyError:
+            raise
         except Exception as e:
-            print(f"API key validation error: {e}")
-            return False
+            kind = classify_error(e)
+            member.stats.end(started_at, kind)
+            member.breaker.record_failure(kind)
+            # The first real call doubles as the key check
+            if kind == "auth":
+                key_validation_cache.mark(member.api_key, False)
+                self.key_pool.discard(member.api_key)
+                if not self.key_pool:
+                    self.api_key_valid = False
+                    print("WARNING: Gemini rejected the API key - bot will use fallback responses")
+            raise
+        finally:
+            self.pending_calls.discard(future)
+        
+        member.stats.end(started_at)
+        member.breaker.record_success()
+        key_validation_cache.mark(member.api_key, True)
+        return response
+    
+    def cancel_pending_calls(self):
+        """Abandon in-flight model calls; queued ones never start"""
+        self.context_window.cancel()
+        for future in list(self.pending_calls):
+            future.cancel()
+        self.pending_calls.clear()
+    
+    async def _summarize_history(self, previous_summary, lines):
+        """Fold older messages into the running conversation summary"""
+        if not self.api_key_valid:
+            # No model - keep who was talking and what about
+            speakers = sorted({self._extract_user(line) for line in lines})
+            themes = self._extract_theme_words(lines) if len(lines) >= 3 else []
+            note = f"{', '.join(speakers)} chatted" + (f" about {', '.join(themes)}" if themes else "")
+            return f"{previous_summary} {note}.".strip()[-600:]
+        
+        prompt = (
+            f"Update this running summary of a Telegram chat about {self.super_context}.\n\n"
+            f"Summary so far:\n{previous_summary or '(none)'}\n\n"
+            "New messages:\n" + "\n".join(lines) + "\n\n"
+            "Write the updated summary in at most 60 words. Keep names, questions "
+            "still open and anything people said about themselves. Plain text only."
+        )
+        response = await self._generate(prompt)
+        return response.text.strip()
 
     def _extract_persona_from_context(self, context):
         """Extract name and role from the super context"""
@@ -193,7 +450,7 @@ class GeminiAI:
             """
             
             try:
-                intro_response = self.model.generate_content(introduction_prompt)
+                intro_response = await self._generate(introduction_prompt)
                 intro_message = intro_response.text.strip()
                 
                 # Add to history
@@ -209,18 +466,19 @@ class GeminiAI:
                 return f"Hey! I'm {self.persona_name}, {self.persona_role}. What do you think about the industry these days? {random.choice(self.emojis)}"
         
         # For group chats, use the existing logic
+        dm_hint = 'Don\'t use phrases like "Hey everyone" since this is a direct message with just one person.' if not is_group_chat else ''
         prompt = f"""
         I need to start a very brief conversation in a {'Telegram group' if is_group_chat else 'one-on-one direct message'} about:
         {self.super_context}
         
         Generate an extremely short, casual opening message (MAXIMUM 7-8 words).
         Sound exactly like someone texting quickly on their phone.
-        {'Don\'t use phrases like "Hey everyone" since this is a direct message with just one person.' if not is_group_chat else ''}
+        {dm_hint}
         Don't introduce the topic explicitly - just start naturally.
         """
         
         try:
-            response = self.model.generate_content(prompt)
+            response = await self._generate(prompt)
             message = response.text.strip()
             
             # Truncate if too long
@@ -247,45 +505,43 @@ class GeminiAI:
             else:
                 return f"Hey! I'm {self.persona_name}, {self.persona_role}. What do you think about the industry these days? {random.choice(self.emojis)}"
 
+    def _message_content(self, message):
+        """Message text without the sender prefix"""
+        return message.split(': ', 1)[1] if ': ' in message else message
+
+    def _signals(self, message):
+        """Signal categories found in a message (one cached lexicon pass)"""
+        return self.lexicon.scan(self._message_content(message))
+
     def _detect_message_context(self, messages):
         """Detect the context/tone of recent messages"""
         # Look at the last 3 messages
-        recent = " ".join([m.lower() for m in messages[-3:]])
-        
-        # Core contexts
-        has_farewell = any(word in recent for word in self.farewells)
-        has_greeting = any(word in recent for word in self.greetings)
-        
-        # Additional contexts
-        has_joke = any(signal in recent for signal in self.joke_signals)
-        has_agreement = any(signal in recent for signal in self.agreement_signals) 
-        has_disagreement = any(signal in recent for signal in self.disagreement_signals)
-        
-        # Question detection - more comprehensive
-        has_question = '?' in recent or any(q in recent for q in [
-            'what', 'how', 'why', 'when', 'where', 'who', 'which', 
-            'mean', 'meaning', 'explain', 'tell me', 'definition'
-        ])
+        signals = set()
+        has_question_mark = False
+        for message in messages[-3:]:
+            signals.update(self._signals(message))
+            has_question_mark = has_question_mark or '?' in message
         
         return {
-            'farewell': has_farewell,
-            'greeting': has_greeting,
-            'joke': has_joke,
-            'question': has_question,
-            'agreement': has_agreement,
-            'disagreement': has_disagreement
+            'farewell': 'farewell' in signals,
+            'greeting': 'greeting' in signals,
+            'joke': 'joke' in signals,
+            'question': has_question_mark or 'question' in signals,
+            'agreement': 'agreement' in signals,
+            'disagreement': 'disagreement' in signals
         }
 
     def _is_valid_response(self, response, recent_context, contexts):
         """Validate if a response makes sense in the current context"""
         response_lower = response.lower()
+        signals = self.lexicon.scan(response_lower)
         
         # Don't reply with agreement to a farewell
-        if contexts['farewell'] and any(word in response_lower for word in self.agreement_signals):
+        if contexts['farewell'] and 'agreement' in signals:
             return False
         
         # Don't say bye if no one is leaving
-        if not contexts['farewell'] and any(word in response_lower for word in self.farewells):
+        if not contexts['farewell'] and 'farewell' in signals:
             return False
         
         # Avoid repetitive responses
@@ -396,12 +652,7 @@ class GeminiAI:
 
     def _is_greeting_only(self, message):
         """Check if a message is just a greeting"""
-        if ': ' in message:
-            content = message.split(': ', 1)[1].lower()
-        else:
-            content = message.lower()
-        
-        return any(greeting in content for greeting in self.greetings) and len(content) < 20
+        return 'greeting' in self._signals(message) and len(self._message_content(message)) < 20
 
     def _extract_user(self, message):
         """Extract username from a message"""
@@ -422,15 +673,7 @@ class GeminiAI:
 
     def _detect_question(self, message):
         """Detect if a message contains a question"""
-        if ': ' in message:
-            content = message.split(': ', 1)[1].lower()
-        else:
-            content = message.lower()
-        
-        return '?' in content or any(q in content for q in [
-            'what', 'how', 'why', 'when', 'where', 'who', 'which', 
-            'mean', 'meaning', 'explain', 'tell me', 'definition'
-        ])
+        return '?' in self._message_content(message) or 'question' in self._signals(message)
 
     def _track_question(self, message, response=None):
         """Track questions and their answers"""
@@ -452,34 +695,112 @@ class GeminiAI:
 
     def _detect_identity_question(self, message):
         """Detect if someone is asking who the bot is"""
-        if ': ' in message:
-            content = message.split(': ', 1)[1].lower()
-        else:
-            content = message.lower()
-        
-        identity_patterns = [
-            "who are you", "who is this", "who r u", "who u", "your name", 
-            "what's your name", "whats ur name", "introduce yourself", "who am i talking to",
-            "aap kaun ho", "tum kaun ho", "apka naam", "tumhara naam", "kon hai tu"
-        ]
-        
-        return any(pattern in content for pattern in identity_patterns)
+        return 'identity' in self._signals(message)
 
     def _detect_hinglish(self, message):
         """Detect if a message contains Hinglish"""
-        if ': ' in message:
-            content = message.split(': ', 1)[1].lower()
-        else:
-            content = message.lower()
+        return 'hinglish' in self._signals(message)
+
+    def _clean_part(self, part):
+        """Strip one "|"-separated part of a response; None if empty"""
+        part = part.strip()
+        
+        # Skip empty parts
+        if not part:
+            return None
         
-        return any(pattern in content for pattern in self.hinglish_patterns)
+        # Remove any name prefixes
+        part = re.sub(r'^[A-Za-z]+:\s+', '', part)
+        
+        # Ensure part is not too long
+        words = part.split()
+        if len(words) > 11:
+            part = " ".join(words[:11])
+        return part
 
-    async def generate_response(self, message_history, is_group_chat=True, message_id_to_reply=None):
-        """Generate a response based on chat history and super context"""
-        # Track API usage for free tier if applicable
-        if self.using_free_tier and self.user_id and self.api_key_valid:
-            config.increment_api_usage(self.user_id)
+    def _finish_part(self, part, message_history, contexts):
+        """Clean, validate and decorate one "|"-separated part; None if rejected"""
+        part = self._clean_part(part)
+        
+        # Validate the response
+        if not part or not self._is_valid_response(part, message_history, contexts):
+            return None
         
+        part = self._decorate_part(part)
+        self.last_responses.append(part.lower())
+        return part
+
+    def _decorate_part(self, part):
+        """Sometimes add an emoji, like a person texting would"""
+        # Increased emoji chance to 45%
+        if random.random() < 0.45 and not any(emoji in part for emoji in self.emojis):
+            # Position: 0 = at end, 1 = at beginning, 2 = in middle
+            emoji_position = random.choices([0, 1, 2], weights=[70, 10, 20])[0]
+            emoji = random.choice(self.emojis)
+            
+            if emoji_position == 0:
+                part = f"{part} {emoji}"
+            elif emoji_position == 1:
+                part = f"{emoji} {part}"
+            else:
+                words = part.split()
+                if len(words) > 3:
+                    mid = len(words) // 2
+                    part = " ".join(words[:mid]) + f" {emoji} " + " ".join(words[mid:])
+        return part
+
+    @staticmethod
+    def _candidate_texts(response):
+        """Text of every candidate in a response; [] if all were blocked or empty"""
+        texts = []
+        for candidate in getattr(response, 'candidates', None) or []:
+            try:
+                text = "".join(part.text for part in candidate.content.parts)
+            except (AttributeError, ValueError):
+                continue
+            if text.strip():
+                texts.append(text)
+        return texts
+
+    def _rank_candidates(self, texts, message_history, contexts):
+        """Cleaned parts of the best candidate by the validators and a diversity score
+
+        A candidate scores the share of its parts that pass validation plus
+        how different its parts are from our recent replies and each other.
+        Returns [] if no candidate has a valid part.
+        """
+        best_parts, best_score = [], None
+        for text in texts:
+            parts = [part for part in (self._clean_part(part) for part in text.split('|')) if part]
+            valid = [part for part in parts if self._is_valid_response(part, message_history, contexts)][:2]
+            if not valid:
+                continue
+            similarities = [max([self._similarity(part.lower(), recent) for recent in self.last_responses[-3:]] or [0])
+                            for part in valid]
+            if len(valid) > 1:
+                similarities.append(self._similarity(valid[0], valid[1]))
+            score = len(valid) / len(parts) + 1 - sum(similarities) / len(similarities)
+            if best_score is None or score > best_score:
+                best_parts, best_score = valid, score
+        
+        finished = []
+        for part in best_parts:
+            part = self._decorate_part(part)
+            self.last_responses.append(part.lower())
+            finished.append(part)
+        return finished
+
+    async def generate_response(self, message_history, is_group_chat=True, message_id_to_reply=None, on_part=None,
+                                on_generate=None, message_ids=None):
+        """Generate a response based on chat history and super context
+
+        If on_part is given, generated parts are passed to it as
+        on_part(message, should_reply) as soon as each one is complete, and
+        the result's "streamed" count says how many messages went that way.
+        on_generate() is called once the model is going to be asked, i.e.
+        not for messages that are ignored or answered locally or from cache.
+        message_ids, if known, are the Telegram ids of message_history's lines.
+        """
         # Check if API key is valid before attempting to generate
         if not self.api_key_valid:
             print("Using fallback response due to invalid API key")
@@ -502,7 +823,8 @@ class GeminiAI:
             response = random.choice(generic_responses)
             if random.random() < 0.45:
                 response += f" {random.choice(self.emojis)}"
-                
+            
+            self.local_responder.record("fallback")
             return {
                 "messages": [response],
                 "should_reply": message_id_to_reply is not None and random.random() < 0.3
@@ -523,18 +845,21 @@ class GeminiAI:
         # Update conversation topic
         self._update_conversation_topic(message_history)
         
-        chat_context = "\n".join(message_history)
+        # Recent messages verbatim within the token budget; older ones live in the summary
+        self.context_window.observe(message_history, message_ids)
+        chat_context = self.context_window.recent_messages(message_history)
         
         # Add session context factors to the prompt - THIS WAS MISSING
-        session_context = ""
+        session_notes = []
         if is_repeat:
-            session_context += "\nIMPORTANT: This message is very similar to one seen earlier in the session.\n"
+            session_notes.append("IMPORTANT: This message is very similar to one seen earlier in the session.")
         if greeting_count > 1:
-            session_context += f"\nIMPORTANT: This user has greeted {greeting_count} times during this session.\n"
+            session_notes.append(f"IMPORTANT: This user has greeted {greeting_count} times during this session.")
         if is_question and previous_answer:
-            session_context += "\nIMPORTANT: This question is similar to one already answered in this session.\n"
+            session_notes.append("IMPORTANT: This question is similar to one already answered in this session.")
         if len(self.topic_history) > 1:
-            session_context += f"\nTopic evolution in this session: {' → '.join(self.topic_history[-3:])}\n"
+            session_notes.append(f"Topic evolution in this session: {' → '.join(self.topic_history[-3:])}")
+        session_context = "\n".join(session_notes)
         
         # Enhanced context detection
         contexts = self._detect_message_context(message_history)
@@ -544,8 +869,8 @@ class GeminiAI:
         is_empty_response = False
         
         if ': ' in last_message:
-            last_content = last_message.split(': ', 1)[1].lower()
-            is_empty_response = any(empty in last_content for empty in self.empty_responses) and len(last_content) < 15
+            last_content = self._message_content(last_message)
+            is_empty_response = 'acknowledgment' in self._signals(last_message) and len(last_content) < 15
         
         # Determine response type for logging
         response_type = "general"
@@ -615,137 +940,196 @@ class GeminiAI:
         
         context_guidance = "\n".join(context_instructions)
         
-        # Build the prompt with improved conversational guidance
-        prompt = f"""
-        You're in a {'Telegram group chat' if is_group_chat else 'one-on-one Telegram conversation'} as {self.persona_name}.
-        
-        You are {self.persona_name}, {self.persona_role}.
-        
-        The conversation is about: {self.conversation_topic}
-        
-        Recent messages:
-        {chat_context}
-        
-        {session_context}
+        # Trivial messages are answered (or ignored) locally, per LOCAL_REPLY_POLICY
+        local_kind = None
+        if 'question' not in self._signals(last_message) and not is_identity_question:
+            if is_simple_greeting:
+                local_kind = "greeting"
+            elif is_empty_response:
+                local_kind = "acknowledgment"
+            elif self.local_responder.is_emoji_only(self._message_content(last_message)):
+                local_kind = "emoji_only"
+        action = self.local_responder.decide(local_kind, is_group_chat)
+        if action == "ignore":
+            self.local_responder.record("ignored")
+            return {"messages": [], "should_reply": False}
+        if action == "local":
+            if local_kind == "greeting" and greeting_count > 1:
+                local_kind = "greeting_repeat"
+            sender = self._extract_user(last_message)
+            emojis = (self.use_learning and self.learning_manager.get_preferred_emojis(response_type)) or self.emojis
+            message = self.local_responder.reply(local_kind, self._message_content(last_message),
+                                                 "" if sender == "User" else sender, emojis,
+                                                 self.last_responses[-3:])
+            self.last_responses.append(message.lower())
+            self._log_response(f"local_{response_type}", last_message, [message], context_data)
+            self.local_responder.record("local")
+            should_reply = (contexts['greeting'] and greeting_count <= 1) or random.random() < 0.3
+            return {
+                "messages": [message],
+                "should_reply": should_reply and message_id_to_reply is not None
+            }
         
-        {context_guidance}
-        """
+        # Questions asked before (in this or an earlier session) can skip the model
+        cache_key = None
+        # Only questions that stand on their own; "why?" or "what do you mean?" depend on the chat
+        if (self.response_cache and not is_repeat and not previous_answer
+                and (is_identity_question or (is_question and is_cacheable(last_message)))):
+            # Who the persona is doesn't depend on the topic
+            topic = "" if is_identity_question else self.conversation_topic
+            cache_key = self.response_cache.make_key(self.super_context, last_message, topic)
+            cached = await self.response_cache.lookup(cache_key)
+            if cached:
+                parts = [part for part in self.response_cache.vary(cached, self.emojis)
+                         if self._is_valid_response(part, message_history, contexts)]
+                if parts:
+                    self.last_responses.extend(part.lower() for part in parts)
+                    if is_question:
+                        self._track_question(last_message, parts[0])
+                    self._log_response(f"cached_{response_type}", last_message, parts, context_data)
+                    self.local_responder.record("cached")
+                    return {
+                        "messages": parts[:2],
+                        "should_reply": message_id_to_reply is not None
+                    }
         
         # Check for Hinglish in the last message
         has_hinglish = False
         if message_history:
             has_hinglish = self._detect_hinglish(message_history[-1])
         
-        # Add Hinglish awareness to the prompt if detected
-        if has_hinglish:
-            prompt += """
-            IMPORTANT: The person is using Hinglish (Hindi-English mixed language).
-            You can occasionally mix in simple Hindi words in your reply.
-            For example: "Haan, tech industry mein bahut opportunities hain!"
-            Keep it mostly English with just a few Hindi words mixed in.
-            """
-        
         # Add learned insights if enabled
+        learned_insights = ""
         if self.use_learning:
             learned_insights = self._get_learned_insights(self.conversation_topic, contexts, is_question, message_history)
-            if learned_insights:
-                prompt += f"\n{learned_insights}\n"
-        
-        prompt += """
-        Generate 1-2 SHORT, natural responses (5-15 words each maximum).
-        Each response should be on its own line, separated by a "|" character.
-        
-        Write exactly like a real person texting on their phone:
-        - Casual and conversational
-        - Use contractions (I'm, you're, doesn't)
-        - Occasionally use abbreviations (tbh, lol, etc.)
-        - Sound friendly but not overly enthusiastic
-        - React naturally to what the other person just said
-        - Don't sound like you're following a script
-        - Be adaptive - if they change topics, go with it
-        
-        Examples of natural responses:
-        "Yeah, been crazy busy with interviews lately."
-        "Tech jobs are so competitive these days!"
-        "I'm interested in ML. What about you?"
-        "Lol, that's exactly what I thought too"
-        
-        Remember: Sound like a real human having a casual conversation.
-        """
         
-        max_attempts = 3
+        # Fill the session's precompiled prompt
+        prompt = self.prompt_builder.build(
+            is_group_chat,
+            self.conversation_topic,
+            chat_context,
+            session_context=session_context,
+            guidance=context_guidance,
+            hinglish=has_hinglish,
+            learned_insights=learned_insights,
+            summary=self.context_window.summary
+        )
+        # Store the answer for reuse only while the chat has no rolling summary yet. The
+        # recent lines are in every prompt, so this doesn't prove the answer ignores them;
+        # the question itself was already checked to stand on its own (is_cacheable)
+        cacheable_reply = cache_key is not None and not self.context_window.summary
+        
+        # DMs and direct questions jump the shared house-key queue
+        priority = "high" if not is_group_chat or is_question or is_identity_question else "normal"
+        
+        # Determine if we should reply directly to the last message
+        # Questions and direct mentions more likely get a direct reply.
+        # Decided up front so streamed parts can go out as soon as they're ready
+        should_reply = (is_question or 
+                        contexts['question'] or 
+                        (contexts['greeting'] and greeting_count <= 1) or
+                        random.random() < 0.3)  # 30% chance to reply to any message
+        should_reply = should_reply and message_id_to_reply is not None
+        streaming = on_part is not None and config.GEMINI_STREAMING
+        
+        async def finish(clean_parts, streamed=0):
+            # If this was a question, record our answer
+            if is_question and not previous_answer:
+                self._track_question(last_message, clean_parts[0])
+            
+            # Log this response
+            self._log_response(response_type, last_message, clean_parts, context_data)
+            self.local_responder.record("model")
+            
+            if cacheable_reply:
+                await self.response_cache.store(cache_key, clean_parts[:2])
+            
+            return {
+                "messages": clean_parts[:2],  # Limit to max 2 responses
+                "should_reply": should_reply,
+                "streamed": streamed
+            }
+        
+        max_attempts = self.retry_policy.max_attempts
+        # The first call asks for a single response (streamed when possible);
+        # only if none of it is usable does the next ask for several candidates
+        # at once and rank them locally, instead of regenerating one at a time
+        use_candidates = False
+        if on_generate:
+            on_generate()
         for attempt in range(max_attempts):
+            # Stop retrying once the key has been rejected
+            if not self.api_key_valid:
+                break
+            
+            # Parts are separated by "|"; send each one as soon as the next starts.
+            # Each attempt has its own buffer, and chunks from an attempt that
+            # was given up on (still arriving from its worker thread) are dropped
+            emitted = []  # parts already handed to on_part
+            tail = [""]
+            cancelled = threading.Event()
+            def on_chunk(text, emitted=emitted, tail=tail, cancelled=cancelled):
+                if cancelled.is_set():
+                    return
+                *complete, tail[0] = (tail[0] + text).split('|')
+                for part in complete:
+                    part = self._finish_part(part, message_history, contexts)
+                    if part and len(emitted) < 2:
+                        emitted.append(part)
+                        on_part(part, should_reply)
+            
             try:
-                response = self.model.generate_content(prompt)
-                full_text = response.text.strip()
-                
-                # Split the response into separate messages
-                message_parts = full_text.split('|')
-                
-                # Clean up and validate each part
-                clean_parts = []
-                for i, part in enumerate(message_parts):
-                    part = part.strip()
-                    
-                    # Skip empty parts
-                    if not part:
-                        continue
-                    
-                    # Remove any name prefixes
-                    part = re.sub(r'^[A-Za-z]+:\s+', '', part)
-                    
-                    # Ensure part is not too long
-                    words = part.split()
-                    if len(words) > 11:
-                        part = " ".join(words[:11])
+                if use_candidates:
+                    response = await self._generate(prompt, priority=priority,
+                                                    candidate_count=config.GEMINI_CANDIDATE_COUNT)
+                    texts = self._candidate_texts(response)
+                    self.candidates_generated += len(texts)
+                    clean_parts = self._rank_candidates(texts, message_history, contexts)
+                elif not streaming:
+                    response = await self._generate(prompt, priority=priority)
+                    text = "|".join(self._candidate_texts(response)[:1])
+                    clean_parts = [part for part in (self._finish_part(part, message_history, contexts)
+                                                     for part in text.split('|')) if part]
+                else:
+                    await self._generate(prompt, priority=priority, on_chunk=on_chunk, cancelled=cancelled)
                     
-                    # Validate the response
-                    if self._is_valid_response(part, message_history, contexts):
-                        # Increased emoji chance to 45%
-                        if random.random() < 0.45 and not any(emoji in part for emoji in self.emojis):
-                            # Position: 0 = at end, 1 = at beginning, 2 = in middle
-                            emoji_position = random.choices([0, 1, 2], weights=[70, 10, 20])[0]
-                            emoji = random.choice(self.emojis)
-                            
-                            if emoji_position == 0:
-                                part = f"{part} {emoji}"
-                            elif emoji_position == 1:
-                                part = f"{emoji} {part}"
-                            else:
-                                words = part.split()
-                                if len(words) > 3:
-                                    mid = len(words) // 2
-                                    part = " ".join(words[:mid]) + f" {emoji} " + " ".join(words[mid:])
-                        
+                    # Streamed parts are already done; the last one has no "|" after it
+                    clean_parts = list(emitted)
+                    part = self._finish_part(tail[0], message_history, contexts)
+                    if part:
                         clean_parts.append(part)
-                        self.last_responses.append(part.lower())
                 
                 # If we have valid responses, track questions and return
                 if clean_parts:
-                    # If this was a question, record our answer
-                    if is_question and not previous_answer:
-                        self._track_question(last_message, clean_parts[0])
-                    
-                    # Log this response
-                    self._log_response(response_type, last_message, clean_parts, context_data)
-                    
-                    # Determine if we should reply directly to the last message
-                    # Questions and direct mentions more likely get a direct reply
-                    should_reply = (is_question or 
-                                    contexts['question'] or 
-                                    (contexts['greeting'] and greeting_count <= 1) or
-                                    random.random() < 0.3)  # 30% chance to reply to any message
-                    
-                    return {
-                        "messages": clean_parts[:2],  # Limit to max 2 responses
-                        "should_reply": should_reply and message_id_to_reply is not None
-                    }
+                    return await finish(clean_parts, streamed=len(emitted))
                 
-                # If we're here, none of the responses were valid, so try again    
-                print(f"Attempt {attempt+1}: No valid responses, trying again...")
+                # Every candidate was blocked, empty or rejected already; don't spend more calls
+                if use_candidates:
+                    self.candidates_exhausted += 1
+                    print(f"Attempt {attempt+1}: No valid candidates, using fallback")
+                    break
+                print(f"Attempt {attempt+1}: No valid responses, asking for {config.GEMINI_CANDIDATE_COUNT} candidates...")
+                use_candidates = True
                 
             except Exception as e:
-                print(f"Error generating response (attempt {attempt+1}): {e}")
+                # Nothing more from this attempt goes out
+                cancelled.set()
+                
+                # Parts already sent can't be taken back; finish with those
+                if emitted:
+                    print(f"Error finishing streamed response: {e}")
+                    return await finish(list(emitted), streamed=len(emitted))
+                
+                # Only transient failures are worth another call; quota, auth,
+                # safety blocks and an open circuit go straight to the fallback
+                kind = classify_error(e)
+                print(f"Error generating response (attempt {attempt+1}, {kind}): {e}")
+                # A quota or auth error only rules out that key; try another
+                if kind in ("quota", "auth") and len(self.key_pool) > 1 and attempt + 1 < max_attempts:
+                    continue
+                if not self.retry_policy.should_retry(kind, attempt):
+                    break
+                await asyncio.sleep(self.retry_policy.delay(attempt))
         
         # If all attempts failed, provide context-appropriate fallback responses
         fallback_response = []
@@ -778,6 +1162,10 @@ class GeminiAI:
         
         # Log fallback response
         self._log_response(f"fallback_{response_type}", last_message, fallback_response, context_data)
+        self.local_responder.record("fallback")
+        
+        # Reply directly to questions, same as for generated responses
+        should_reply = is_question or contexts['question']
         
         # Update the fallback response to include the reply flag
         return {
@@ -804,11 +1192,11 @@ class GeminiAI:
         }
         
         # Add to log
-        self.response_log.append(log_entry)
+        self.session_log.append(log_entry)
     
     def get_session_analytics(self):
         """Generate analytics about the session responses"""
-        total_responses = len(self.response_log)
+        total_responses = len(self.session_log)
         if (total_responses == 0):
             return {
                 "status": "No responses logged in this session",
@@ -819,37 +1207,12 @@ class GeminiAI:
         duration = datetime.now() - self.session_start_time
         duration_minutes = duration.total_seconds() / 60
         
-        # Count response types
-        response_types = {}
-        for entry in self.response_log:
-            response_type = entry["response_type"]
-            if (response_type in response_types):
-                response_types[response_type] += 1
-            else:
-                response_types[response_type] = 1
-        
-        # Count unique users responded to
-        unique_users = set(entry["user"] for entry in self.response_log)
-        
-        # Get most common topics
-        topic_counts = {}
-        for entry in self.response_log:
-            topic = entry["topic"]
-            if (topic in topic_counts):
-                topic_counts[topic] += 1
-            else:
-                topic_counts[topic] = 1
-        
-        sorted_topics = sorted(topic_counts.items(), key=lambda x: x[1], reverse=True)
-        top_topics = sorted_topics[:5] if len(sorted_topics) > 5 else sorted_topics
+        # Counted as entries were logged
+        response_types = dict(self.session_log.response_types)
+        unique_users = self.session_log.users
+        top_topics = self.session_log.topics.most_common(5)
         
-        # Analyze response length
-        total_words = 0
-        for entry in self.response_log:
-            for response in entry["bot_responses"]:
-                total_words += len(response.split())
-        
-        avg_words_per_response = total_words / total_responses if total_responses > 0 else 0
+        avg_words_per_response = self.session_log.total_words / total_responses if total_responses > 0 else 0
         
         return {
             "session_duration_minutes": round(duration_minutes, 2),
@@ -860,37 +1223,52 @@ class GeminiAI:
             "top_topics": top_topics,
             "average_words_per_response": round(avg_words_per_response, 2),
             "emoji_usage_percentage": self._calculate_emoji_usage(),
-            "full_log": self.response_log
+            "response_cache": self.response_cache.stats() if self.response_cache else {},
+            "prompt_sizes": self.prompt_builder.stats(),
+            "context": self.context_window.stats(),
+            "key_pool": self.key_pool.status(),
+            "reply_tiers": self.local_responder.stats(),
+            "candidates": {
+                "generated": self.candidates_generated,
+                "all_rejected": self.candidates_exhausted
+            },
+            "session_log_file": self.session_log.spill_path,
+            "recent_log": list(self.session_log.tail)
         }
     
     def _calculate_emoji_usage(self):
         """Calculate percentage of responses that used emojis"""
-        if not self.response_log:
+        if not len(self.session_log):
             return 0
         
-        responses_with_emoji = 0
-        for entry in self.response_log:
-            for response in entry["bot_responses"]:
-                if any(emoji in response for emoji in self.emojis):
-                    responses_with_emoji += 1
-                    break
-        
-        return round((responses_with_emoji / len(self.response_log)) * 100, 2)
+        return round((self.session_log.with_emoji / len(self.session_log)) * 100, 2)
     
     def save_session_log(self, filename=None):
-        """Save the session log to a JSON file"""
+        """Finalize the session log: a JSON summary next to the responses already spilled to disk
+
+        Reads the whole log file back, so async callers should run it in an executor.
+        """
+        spill_path = self.session_log.spill_path
         if not filename:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            topic_slug = re.sub(r'[^\w]', '_', self.super_context)[:20]
-            filename = f"session_{topic_slug}_{timestamp}.json"
+            if spill_path:
+                filename = os.path.splitext(os.path.basename(spill_path))[0] + ".json"
+            else:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                topic_slug = re.sub(r'[^\w]', '_', self.super_context)[:20]
+                filename = f"session_{topic_slug}_{timestamp}.json"
         
+        # Responses were written as they arrived; only a memory-only log embeds them
+        self.session_log.close()
         log_data = {
             "super_context": self.super_context,
             "session_start": self.session_start_time.strftime("%Y-%m-%d %H:%M:%S"),
             "session_end": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "analytics": self.get_session_analytics(),
-            "responses": self.response_log
+            "analytics": self.get_session_analytics()
         }
+        if spill_path:
+            log_data["responses_file"] = os.path.basename(spill_path)
+        else:
+            log_data["responses"] = list(self.session_log.tail)
         
         # If using MongoDB
         if os.environ.get('MONGODB_URI'):
@@ -898,11 +1276,22 @@ class GeminiAI:
                 from db_handler import MongoDBHandler
                 db_handler = MongoDBHandler()
                 log_id = db_handler.save_session_log(log_data)
-                print(f"Session responses saved to MongoDB with ID: {log_id}")
                 
-                # If learning is enabled, learn from this session
+                # One pass over the log file: store each response and, if learning
+                # is enabled, learn from it on the way through
+                patterns_learned = 0
+                def entries():
+                    nonlocal patterns_learned
+                    for entry in self.session_log.entries():
+                        if self.use_learning:
+                            patterns_learned += self.learning_manager.learn_from_entry(entry)
+                        yield entry
+                saved = db_handler.save_session_responses(log_id, entries())
+                print(f"Session log saved to MongoDB with ID: {log_id} ({saved} responses)")
+                
                 if self.use_learning:
-                    patterns_learned = self.learning_manager.learn_from_session(self.response_log)
+                    if patterns_learned:
+                        self.learning_manager.save_learned_patterns()
                     print(f"Learned {patterns_learned} new patterns from this session")
                 
                 return log_id
@@ -919,7 +1308,7 @@ class GeminiAI:
         
         # If learning is enabled, learn from this session
         if self.use_learning:
-            patterns_learned = self.learning_manager.learn_from_session(self.response_log)
+            patterns_learned = self.learning_manager.learn_from_session(self.session_log.entries())
             print(f"Learned {patterns_learned} new patterns from this session")
         
         return filepath
@@ -1160,61 +1549,66 @@ class LearningManager:
     
     def learn_from_session(self, session_log):
         """Extract patterns from a completed session"""
-        if not session_log:
-            return 0
-        
         patterns_learned = 0
         
         # Process each logged response
         for entry in session_log:
-            if "bot_responses" not in entry or not entry["bot_responses"]:
-                continue
-                
-            topic = entry.get("topic", "").lower()
-            response_type = entry.get("response_type", "")
-            user = entry.get("user", "")
-            user_message = entry.get("user_message", "")
-            bot_responses = entry.get("bot_responses", [])
-            
-            # Only learn from substantial topics
-            if len(topic) < 3:
-                continue
-            
-            # Store successful responses for topics
-            if topic and bot_responses:
-                for resp in bot_responses:
-                    if len(resp) > 3:  # Only learn substantial responses
-                        self.learned_patterns["topic_responses"][topic].append(resp)
-                patterns_learned += 1
-            
-            # Track user interaction patterns
-            if user and response_type:
-                self.learned_patterns["user_preferences"][user][response_type] += 1
-                patterns_learned += 1
-            
-            # Remember question/answer pairs
-            if response_type == "question_answer" and user_message and bot_responses:
-                if "?" in user_message:
-                    question = user_message.split(":")[-1].strip() if ":" in user_message else user_message
-                    question = question.lower()
-                    
-                    # Only store if we don't already have this question or if the new answer is better
-                    if (question not in self.learned_patterns["question_answers"] or 
-                            len(bot_responses[0]) < len(self.learned_patterns["question_answers"][question])):
-                        self.learned_patterns["question_answers"][question] = bot_responses[0]
-                        patterns_learned += 1
-            
-            # Learn emoji usage patterns
+            patterns_learned += self.learn_from_entry(entry)
+        
+        # Save the updated learned patterns
+        if patterns_learned:
+            self.save_learned_patterns()
+        
+        return patterns_learned
+    
+    def learn_from_entry(self, entry):
+        """Extract patterns from one logged response (call save_learned_patterns() after)"""
+        if "bot_responses" not in entry or not entry["bot_responses"]:
+            return 0
+        
+        patterns_learned = 0
+        topic = entry.get("topic", "").lower()
+        response_type = entry.get("response_type", "")
+        user = entry.get("user", "")
+        user_message = entry.get("user_message", "")
+        bot_responses = entry.get("bot_responses", [])
+        
+        # Only learn from substantial topics
+        if len(topic) < 3:
+            return 0
+        
+        # Store successful responses for topics
+        if topic and bot_responses:
             for resp in bot_responses:
-                # Extract emojis from the response
-                emojis_used = [c for c in resp if c in "😊👍😂🔥💯👏😁🤣😎🙂😉🤩🤔👀😅🤨🧐😮😯🤷‍♂️🤷‍♀️👆💪💻🚀📱🤖💡⚡✨🌟💰📈🎯🔍💅🙌🫡🫠🤌✌️🫂🤝🙏🎉🔄❗❓⁉️‼️💭💬📢👇👈👉👋"]
-                if emojis_used:
-                    for emoji in emojis_used:
-                        self.learned_patterns["emoji_patterns"][response_type][emoji] += 1
+                if len(resp) > 3:  # Only learn substantial responses
+                    self.learned_patterns["topic_responses"][topic].append(resp)
+            patterns_learned += 1
+        
+        # Track user interaction patterns
+        if user and response_type:
+            self.learned_patterns["user_preferences"][user][response_type] += 1
+            patterns_learned += 1
+        
+        # Remember question/answer pairs
+        if response_type == "question_answer" and user_message and bot_responses:
+            if "?" in user_message:
+                question = user_message.split(":")[-1].strip() if ":" in user_message else user_message
+                question = question.lower()
+                
+                # Only store if we don't already have this question or if the new answer is better
+                if (question not in self.learned_patterns["question_answers"] or 
+                        len(bot_responses[0]) < len(self.learned_patterns["question_answers"][question])):
+                    self.learned_patterns["question_answers"][question] = bot_responses[0]
                     patterns_learned += 1
         
-        # Save the updated learned patterns
-        self.save_learned_patterns()
+        # Learn emoji usage patterns
+        for resp in bot_responses:
+            # Extract emojis from the response
+            emojis_used = [c for c in resp if c in "😊👍😂🔥💯👏😁🤣😎🙂😉🤩🤔👀😅🤨🧐😮😯🤷‍♂️🤷‍♀️👆💪💻🚀📱🤖💡⚡✨🌟💰📈🎯🔍💅🙌🫡🫠🤌✌️🫂🤝🙏🎉🔄❗❓⁉️‼️💭💬📢👇👈👉👋"]
+            if emojis_used:
+                for emoji in emojis_used:
+                    self.learned_patterns["emoji_patterns"][response_type][emoji] += 1
+                patterns_learned += 1
         
         return patterns_learned
     
@@ -1227,9 +1621,8 @@ class LearningManager:
             try:
                 with open(log_file, 'r', encoding='utf-8') as f:
                     log_data = json.load(f)
-                    if "responses" in log_data:
-                        patterns = self.learn_from_session(log_data["responses"])
-                        total_patterns += patterns
+                patterns = self.learn_from_session(load_responses(log_data, log_file))
+                total_patterns += patterns
             except Exception as e:
                 print(f"Error processing log file {log_file}: {e}")
         
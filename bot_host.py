@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+
+import config
+from client_pool import AccountClientPool
+from timer_service import TimerService
+
+logger = logging.getLogger('BotHost')
+
+
+class HostLoop:
+    """One long-lived event loop running on its own daemon thread"""
+
+    def __init__(self, index, lag_probe_interval=1.0):
+        self.index = index
+        self.lag_probe_interval = lag_probe_interval
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=f"bot-host-{index}", daemon=True)
+        self.bot_ids = set()
+
+        # Updated from inside the loop by the lag probe
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.task_count = 0
+        self.timer_metrics = {}
+        self.account_metrics = {}
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self._probe_lag())
+        try:
+            self.loop.run_forever()
+        finally:
+            try:
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            except Exception as e:
+                logger.warning(f"Error shutting down async generators on loop {self.index}: {e}")
+            self.loop.close()
+
+    async def _probe_lag(self):
+        """Measure how late the loop wakes up - a blocked loop shows up here"""
+        while True:
+            expected = time.monotonic() + self.lag_probe_interval
+            await asyncio.sleep(self.lag_probe_interval)
+            lag = max(0.0, time.monotonic() - expected) * 1000
+            self.lag_ms = lag
+            self.max_lag_ms = max(self.max_lag_ms, lag)
+            self.task_count = len(asyncio.all_tasks(self.loop))
+            self.timer_metrics = TimerService.for_loop(self.loop).metrics()
+            self.account_metrics = AccountClientPool.for_loop(self.loop).metrics()
+
+    def submit(self, coro):
+        """Schedule a coroutine from any thread; returns a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def metrics(self):
+        return {
+            "index": self.index,
+            "bots": len(self.bot_ids),
+            "tasks": self.task_count,
+            "lag_ms": round(self.lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "timers": self.timer_metrics,
+            "accounts": self.account_metrics,
+            "alive": self.thread.is_alive()
+        }
+
+
+class BotHost:
+    """Hosts many bots as tasks on a small pool of shared event loops"""
+
+    def __init__(self, num_loops=None, lag_probe_interval=1.0):
+        self.num_loops = max(1, num_loops or config.BOT_HOST_LOOPS)
+        self.lag_probe_interval = lag_probe_interval
+        self.loops = []
+        self.bots = {}  # bot_id -> hosting record
+        self.lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Start the loop threads on first use"""
+        if self.loops:
+            return
+        for index in range(self.num_loops):
+            host_loop = HostLoop(index, self.lag_probe_interval)
+            host_loop.start()
+            self.loops.append(host_loop)
+        logger.info(f"Bot host started with {self.num_loops} event loop(s)")
+
+    def _pick_loop(self, affinity=None):
+        """Place a new bot next to its affinity group, else on the least loaded loop"""
+        if affinity is not None:
+            for record in self.bots.values():
+                if record['affinity'] == affinity:
+                    return record['loop']
+        return min(self.loops, key=lambda host_loop: len(host_loop.bot_ids))
+
+    async def _run(self, bot_id, bot, runner):
+        try:
+            if runner:
+                await runner(bot)
+            else:
+                await bot.start()
+                await bot.wait_until_stopped()
+        finally:
+            # Make sure session logs get saved when a bot stops by itself
+            if getattr(bot, '_is_running', False):
+                try:
+                    await bot.stop()
+                except Exception as e:
+                    logger.error(f"Error stopping bot {bot_id}: {e}")
+
+    def _on_done(self, bot_id, future, on_done):
+        with self.lock:
+            record = self.bots.pop(bot_id, None)
+            if record:
+                record['loop'].bot_ids.discard(bot_id)
+
+        if future.cancelled():
+            logger.info(f"Bot {bot_id} task cancelled")
+        elif future.exception():
+            logger.error(f"Bot {bot_id} exited with error: {future.exception()}")
+
+        if on_done:
+            try:
+                on_done(bot_id)
+            except Exception as e:
+                logger.error(f"Error in bot {bot_id} completion callback: {e}")
+
+    def submit(self, bot_id, bot, runner=None, on_done=None, affinity=None):
+        """Run a bot on one of the shared loops
+
+        runner is an optional coroutine function taking the bot; by default the
+        bot is started and awaited until it stops. on_done(bot_id) is called
+        from the loop thread once the bot's task finishes. Bots with the same
+        affinity (e.g. user id) are kept on the same loop so they can share a
+        Telegram client.
+        """
+        with self.lock:
+            if bot_id in self.bots:
+                return False
+            self._ensure_started()
+            host_loop = self._pick_loop(affinity)
+            host_loop.bot_ids.add(bot_id)
+            future = host_loop.submit(self._run(bot_id, bot, runner))
+            self.bots[bot_id] = {
+                'bot': bot,
+                'loop': host_loop,
+                'future': future,
+                'affinity': affinity,
+                'start_time': datetime.now()
+            }
+
+        future.add_done_callback(lambda f: self._on_done(bot_id, f, on_done))
+        return True
+
+    def stop(self, bot_id, timeout=10):
+        """Stop a hosted bot and wait (up to timeout) for it to finish"""
+        with self.lock:
+            record = self.bots.get(bot_id)
+        if not record:
+            return False
+
+        stop_future = record['loop'].submit(record['bot'].stop())
+        try:
+            stop_future.result(timeout=timeout)
+        except Exception as e:
+            logger.error(f"Error stopping bot {bot_id}: {e}")
+        finally:
+            # Give the run task a moment to wind down before cancelling it
+            try:
+                record['future'].result(timeout=2)
+            except Exception:
+                pass
+            if not record['future'].done():
+                record['future'].cancel()
+        return True
+
+    def call(self, bot_id, func, timeout=10):
+        """Run a coroutine function against a hosted bot on its own loop"""
+        with self.lock:
+            record = self.bots.get(bot_id)
+        if not record:
+            return None
+        return record['loop'].submit(func(record['bot'])).result(timeout=timeout)
+
+    def is_running(self, bot_id):
+        with self.lock:
+            return bot_id in self.bots
+
+    def get_bot(self, bot_id):
+        with self.lock:
+            record = self.bots.get(bot_id)
+        return record['bot'] if record else None
+
+    def status(self, bot_id):
+        """Hosting status for a single bot"""
+        with self.lock:
+            record = self.bots.get(bot_id)
+        if not record:
+            return {"running": False}
+        return {
+            "running": True,
+            "loop": record['loop'].index,
+            "start_time": record['start_time'].isoformat(),
+            "done": record['future'].done()
+        }
+
+    def metrics(self):
+        """Tasks per loop and loop lag for every host loop"""
+        with self.lock:
+            return {
+                "loops": [host_loop.metrics() for host_loop in self.loops],
+                "total_bots": len(self.bots)
+            }
+
+    def shutdown(self, timeout=10):
+        """Stop every hosted bot and then the loops themselves"""
+        for bot_id in list(self.bots.keys()):
+            self.stop(bot_id, timeout=timeout)
+        for host_loop in self.loops:
+            host_loop.stop()
+        self.loops = []
@@ -0,0 +1,408 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+from datetime import datetime
+
+import config
+from bot_host import BotHost
+from circuit_breaker import all_breaker_status
+from fair_scheduler import house_scheduler_status
+from userbot import GeminiUserbot
+
+logger = logging.getLogger('BotRunner')
+
+
+async def run_bot(bot, bot_config, user_id, log_fn=None):
+    """Run a bot for its whole session, recording lifecycle events via log_fn"""
+    bot_id = str(bot_config['_id'])
+    loop = asyncio.get_running_loop()
+
+    # Log writes block (Mongo), so keep them off the shared event loop
+    async def log(log_type, message):
+        if log_fn:
+            await loop.run_in_executor(None, log_fn, bot_id, user_id, log_type, message)
+
+    # Record start
+    await log('start', f"Started bot {bot_config['name']}")
+
+    try:
+        # Run the async start method with connection error handling
+        max_retries = 3
+        retry_count = 0
+
+        while retry_count < max_retries:
+            try:
+                await bot.start()
+                break  # If successful, exit the retry loop
+            except ConnectionError as conn_err:
+                retry_count += 1
+                error_msg = f"Connection error (attempt {retry_count}/{max_retries}): {str(conn_err)}"
+                print(error_msg)
+
+                # Log connection error
+                await log('warning', error_msg)
+
+                if retry_count >= max_retries:
+                    raise  # Re-raise if max retries reached
+
+                # Wait before retrying (incremental backoff)
+                await asyncio.sleep(2 * retry_count)
+
+        # Add a log message indicating successful initialization
+        await log('info', f"Bot initialized and running in group {bot_config['target_group']}")
+
+        # Keep the task alive for the whole session
+        await bot.wait_until_stopped()
+    except ConnectionError as e:
+        # Handle connection errors specifically
+        error_msg = f"Network connection error: {str(e)}. Please check your internet connection and Telegram service status."
+        await log('error', error_msg)
+        print(f"Bot connection error: {error_msg}")
+    except Exception as e:
+        # Log other errors
+        error_msg = str(e)
+        await log('error', f"Error: {error_msg}")
+        print(f"Bot error: {error_msg}")
+    finally:
+        # Record stop
+        await log('stop', f"Bot {bot_config['name']} stopped")
+
+
+class LocalBotRunner:
+    """Runs bots on a BotHost inside the current process"""
+
+    def __init__(self, log_fn=None, num_loops=None):
+        self.log_fn = log_fn
+        self.host = BotHost(num_loops=num_loops)
+        self.owners = {}  # bot_id -> user_id
+
+    def start(self, bot_config, user):
+        """Create and host a bot; user is a dict with id, gemini_api_key and api_keys"""
+        bot_id = str(bot_config['_id'])
+        if self.host.is_running(bot_id):
+            return False, "Bot is already running"
+
+        # Create bot instance
+        bot = GeminiUserbot(
+            bot_config['context'],
+            bot_config['target_group'],
+            bot_config['duration'],
+            user['id'],
+            api_keys=user.get('api_keys')
+        )
+
+        # Set learning mode
+        if hasattr(bot, 'set_learning_enabled'):
+            bot.set_learning_enabled(bot_config.get('learning_enabled', True))
+        
+        # Per-bot reply budget (bots created before it existed use the defaults)
+        bot.set_reply_budget(bot_config.get('replies_per_minute'), bot_config.get('min_reply_score'))
+
+        self.owners[bot_id] = user['id']
+        submitted = self.host.submit(
+            bot_id,
+            bot,
+            runner=lambda b: run_bot(b, bot_config, user['id'], self.log_fn),
+            on_done=lambda done_id: self.owners.pop(done_id, None),
+            # A user's bots share one Telegram client, which lives on one loop
+            affinity=user['id']
+        )
+        if not submitted:
+            return False, "Bot is already running"
+        return True, f"Bot {bot_config['name']} started successfully"
+
+    def stop(self, bot_id, timeout=5):
+        if not self.host.stop(bot_id, timeout=timeout):
+            return False, "Bot is not running"
+        self.owners.pop(bot_id, None)
+        return True, "Bot stopped successfully"
+
+    def is_running(self, bot_id):
+        return self.host.is_running(bot_id)
+
+    def running_bot_ids(self, user_id=None):
+        return {bot_id for bot_id, owner in list(self.owners.items())
+                if user_id is None or owner == user_id}
+
+    def analytics(self, bot_id):
+        bot = self.host.get_bot(bot_id)
+        return bot.get_session_analytics() if bot else {}
+
+    def metrics(self):
+        metrics = self.host.metrics()
+        metrics["circuit_breakers"] = all_breaker_status()
+        metrics["house_key"] = house_scheduler_status()
+        return metrics
+
+    def shutdown(self):
+        self.host.shutdown()
+
+
+class HashRing:
+    """Consistent hash ring mapping keys (user ids) to worker indexes"""
+
+    def __init__(self, nodes, replicas=100):
+        self.ring = []
+        for node in nodes:
+            for replica in range(replicas):
+                self.ring.append((self._hash(f"{node}:{replica}"), node))
+        self.ring.sort()
+        self.keys = [h for h, _ in self.ring]
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(str(value).encode()).hexdigest(), 16)
+
+    def get(self, key):
+        index = bisect.bisect(self.keys, self._hash(key)) % len(self.ring)
+        return self.ring[index][1]
+
+
+_worker_db = None
+
+def mongo_log_bot_event(bot_id, user_id, log_type, message):
+    """Bot log writer used inside worker processes (no Flask app there)"""
+    global _worker_db
+    try:
+        if _worker_db is None:
+            from db_handler import MongoDBHandler
+            _worker_db = MongoDBHandler()
+        if not _worker_db.client:
+            return
+        _worker_db.db['logs'].insert_one({
+            'bot_id': bot_id,
+            'user_id': user_id,
+            'type': log_type,
+            'timestamp': datetime.now(),
+            'message': message
+        })
+    except Exception as e:
+        print(f"Error writing bot log: {e}")
+
+
+def worker_main(conn, worker_index):
+    """Entry point of a bot worker process: serve requests from the web app"""
+    logging.basicConfig(level=logging.INFO,
+                        format=f'%(asctime)s - worker{worker_index} - %(name)s - %(levelname)s - %(message)s')
+    runner = LocalBotRunner(log_fn=mongo_log_bot_event)
+    handlers = {
+        'start': runner.start,
+        'stop': runner.stop,
+        'is_running': runner.is_running,
+        'running_bot_ids': runner.running_bot_ids,
+        'analytics': runner.analytics,
+        'metrics': runner.metrics,
+        'ping': lambda: True
+    }
+
+    while True:
+        try:
+            seq, command, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        if command == 'shutdown':
+            break
+        try:
+            conn.send((seq, 'ok', handlers[command](*args)))
+        except Exception as e:
+            conn.send((seq, 'error', str(e)))
+
+    runner.shutdown()
+
+
+class WorkerHandle:
+    """Parent-side handle for one worker process and its pipe
+
+    Requests carry a sequence number, so a reply that arrives after its
+    request timed out is recognised and dropped rather than taken as the
+    answer to a later request.
+    """
+
+    def __init__(self, index, context):
+        self.index = index
+        self.context = context
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.seq = 0
+        self.restarts = 0
+        self.timeouts = 0
+        self.spawn()
+
+    def spawn(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=worker_main,
+            args=(child_conn, self.index),
+            name=f"bot-worker-{self.index}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def _restart(self, reason):
+        logger.error(f"Bot worker {self.index} {reason}; restarting (its bots were stopped)")
+        try:
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        self.restarts += 1
+        self.spawn()
+
+    def _call(self, command, args, timeout):
+        """Send one request and wait for its reply; None on timeout"""
+        self.seq += 1
+        seq = self.seq
+        self.conn.send((seq, command, args))
+        deadline = time.monotonic() + timeout
+        while self.conn.poll(max(0, deadline - time.monotonic())):
+            reply_seq, status, result = self.conn.recv()
+            # A late reply to a request that already timed out
+            if reply_seq == seq:
+                return status, result
+        return None
+
+    def request(self, command, *args, timeout=30):
+        with self.lock:
+            if not self.process.is_alive():
+                self._restart("died")
+            try:
+                reply = self._call(command, args, timeout)
+                # Slow isn't dead: its bots keep running unless it's also unresponsive
+                if reply is None and self.process.is_alive():
+                    if self._call('ping', (), config.BOT_WORKER_PING_TIMEOUT) is None:
+                        self._restart(f"did not answer '{command}' or a ping")
+                elif reply is None:
+                    self._restart("died")
+            except (EOFError, OSError, BrokenPipeError):
+                self._restart("crashed")
+                raise ConnectionError(f"Bot worker {self.index} crashed")
+            if reply is None:
+                self.timeouts += 1
+                raise TimeoutError(f"Bot worker {self.index} did not answer '{command}' within {timeout}s")
+        status, result = reply
+        if status == 'error':
+            raise RuntimeError(result)
+        return result
+
+    def shutdown(self):
+        try:
+            with self.lock:
+                self.conn.send((0, 'shutdown', ()))
+            self.process.join(timeout=10)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class BotWorkerPool:
+    """Shards bots across worker processes by consistent hashing on user id
+
+    Telegram sessions are per user, so all of a user's bots land on the same
+    worker. A crashed worker is restarted on the next request; the web app
+    keeps running.
+    """
+
+    def __init__(self, num_workers=None):
+        self.num_workers = max(1, num_workers or config.BOT_WORKER_PROCESSES)
+        context = multiprocessing.get_context('spawn')
+        self.workers = [WorkerHandle(i, context) for i in range(self.num_workers)]
+        self.ring = HashRing(range(self.num_workers))
+        self.bot_workers = {}  # bot_id -> worker index
+
+    def _worker_for_user(self, user_id):
+        return self.workers[self.ring.get(user_id)]
+
+    def _worker_for_bot(self, bot_id):
+        index = self.bot_workers.get(bot_id)
+        return self.workers[index] if index is not None else None
+
+    def start(self, bot_config, user):
+        worker = self._worker_for_user(user['id'])
+        success, message = worker.request('start', bot_config, user)
+        if success:
+            self.bot_workers[str(bot_config['_id'])] = worker.index
+        return success, message
+
+    def stop(self, bot_id, timeout=5):
+        worker = self._worker_for_bot(bot_id)
+        workers = [worker] if worker else self.workers
+        for candidate in workers:
+            try:
+                success, message = candidate.request('stop', bot_id, timeout)
+            except Exception as e:
+                logger.error(f"Error stopping bot {bot_id} on worker {candidate.index}: {e}")
+                continue
+            if success:
+                self.bot_workers.pop(bot_id, None)
+                return success, message
+        return False, "Bot is not running"
+
+    def is_running(self, bot_id):
+        worker = self._worker_for_bot(bot_id)
+        if not worker:
+            return False
+        try:
+            running = worker.request('is_running', bot_id)
+        except Exception:
+            running = False
+        if not running:
+            self.bot_workers.pop(bot_id, None)
+        return running
+
+    def running_bot_ids(self, user_id=None):
+        workers = [self._worker_for_user(user_id)] if user_id else self.workers
+        bot_ids = set()
+        for worker in workers:
+            try:
+                bot_ids |= worker.request('running_bot_ids', user_id)
+            except Exception as e:
+                logger.error(f"Error listing bots on worker {worker.index}: {e}")
+        return bot_ids
+
+    def analytics(self, bot_id):
+        worker = self._worker_for_bot(bot_id)
+        if not worker:
+            return {}
+        try:
+            return worker.request('analytics', bot_id)
+        except Exception as e:
+            logger.error(f"Error getting analytics for bot {bot_id}: {e}")
+            return {}
+
+    def metrics(self):
+        workers = []
+        for worker in self.workers:
+            try:
+                host = worker.request('metrics', timeout=5)
+            except Exception as e:
+                host = {"error": str(e)}
+            workers.append({
+                "index": worker.index,
+                "pid": worker.process.pid,
+                "alive": worker.process.is_alive(),
+                "restarts": worker.restarts,
+                "timeouts": worker.timeouts,
+                "host": host
+            })
+        return {"workers": workers}
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+
+
+def create_bot_runner(log_fn=None):
+    """Worker pool when BOT_WORKER_PROCESSES is set, otherwise run in-process"""
+    # Spawned workers re-import the web app's main module; never nest pools
+    if config.BOT_WORKER_PROCESSES > 0 and multiprocessing.parent_process() is None:
+        return BotWorkerPool(config.BOT_WORKER_PROCESSES)
+    return LocalBotRunner(log_fn=log_fn)
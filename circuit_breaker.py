@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import BlockedPromptException, StopCandidateException
+
+import config
+
+logger = logging.getLogger('CircuitBreaker')
+
+# Error kinds worth another attempt (with backoff)
+RETRYABLE = {"transient", "timeout"}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while a key's circuit is open"""
+
+
+def key_fingerprint(api_key):
+    """Stable id for a key that doesn't expose it"""
+    return hashlib.sha256((api_key or "").encode()).hexdigest()
+
+
+def is_auth_error(error):
+    """True if Gemini rejected the API key itself"""
+    if isinstance(error, (google_exceptions.PermissionDenied, google_exceptions.Unauthenticated)):
+        return True
+    message = str(error)
+    return "API_KEY_INVALID" in message or "API key not valid" in message
+
+
+def classify_error(error):
+    """Sort a Gemini failure into auth, quota, safety, timeout, transient, circuit_open or fatal"""
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if is_auth_error(error):
+        return "auth"
+    if isinstance(error, google_exceptions.TooManyRequests) or "quota" in str(error).lower():
+        return "quota"
+    if isinstance(error, (BlockedPromptException, StopCandidateException)):
+        return "safety"
+    # response.text raises ValueError when the candidate was blocked
+    if isinstance(error, ValueError) and ("finish_reason" in str(error) or "safety" in str(error).lower()):
+        return "safety"
+    if isinstance(error, (TimeoutError, google_exceptions.DeadlineExceeded)):
+        return "timeout"
+    if isinstance(error, (ConnectionError, google_exceptions.ServiceUnavailable,
+                          google_exceptions.InternalServerError, google_exceptions.GatewayTimeout)):
+        return "transient"
+    return "fatal"
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, only for retryable error kinds"""
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None):
+        self.max_attempts = max_attempts or config.GEMINI_MAX_ATTEMPTS
+        self.base_delay = base_delay or config.GEMINI_RETRY_BASE_DELAY
+        self.max_delay = max_delay or config.GEMINI_RETRY_MAX_DELAY
+
+    def should_retry(self, kind, attempt):
+        return kind in RETRYABLE and attempt + 1 < self.max_attempts
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Per-key breaker: trips to fallback mode for a cool-down period
+
+    Quota and auth errors trip it immediately; other failures trip it after
+    `failure_threshold` in a row. After the cool-down one probe call is let
+    through (half-open); success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, name, failure_threshold=None, cooldown=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or config.BREAKER_FAILURE_THRESHOLD
+        self.cooldown = cooldown or config.BREAKER_COOLDOWN
+        self.lock = threading.Lock()  # shared by bots on every loop
+
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.open_until = 0
+        self.probe_in_flight = False
+        self.last_error = None
+
+        # Metrics
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Whether a call may go to Gemini right now"""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() >= self.open_until:
+                self.state = "half_open"
+                self.probe_in_flight = False
+                logger.info(f"Circuit {self.name} half-open, probing")
+            if self.state == "half_open" and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                logger.info(f"Circuit {self.name} closed")
+            self.state = "closed"
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def abandon(self):
+        """A call was cancelled before it finished; free the probe slot"""
+        with self.lock:
+            self.probe_in_flight = False
+
+    def record_failure(self, kind):
+        # Bad output isn't the key's fault
+        if kind in ("safety", "circuit_open"):
+            with self.lock:
+                self.probe_in_flight = False
+            return
+        with self.lock:
+            self.failures += 1
+            self.last_error = kind
+            if self.state == "half_open" or kind in ("quota", "auth") or self.failures >= self.failure_threshold:
+                self._trip(kind)
+
+    def _trip(self, kind):
+        # A failed half-open probe means the key is still unhealthy; wait longer
+        cooldown = self.cooldown * (2 if self.state == "half_open" else 1)
+        self.state = "open"
+        self.opened_at = time.time()
+        self.open_until = self.opened_at + cooldown
+        self.probe_in_flight = False
+        self.trips += 1
+        logger.warning(f"Circuit {self.name} opened for {cooldown:.0f}s after {kind} error "
+                       f"({self.failures} failure(s)); using fallback responses")
+
+    def status(self):
+        with self.lock:
+            return {
+                "key": self.name,
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "last_error": self.last_error,
+                "retry_in_s": round(max(0, self.open_until - time.time()), 1) if self.state == "open" else 0,
+                "trips": self.trips,
+                "rejected_calls": self.rejected
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(api_key):
+    """The process-wide breaker for an API key"""
+    fingerprint = key_fingerprint(api_key)
+    with _breakers_lock:
+        breaker = _breakers.get(fingerprint)
+        if breaker is None:
+            breaker = CircuitBreaker(fingerprint[:8])
+            _breakers[fingerprint] = breaker
+        return breaker
+
+def all_breaker_status():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.status() for breaker in breakers]
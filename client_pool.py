@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import weakref
+
+from message_cache import SenderCache
+from send_scheduler import OutboundScheduler
+
+logger = logging.getLogger('ClientPool')
+
+
+class AccountSession:
+    """One connected TelegramClient plus the state shared by its bots"""
+
+    def __init__(self, key):
+        self.key = key
+        self.client = None
+        self.refs = 0
+        self.connecting = None  # task creating and connecting the client
+
+        # Per-account rather than per-bot: rate limits and sender ids are account-wide
+        self.send_scheduler = OutboundScheduler()
+        self.sender_cache = SenderCache()
+
+        # One disconnect watcher per client; bots subscribe to hear about drops
+        self.watcher = None
+        self.subscribers = set()
+
+    def subscribe(self, callback):
+        """Call callback(connected) when the connection drops or comes back"""
+        self.subscribers.add(callback)
+        if self.client and (self.watcher is None or self.watcher.done()):
+            self.watcher = asyncio.ensure_future(self._watch())
+
+    def unsubscribe(self, callback):
+        self.subscribers.discard(callback)
+
+    def _notify(self, connected):
+        for callback in list(self.subscribers):
+            try:
+                callback(connected)
+            except Exception as e:
+                logger.error(f"Error in connection callback for account {self.key}: {e}")
+
+    async def _watch(self):
+        """Wait on Telethon's disconnect notification, then reconnect with capped backoff"""
+        while self.subscribers:
+            try:
+                await self.client.disconnected
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Client for account {self.key} disconnected with error: {e}")
+            if not self.subscribers:
+                return
+
+            self._notify(False)
+            attempts = 0
+            while self.subscribers:
+                delay = min(60, 2 ** attempts)
+                logger.warning(f"Connection lost for account {self.key}, reconnecting in {delay}s...")
+                await asyncio.sleep(delay)
+                try:
+                    await self.client.connect()
+                    logger.info(f"Reconnected to Telegram for account {self.key}")
+                    self._notify(True)
+                    break
+                except Exception as e:
+                    attempts += 1
+                    logger.error(f"Reconnection failed for account {self.key}: {e}")
+
+
+class AccountClientPool:
+    """Reference-counted TelegramClients, one per Telegram account per event loop
+
+    Every bot a user runs shares the same MTProto connection and session file;
+    each bot only registers its own per-chat handlers on it.
+    """
+
+    _instances = weakref.WeakKeyDictionary()  # loop -> AccountClientPool
+
+    @classmethod
+    def for_loop(cls, loop=None):
+        """Get the shared pool for a loop (the running one by default)"""
+        loop = loop or asyncio.get_running_loop()
+        pool = cls._instances.get(loop)
+        if pool is None:
+            pool = cls()
+            cls._instances[loop] = pool
+        return pool
+
+    def __init__(self):
+        self.sessions = {}  # account key -> AccountSession
+
+    async def acquire(self, key, connect):
+        """Get the account's session, connecting with connect() on first use"""
+        session = self.sessions.get(key)
+        if session is None:
+            session = AccountSession(key)
+            session.connecting = asyncio.ensure_future(connect())
+            self.sessions[key] = session
+            logger.info(f"Opening Telegram client for account {key}")
+
+        session.refs += 1
+        try:
+            # Shield so one bot giving up doesn't cancel the connect for the others
+            session.client = await asyncio.shield(session.connecting)
+        except BaseException:
+            session.refs -= 1
+            if session.refs <= 0 and self.sessions.get(key) is session:
+                del self.sessions[key]
+            raise
+        return session
+
+    async def release(self, key):
+        """Drop one reference; the last one closes the client"""
+        session = self.sessions.get(key)
+        if session is None:
+            return
+        session.refs -= 1
+        if session.refs > 0:
+            return
+
+        del self.sessions[key]
+        # Stop watching first so closing the client doesn't look like a drop
+        if session.watcher and not session.watcher.done():
+            session.watcher.cancel()
+        await session.send_scheduler.close()
+        if session.client:
+            try:
+                if session.client.is_connected():
+                    logger.info(f"Closing Telegram client for account {key}")
+                    await session.client.disconnect()
+            except Exception as e:
+                logger.error(f"Error disconnecting Telegram client for account {key}: {e}")
+
+    def metrics(self):
+        return {
+            "accounts": len(self.sessions),
+            "bots_per_account": {str(key): session.refs for key, session in self.sessions.items()}
+        }
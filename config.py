@@ -17,9 +17,116 @@ MESSAGE_HISTORY_LIMIT = 15  # messages to include for context
 RESPONSE_DELAY_MIN = 5  # seconds
 RESPONSE_DELAY_MAX = 15  # seconds
 
+# Number of shared event loops hosting bots in the web app
+BOT_HOST_LOOPS = int(os.environ.get("BOT_HOST_LOOPS", "1"))
+
+# Worker processes running bots, sharded by user id (0 runs bots in the web process)
+BOT_WORKER_PROCESSES = int(os.environ.get("BOT_WORKER_PROCESSES", "0"))
+BOT_WORKER_PING_TIMEOUT = 30  # seconds a worker that missed a reply has to answer a ping before it's restarted
+
+# User ids allowed to see host-wide metrics (comma-separated)
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+# Stop a bot early after this many seconds without chat activity (0 disables)
+BOT_IDLE_TIMEOUT = 0
+
+# Which incoming messages get a reply (bots can override the first two)
+REPLY_BUDGET_PER_MINUTE = 4  # replies per chat per minute
+REPLY_MIN_SCORE = 0.2  # reply-worthiness below this is never answered
+REPLY_ADDRESSED_PER_MINUTE = 12  # replies per chat per minute to mentions and replies to us
+REPLY_BUDGET_RESERVE = 2  # budget a low-scoring message must leave for direct ones
+
+# Burst coalescing - messages arriving close together get one reply
+COALESCE_QUIET_WINDOW = 2.0  # seconds of silence before replying (0 disables)
+COALESCE_MAX_WAIT = 6.0  # never hold a burst longer than this
+
+# Start the typing indicator when generation starts (False = type after generating)
+PIPELINED_TYPING = True
+
+# Outbound send limits (messages per second, burst size)
+SEND_CHAT_RATE = 0.33  # ~20 messages a minute per chat
+SEND_CHAT_BURST = 3
+SEND_ACCOUNT_RATE = 1.0  # across all chats of one account
+SEND_ACCOUNT_BURST = 5
+
+# Sender name cache
+SENDER_CACHE_SIZE = 2000  # entries
+SENDER_CACHE_TTL = 3600  # seconds
+SENDER_CACHE_NEGATIVE_TTL = 300  # seconds to remember failed lookups
+
+# Gemini model used for every call
+GEMINI_MODEL = 'gemini-1.5-flash'
+
+# Stream replies so the first "|" part is sent before the rest is generated
+GEMINI_STREAMING = True
+
+# Alternatives requested in one call (instead of regenerating) when a reply is rejected
+GEMINI_CANDIDATE_COUNT = 3
+
+# Trivial messages answered or ignored without Gemini: per kind, the chance
+# of a local reply or of ignoring it (whatever is left goes to the model)
+LOCAL_REPLY_POLICY = {
+    "greeting": {"local": 1.0},
+    "acknowledgment": {"local": 0.5, "ignore": 0.5},
+    "emoji_only": {"local": 0.6, "ignore": 0.4}
+}
+
+# Gemini calls run on a bounded thread pool, off the bots' event loops
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "8"))  # per process
+GEMINI_CALL_TIMEOUT = 30  # seconds before a single model call is abandoned (from when it starts)
+GEMINI_QUEUE_MAX_WAIT = 30  # seconds a call may wait for a free slot before using the fallback
+
+# How long a Gemini key's validation result is trusted (process-wide cache)
+GEMINI_KEY_VALID_TTL = 6 * 3600  # seconds
+GEMINI_KEY_INVALID_TTL = 600  # seconds, so a fixed key is picked up again soon
+
+# Retries for transient Gemini errors (timeouts, 5xx): exponential backoff with jitter
+GEMINI_MAX_ATTEMPTS = 3
+GEMINI_RETRY_BASE_DELAY = 0.5  # seconds
+GEMINI_RETRY_MAX_DELAY = 4  # seconds
+
+# Per-key circuit breaker: stop calling a failing key and use fallback replies
+BREAKER_FAILURE_THRESHOLD = 3  # consecutive failures (quota/auth errors trip at once)
+BREAKER_COOLDOWN = 60  # seconds before a probe call is allowed
+
+# Key pool: calls are spread over all of a user's stored Gemini keys
+GEMINI_KEY_RPM = int(os.environ.get("GEMINI_KEY_RPM", "15"))  # requests per minute per key
+GEMINI_KEY_SLOW_LATENCY = 8  # seconds; a key this slow ranks like one at its rate limit
+GEMINI_KEY_STATS_WINDOW = 60  # seconds of history for per-key request rate
+
+# Answers to repeated questions, shared by every session of the same persona
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_SIZE = 1000  # entries
+RESPONSE_CACHE_TTL = 24 * 3600  # seconds
+RESPONSE_CACHE_VARIANTS = 3  # distinct answers kept per question
+RESPONSE_CACHE_PERSIST = True  # also store in MongoDB when MONGO_URI is set
+RESPONSE_CACHE_MIN_CONTENT_WORDS = 2  # shorter questions ("why?", "how so?") depend on the chat
+
+# Byte caps for dynamic reply prompt sections (sections not listed are uncapped)
+PROMPT_SECTION_CAPS = {
+    "summary": 800,
+    "session_context": 600,
+    "learned_insights": 1500
+}
+
+# Chat context in the reply prompt: recent messages verbatim, older ones summarized
+CONTEXT_VERBATIM_MESSAGES = 8  # newest messages quoted as-is
+CONTEXT_TOKEN_BUDGET = 400  # estimated tokens for the verbatim messages
+CONTEXT_SUMMARY_EVERY = 10  # fold this many older messages into the summary at a time
+
+# Session response log: entries are appended to logs/*.jsonl as they arrive
+SESSION_LOG_TAIL = 200  # newest entries kept in memory
+
 # Free tier settings
 FREE_TIER_ENABLED = True
 FREE_TIER_API_KEY = os.environ.get("HOUSE_GEMINI_API_KEY", os.environ.get("GEMINI_API_KEY"))
+
+# Fair sharing of the house key between free-tier users (split across worker processes)
+HOUSE_KEY_RPM = int(os.environ.get("HOUSE_KEY_RPM", "15"))  # requests per minute
+HOUSE_KEY_BURST = 3  # calls that may go out back to back
+HOUSE_KEY_QUANTUM = 1000  # estimated prompt tokens credited per user per round
+HOUSE_KEY_HIGH_BURST = 4  # DMs/questions served in a row while others wait
+HOUSE_KEY_MAX_WAIT = 20  # seconds before giving up and using a fallback reply
 FREE_TIER_MAX_REQUESTS = 50  # Maximum number of free requests per user
 FREE_TIER_MAX_DAYS = 7  # Maximum number of days for free tier access
 
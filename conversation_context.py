@@ -0,0 +1,109 @@
+import asyncio
+import logging
+
+import config
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger('ConversationContext')
+
+
+class RollingContext:
+    """Token-budgeted chat context: recent messages verbatim plus a rolling summary
+
+    Messages that scroll out of the verbatim window are queued and folded into
+    the summary every `summary_every` messages by a background task, so the
+    reply path never waits on summarization. New messages are told apart by
+    their (increasing) Telegram ids, so an edit or delete in the history never
+    makes an old message look new and get folded twice.
+    """
+
+    def __init__(self, summarize=None, verbatim_messages=None, token_budget=None, summary_every=None):
+        self.summarize = summarize  # async (previous_summary, lines) -> new summary
+        self.verbatim_messages = verbatim_messages or config.CONTEXT_VERBATIM_MESSAGES
+        self.token_budget = token_budget or config.CONTEXT_TOKEN_BUDGET
+        self.summary_every = summary_every or config.CONTEXT_SUMMARY_EVERY
+
+        self.summary = ""
+        self.last_id = 0  # newest message id seen (Telegram ids start at 1)
+        self.last_tail = []  # end of the previous history, to find new lines when ids are unknown
+        self.recent = []  # newest lines seen, up to verbatim_messages
+        self.to_fold = []  # lines that left the verbatim window, not yet summarized
+        self.refresh_task = None
+
+        # Metrics
+        self.folded = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.last_tokens = 0
+
+    def _new_lines(self, history, message_ids=None):
+        """Lines of history not seen on a previous call"""
+        if message_ids is not None:
+            new = [line for message_id, line in zip(message_ids, history) if message_id > self.last_id]
+            self.last_id = max([self.last_id, *message_ids])
+            return new
+        tail = self.last_tail
+        if not history:
+            return []
+        if not tail:
+            return list(history)
+        for start in range(len(history) - len(tail), -1, -1):
+            if history[start:start + len(tail)] == tail:
+                return list(history[start + len(tail):])
+        # No overlap - the window moved past everything we saw
+        return list(history)
+
+    def observe(self, history, message_ids=None):
+        """Track lines leaving the verbatim window; refresh the summary in the background"""
+        for line in self._new_lines(history, message_ids):
+            self.recent.append(line)
+            if len(self.recent) > self.verbatim_messages:
+                self.to_fold.append(self.recent.pop(0))
+        self.last_tail = list(history[-3:])
+
+        if (self.summarize and len(self.to_fold) >= self.summary_every
+                and (self.refresh_task is None or self.refresh_task.done())):
+            lines, self.to_fold = self.to_fold, []
+            self.refresh_task = asyncio.create_task(self._refresh(lines))
+
+    async def _refresh(self, lines):
+        try:
+            summary = await self.summarize(self.summary, lines)
+            if summary:
+                self.summary = summary.strip()
+                self.folded += len(lines)
+                self.refreshes += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Keep the lines for the next refresh rather than losing them
+            self.refresh_failures += 1
+            self.to_fold = lines + self.to_fold
+            logger.warning(f"Error refreshing conversation summary: {e}")
+
+    def recent_messages(self, history):
+        """The newest messages that fit the token budget, oldest first"""
+        selected = []
+        tokens = 0
+        for line in reversed(history[-self.verbatim_messages:]):
+            line_tokens = estimate_tokens(len(line.encode()))
+            if selected and tokens + line_tokens > self.token_budget:
+                break
+            selected.append(line)
+            tokens += line_tokens
+        self.last_tokens = tokens
+        return "\n".join(reversed(selected))
+
+    def cancel(self):
+        if self.refresh_task and not self.refresh_task.done():
+            self.refresh_task.cancel()
+
+    def stats(self):
+        return {
+            "summary_tokens": estimate_tokens(len(self.summary.encode())),
+            "recent_tokens": self.last_tokens,
+            "folded_messages": self.folded,
+            "pending_fold": len(self.to_fold),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures
+        }
@@ -13,7 +13,9 @@ class MongoDBHandler:
             
             # Collections
             self.logs_collection = self.db['session_logs']
+            self.responses_collection = self.db['session_responses']
             self.learning_collection = self.db['learned_patterns']
+            self.response_cache_collection = self.db['response_cache']
     
     def save_session_log(self, log_data):
         """Save a session log to MongoDB"""
@@ -27,6 +29,24 @@ class MongoDBHandler:
         result = self.logs_collection.insert_one(log_data)
         return str(result.inserted_id)
     
+    def save_session_responses(self, log_id, entries, batch_size=500):
+        """Save a session's responses in batches, linked to its session log"""
+        if not self.client or not log_id:
+            return 0
+        
+        saved = 0
+        batch = []
+        for entry in entries:
+            batch.append(dict(entry, session_id=log_id))
+            if len(batch) >= batch_size:
+                self.responses_collection.insert_many(batch)
+                saved += len(batch)
+                batch = []
+        if batch:
+            self.responses_collection.insert_many(batch)
+            saved += len(batch)
+        return saved
+    
     def get_all_logs(self):
         """Get all session logs from MongoDB"""
         if not self.client:
@@ -70,4 +90,24 @@ class MongoDBHandler:
             return None
             
         result = self.learning_collection.find_one({'type': 'learned_patterns'})
-        return result['data'] if result and 'data' in result else None
\ No newline at end of file
+        return result['data'] if result and 'data' in result else None
+    
+    def load_cached_response(self, key):
+        """Load cached answer variants for a response cache key"""
+        if not self.client:
+            return None
+            
+        result = self.response_cache_collection.find_one({'_id': key})
+        return result['variants'] if result and 'variants' in result else None
+    
+    def save_cached_response(self, key, variants):
+        """Save answer variants for a response cache key"""
+        if not self.client:
+            return False
+            
+        self.response_cache_collection.replace_one(
+            {'_id': key},
+            {'_id': key, 'variants': variants, 'updated_at': datetime.now()},
+            upsert=True
+        )
+        return True
\ No newline at end of file
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+import config
+from circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger('FairScheduler')
+
+PRIORITIES = ("high", "normal")
+
+
+class HouseKeyBusyError(CircuitOpenError):
+    """Raised when a call waited too long for a house-key slot"""
+
+
+class Waiter:
+    def __init__(self, user, cost, loop, future):
+        self.user = user
+        self.cost = cost
+        self.loop = loop
+        self.future = future
+        self.enqueued_at = time.time()
+
+
+class FairShareScheduler:
+    """Global rate limit for the shared house key with per-user fair queuing
+
+    Calls wait in per-user queues and are released at `rpm` per minute by
+    deficit round robin, with estimated prompt tokens as the cost, so one
+    busy bot gets the same share as a quiet one instead of starving it.
+    High priority calls (DMs, direct questions) go first, but at most
+    `high_burst` in a row while normal ones are waiting.
+
+    Bots run on several event loops, so the dispatcher is a thread and
+    grants are handed back with call_soon_threadsafe.
+    """
+
+    def __init__(self, rpm=None, burst=None, quantum=None, high_burst=None, max_wait=None):
+        self.rate = (rpm or config.HOUSE_KEY_RPM) / 60.0
+        self.burst = burst or config.HOUSE_KEY_BURST
+        self.quantum = quantum or config.HOUSE_KEY_QUANTUM
+        self.high_burst = high_burst or config.HOUSE_KEY_HIGH_BURST
+        self.max_wait = max_wait or config.HOUSE_KEY_MAX_WAIT
+
+        self.condition = threading.Condition()
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.queues = {priority: {} for priority in PRIORITIES}  # user -> deque of Waiters
+        self.active = {priority: deque() for priority in PRIORITIES}  # users in round-robin order
+        self.deficit = {priority: {} for priority in PRIORITIES}
+        self.high_streak = 0
+        self.thread = None
+
+        # Metrics
+        self.waits = {priority: deque(maxlen=500) for priority in PRIORITIES}
+        self.granted = dict.fromkeys(PRIORITIES, 0)
+        self.timeouts = 0
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="house-key-scheduler", daemon=True)
+            self.thread.start()
+
+    async def acquire(self, user, priority="normal", cost=1):
+        """Wait for this user's turn to call Gemini on the house key"""
+        loop = asyncio.get_running_loop()
+        waiter = Waiter(user, max(1, cost), loop, loop.create_future())
+        with self.condition:
+            self._ensure_thread()
+            queue = self.queues[priority].get(user)
+            if queue is None:
+                queue = self.queues[priority][user] = deque()
+                self.active[priority].append(user)
+                self.deficit[priority][user] = 0
+            queue.append(waiter)
+            self.condition.notify()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            with self.condition:
+                removed = self._remove(priority, waiter)
+                if removed:
+                    self.timeouts += 1
+            if removed:
+                logger.info(f"Gave up waiting for the house key after {self.max_wait}s ({priority})")
+                raise HouseKeyBusyError(f"No house-key slot within {self.max_wait}s")
+            # Granted just as we gave up - the slot is still ours
+        except asyncio.CancelledError:
+            with self.condition:
+                self._remove(priority, waiter)
+            raise
+        self.waits[priority].append(time.time() - waiter.enqueued_at)
+
+    def _remove(self, priority, waiter):
+        """Take a waiter out of its queue; False if it was already granted"""
+        queue = self.queues[priority].get(waiter.user)
+        if not queue or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        if not queue:
+            self._drop_user(priority, waiter.user)
+        return True
+
+    def _drop_user(self, priority, user):
+        del self.queues[priority][user]
+        self.active[priority].remove(user)
+        del self.deficit[priority][user]
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _next(self, priority):
+        """Deficit round robin over the users waiting at this priority"""
+        active = self.active[priority]
+        while active:
+            user = active[0]
+            queue = self.queues[priority][user]
+            if self.deficit[priority][user] < queue[0].cost:
+                self.deficit[priority][user] += self.quantum
+                active.rotate(-1)
+                continue
+            waiter = queue.popleft()
+            self.deficit[priority][user] -= waiter.cost
+            if not queue:
+                # An idle user doesn't bank credit
+                self._drop_user(priority, user)
+            return waiter
+        return None
+
+    def _pick(self):
+        normal_waiting = bool(self.active["normal"])
+        if self.active["high"] and (self.high_streak < self.high_burst or not normal_waiting):
+            self.high_streak += 1
+            return "high", self._next("high")
+        self.high_streak = 0
+        return "normal", self._next("normal")
+
+    def _run(self):
+        with self.condition:
+            while True:
+                if not self.active["high"] and not self.active["normal"]:
+                    self.condition.wait()
+                    continue
+                self._refill()
+                if self.tokens < 1:
+                    self.condition.wait((1 - self.tokens) / self.rate)
+                    continue
+                priority, waiter = self._pick()
+                if waiter is None:
+                    continue
+                self.tokens -= 1
+                self.granted[priority] += 1
+                waiter.loop.call_soon_threadsafe(_grant, waiter.future)
+
+    def stats(self):
+        """Queue depth and wait times, to see when users should bring their own key"""
+        with self.condition:
+            queued = {priority: sum(len(queue) for queue in self.queues[priority].values())
+                      for priority in PRIORITIES}
+            users_waiting = len(set(self.queues["high"]) | set(self.queues["normal"]))
+            waits = {priority: sorted(self.waits[priority]) for priority in PRIORITIES}
+        wait_ms = {}
+        for priority, samples in waits.items():
+            if samples:
+                wait_ms[priority] = {
+                    "p50": round(samples[len(samples) // 2] * 1000, 1),
+                    "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+                    "max": round(samples[-1] * 1000, 1)
+                }
+            else:
+                wait_ms[priority] = {"p50": 0, "p95": 0, "max": 0}
+        return {
+            "rpm": round(self.rate * 60, 1),
+            "queued": queued,
+            "users_waiting": users_waiting,
+            "granted": dict(self.granted),
+            "timeouts": self.timeouts,
+            "wait_ms": wait_ms
+        }
+
+
+def _grant(future):
+    if not future.done():
+        future.set_result(True)
+
+
+_house_scheduler = None
+_house_scheduler_lock = threading.Lock()
+
+def get_house_scheduler():
+    """The process-wide scheduler for FREE_TIER_API_KEY calls"""
+    global _house_scheduler
+    with _house_scheduler_lock:
+        if _house_scheduler is None:
+            # Worker processes split the house key's budget between them
+            processes = max(1, config.BOT_WORKER_PROCESSES)
+            _house_scheduler = FairShareScheduler(rpm=config.HOUSE_KEY_RPM / processes)
+        return _house_scheduler
+
+def house_scheduler_status():
+    return _house_scheduler.stats() if _house_scheduler else None
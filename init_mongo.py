@@ -20,6 +20,7 @@ def init_database():
             'users': {'username': ASCENDING},
             'bots': {'user_id': ASCENDING, 'name': ASCENDING},
             'session_logs': {'saved_at': ASCENDING, 'bot_id': ASCENDING},
+            'session_responses': {'session_id': ASCENDING},
             'learned_patterns': {'type': ASCENDING}
         }
         
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import google.generativeai as genai
+import google.ai.generativelanguage as glm
+
+import config
+from circuit_breaker import CircuitOpenError, get_breaker, key_fingerprint
+
+logger = logging.getLogger('KeyPool')
+
+
+def make_model(api_key, model_name=None):
+    """A Gemini model bound to its own key
+
+    genai.configure() is process-wide, so bots configuring different keys
+    would overwrite each other; giving the model its own client avoids that.
+    """
+    model = genai.GenerativeModel(model_name or config.GEMINI_MODEL)
+    model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    return model
+
+
+class KeyStats:
+    """Request rate, latency and errors for one key, shared by every bot using it"""
+
+    def __init__(self, name, window=None):
+        self.name = name
+        self.window = window or config.GEMINI_KEY_STATS_WINDOW
+        self.lock = threading.Lock()
+        self.started = deque()  # start times of calls inside the window
+        self.in_flight = 0
+        self.latency = None  # moving average, seconds
+
+        # Totals
+        self.requests = 0
+        self.errors = 0
+        self.quota_errors = 0
+
+    def _trim(self, now):
+        while self.started and self.started[0] <= now - self.window:
+            self.started.popleft()
+
+    def rate(self):
+        """Calls started per minute over the window"""
+        with self.lock:
+            self._trim(time.time())
+            return len(self.started) * 60 / self.window
+
+    def begin(self):
+        with self.lock:
+            now = time.time()
+            self._trim(now)
+            self.started.append(now)
+            self.in_flight += 1
+            self.requests += 1
+            return now
+
+    def end(self, started_at, kind=None):
+        """Record a finished call; kind is the classify_error() result or None on success"""
+        with self.lock:
+            self.in_flight -= 1
+            if kind is None or kind == "timeout":
+                elapsed = time.time() - started_at
+                self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            if kind is not None:
+                self.errors += 1
+                if kind == "quota":
+                    self.quota_errors += 1
+
+    def cancel(self):
+        """A call was abandoned; it counts toward the rate but not latency or errors"""
+        with self.lock:
+            self.in_flight -= 1
+
+    def status(self):
+        rate = self.rate()
+        with self.lock:
+            return {
+                "key": self.name,
+                "rate_per_min": round(rate, 1),
+                "in_flight": self.in_flight,
+                "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+                "requests": self.requests,
+                "errors": self.errors,
+                "quota_errors": self.quota_errors
+            }
+
+
+_key_stats = {}
+_key_stats_lock = threading.Lock()
+
+def get_key_stats(api_key):
+    """The process-wide stats for an API key"""
+    fingerprint = key_fingerprint(api_key)
+    with _key_stats_lock:
+        stats = _key_stats.get(fingerprint)
+        if stats is None:
+            stats = KeyStats(fingerprint[:8])
+            _key_stats[fingerprint] = stats
+        return stats
+
+
+class PooledKey:
+    """One key of a pool with its model, breaker and stats"""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.model = make_model(api_key)
+        self.breaker = get_breaker(api_key)
+        self.stats = get_key_stats(api_key)
+
+
+class ApiKeyPool:
+    """Spreads Gemini calls over all of a user's keys
+
+    Each call goes to the healthy key with the most headroom: keys whose
+    circuit is open are skipped, keys at their per-minute rate limit are
+    only used when nothing else is left, and slow keys rank lower.
+    """
+
+    def __init__(self, api_keys, rpm=None, slow_latency=None):
+        self.rpm = rpm or config.GEMINI_KEY_RPM
+        self.slow_latency = slow_latency or config.GEMINI_KEY_SLOW_LATENCY
+        self.members = []
+        for api_key in api_keys:
+            if api_key and api_key not in (member.api_key for member in self.members):
+                self.members.append(PooledKey(api_key))
+
+    def __len__(self):
+        return len(self.members)
+
+    def _load(self, member):
+        """Lower is better: share of the rate limit in use plus a latency penalty"""
+        load = (member.stats.rate() + member.stats.in_flight) / self.rpm
+        if member.stats.latency is not None:
+            load += member.stats.latency / self.slow_latency
+        return load
+
+    def acquire(self):
+        """The key to use for the next call; raises CircuitOpenError if none is usable"""
+        ranked = sorted(self.members, key=lambda member: (
+            member.stats.rate() >= self.rpm,  # exhausted keys last
+            self._load(member)
+        ))
+        for member in ranked:
+            # allow() also hands out the single half-open probe
+            if member.breaker.allow():
+                return member
+        raise CircuitOpenError(f"No usable key in pool of {len(self.members)}")
+
+    def discard(self, api_key):
+        """Drop a key Gemini rejected"""
+        self.members = [member for member in self.members if member.api_key != api_key]
+        logger.warning(f"Removed rejected key from pool ({len(self.members)} left)")
+
+    def status(self):
+        keys = []
+        for member in self.members:
+            status = member.stats.status()
+            status["circuit"] = member.breaker.status()["state"]
+            keys.append(status)
+        return {"size": len(self.members), "rpm_per_key": self.rpm, "keys": keys}
@@ -0,0 +1,66 @@
+import re
+from collections import OrderedDict
+
+
+class Lexicon:
+    """Classifies text into every signal category in a single regex pass
+
+    All phrases from all categories are compiled into one alternation with
+    word boundaries, so 'hi' no longer matches inside 'this'. Because the
+    regex takes the longest phrase at each position, a phrase also carries
+    the categories of any shorter phrase inside it ('what's up' counts as a
+    greeting and as a question word).
+    """
+
+    def __init__(self, categories, cache_size=256):
+        self.categories = {name: [p.lower() for p in phrases] for name, phrases in categories.items()}
+
+        phrase_categories = {}
+        for name, phrases in self.categories.items():
+            for phrase in phrases:
+                phrase_categories.setdefault(phrase, set()).add(name)
+
+        # Longest first so the alternation prefers the longest phrase
+        phrases = sorted(phrase_categories, key=len, reverse=True)
+        self.pattern = re.compile(
+            r"(?<!\w)(?:" + "|".join(re.escape(p) for p in phrases) + r")(?!\w)"
+        )
+
+        # Fold in categories of phrases nested inside longer ones
+        self.phrase_categories = {}
+        for phrase in phrases:
+            names = set(phrase_categories[phrase])
+            for other in phrases:
+                if len(other) < len(phrase) and other in phrase and re.search(
+                        r"(?<!\w)" + re.escape(other) + r"(?!\w)", phrase):
+                    names |= phrase_categories[other]
+            self.phrase_categories[phrase] = frozenset(names)
+
+        # Recently scanned texts, so every detector shares one pass per message
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.scans = 0
+        self.cache_hits = 0
+
+    def scan(self, text):
+        """Map of category -> matched phrases for text (lowercased)"""
+        text = text.lower()
+        result = self.cache.get(text)
+        if result is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(text)
+            return result
+
+        self.scans += 1
+        result = {}
+        for phrase in self.pattern.findall(text):
+            for name in self.phrase_categories[phrase]:
+                result.setdefault(name, set()).add(phrase)
+
+        self.cache[text] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def has(self, text, category):
+        return category in self.scan(text)
@@ -0,0 +1,92 @@
+import random
+import re
+from collections import Counter
+
+import config
+from response_cache import EMOJI_RE
+
+# Replies for messages that don't need the model; {name} is the sender
+TEMPLATES = {
+    "greeting": [
+        "Hey {name}!", "Hi {name}, what's up?", "Hey! How's it going?", "Heyy", "Hi there!",
+        "Hey {name}, how's your day going?", "Yo {name}!", "Hello! What's new?"
+    ],
+    "greeting_repeat": [
+        "Hey again {name}!", "Back again? Haha", "Hi again!", "Hey hey", "Welcome back {name}"
+    ],
+    "acknowledgment": [
+        "Yeah", "For sure", "Haha true", "Right?", "Exactly", "Yep", "Fair enough", "Totally",
+        "Makes sense", "Same tbh"
+    ],
+    "thanks": [
+        "No worries!", "Anytime!", "Np!", "Happy to help", "Of course!"
+    ]
+}
+
+THANKS_RE = re.compile(r"\b(thanks|thank you|thx|ty|shukriya|dhanyavad)\b")
+
+
+class LocalResponder:
+    """Answers or ignores trivial messages without calling Gemini
+
+    LOCAL_REPLY_POLICY gives, per kind of message (greeting, acknowledgment,
+    emoji_only), the chance of replying locally or ignoring it; the rest go
+    to the model as before. Every reply is counted by the tier that served
+    it so the share of traffic handled locally can be tracked.
+    """
+
+    def __init__(self, policy=None, templates=None):
+        self.policy = policy if policy is not None else config.LOCAL_REPLY_POLICY
+        self.templates = templates or TEMPLATES
+        self.tiers = Counter()  # local / ignored / cached / model / fallback
+
+    @staticmethod
+    def is_emoji_only(content):
+        stripped = re.sub(r"[\W_]+", "", EMOJI_RE.sub("", content))
+        return bool(content.strip()) and not stripped
+
+    def decide(self, kind, is_group_chat=True):
+        """'local', 'ignore' or 'model' for a message of this kind"""
+        weights = self.policy.get(kind) if kind else None
+        if not weights:
+            return "model"
+        roll = random.random()
+        for action in ("local", "ignore"):
+            roll -= weights.get(action, 0)
+            if roll < 0:
+                # Ignoring someone in a DM would be rude
+                if action == "ignore" and not is_group_chat:
+                    return "local"
+                return action
+        return "model"
+
+    def reply(self, kind, content, name, emojis, recent=()):
+        """A short templated reply, avoiding ones we just used"""
+        if kind == "emoji_only":
+            # Answer emoji with emoji: often the same one, else one that worked before
+            theirs = EMOJI_RE.findall(content)
+            if theirs and random.random() < 0.5:
+                return random.choice(theirs)
+            return random.choice(emojis)
+        if kind == "acknowledgment" and THANKS_RE.search(content.lower()):
+            kind = "thanks"
+        templates = self.templates[kind] if name else [t for t in self.templates[kind] if "{name}" not in t]
+        options = [template.format(name=name) for template in templates]
+        fresh = [option for option in options
+                 if not any(previous.startswith(option.lower()) for previous in recent)]
+        message = random.choice(fresh or options)
+        if random.random() < 0.35:
+            message = f"{message} {random.choice(emojis)}"
+        return message
+
+    def record(self, tier):
+        self.tiers[tier] += 1
+
+    def stats(self):
+        total = sum(self.tiers.values())
+        local = self.tiers["local"] + self.tiers["ignored"]
+        return {
+            "tiers": dict(self.tiers),
+            "local_percentage": round(local / total * 100, 2) if total else 0,
+            "model_percentage": round(self.tiers["model"] / total * 100, 2) if total else 0
+        }
@@ -0,0 +1,172 @@
+import time
+from collections import OrderedDict
+
+from telethon import utils
+
+import config
+
+
+class ChatHistoryBuffer:
+    """Bounded per-chat message history kept current from the update stream"""
+
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen or config.MESSAGE_HISTORY_LIMIT
+        self.chats = {}  # chat_id -> OrderedDict(message_id -> formatted line)
+
+    def _chat(self, chat_id):
+        """Get (or create) the ordered buffer for a chat"""
+        if chat_id not in self.chats:
+            self.chats[chat_id] = OrderedDict()
+        return self.chats[chat_id]
+
+    def is_seeded(self, chat_id):
+        """Check whether a chat has been seeded from history yet"""
+        return chat_id in self.chats
+
+    def seed(self, chat_id, entries):
+        """Replace a chat's buffer with (message_id, line) pairs, oldest first"""
+        chat = OrderedDict()
+        for message_id, line in entries:
+            chat[message_id] = line
+        while len(chat) > self.maxlen:
+            chat.popitem(last=False)
+        self.chats[chat_id] = chat
+
+    def append(self, chat_id, message_id, line):
+        """Add a new message to the end of a chat's buffer"""
+        chat = self._chat(chat_id)
+        chat[message_id] = line
+        chat.move_to_end(message_id)
+        if len(chat) > self.maxlen:
+            chat.popitem(last=False)
+
+    def edit(self, chat_id, message_id, line):
+        """Update a message in place if it is still inside the window"""
+        chat = self.chats.get(chat_id)
+        if chat is not None and message_id in chat:
+            chat[message_id] = line
+            return True
+        return False
+
+    def delete(self, message_ids, chat_id=None):
+        """Remove messages; without a chat id all chats are searched"""
+        if chat_id is None:
+            chats = list(self.chats.values())
+        elif chat_id in self.chats:
+            chats = [self.chats[chat_id]]
+        else:
+            chats = []
+
+        removed = 0
+        for chat in chats:
+            for message_id in message_ids:
+                if chat.pop(message_id, None) is not None:
+                    removed += 1
+        return removed
+
+    def entries(self, chat_id):
+        """Return the buffered (message_id, line) pairs for a chat, oldest first"""
+        return list(self.chats.get(chat_id, {}).items())
+
+    def get(self, chat_id, limit=None):
+        """Return the buffered lines for a chat, oldest first"""
+        chat = self.chats.get(chat_id)
+        if not chat:
+            return []
+        lines = list(chat.values())
+        if limit:
+            return lines[-limit:]
+        return lines
+
+    def clear(self, chat_id=None):
+        """Drop one chat's buffer, or every buffer"""
+        if chat_id is None:
+            self.chats.clear()
+        else:
+            self.chats.pop(chat_id, None)
+
+
+def display_name(entity):
+    """Short display name for a user, chat or channel entity"""
+    if entity is None:
+        return None
+    return getattr(entity, 'first_name', None) or getattr(entity, 'title', None) or getattr(entity, 'username', None)
+
+
+class SenderCache:
+    """LRU cache of sender id -> display name with TTL and negative entries"""
+
+    def __init__(self, max_size=None, ttl=None, negative_ttl=None):
+        self.max_size = max_size or config.SENDER_CACHE_SIZE
+        self.ttl = ttl or config.SENDER_CACHE_TTL
+        self.negative_ttl = negative_ttl or config.SENDER_CACHE_NEGATIVE_TTL
+        self.entries = OrderedDict()  # sender_id -> (name or None, expires_at)
+
+        # Counters so we can confirm steady state needs no lookups
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.rpc_lookups = 0
+
+    def lookup(self, sender_id):
+        """Return (found, name); name is None for a cached failure"""
+        entry = self.entries.get(sender_id)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        name, expires_at = entry
+        if time.time() >= expires_at:
+            del self.entries[sender_id]
+            self.misses += 1
+            return False, None
+
+        self.entries.move_to_end(sender_id)
+        if name is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, name
+
+    def _store(self, sender_id, name, ttl):
+        self.entries[sender_id] = (name, time.time() + ttl)
+        self.entries.move_to_end(sender_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def put(self, sender_id, name):
+        """Cache a resolved display name"""
+        if sender_id is None:
+            return
+        if not name:
+            self.put_missing(sender_id)
+            return
+        self._store(sender_id, name, self.ttl)
+
+    def put_missing(self, sender_id):
+        """Remember that a sender could not be resolved"""
+        if sender_id is not None:
+            self._store(sender_id, None, self.negative_ttl)
+
+    def prefill(self, entities):
+        """Bulk-load entities (e.g. the users/chats vectors of a history response)"""
+        count = 0
+        for entity in entities or []:
+            try:
+                self.put(utils.get_peer_id(entity), display_name(entity))
+                count += 1
+            except Exception:
+                continue
+        return count
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "rpc_lookups": self.rpc_lookups,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups * 100, 2) if lookups else 0
+        }
@@ -0,0 +1,149 @@
+import textwrap
+
+import config
+
+
+def estimate_tokens(byte_count):
+    """Rough Gemini token count (~4 bytes of English text per token)"""
+    return (byte_count + 3) // 4
+
+
+class PromptBuilder:
+    """Reply prompt compiled once per session into static segments and slots
+
+    Static text (persona header, Hinglish note, style guide and examples) is
+    rendered and measured once; each call only fills the dynamic slots and
+    joins the pieces. Per-section byte and token sizes are tracked so prompt
+    growth can be seen and capped.
+    """
+
+    SECTIONS = ("header", "topic", "summary", "recent_messages", "session_context", "guidance",
+                "hinglish", "learned_insights", "style")
+
+    def __init__(self, persona_name, persona_role, caps=None):
+        self.caps = dict(config.PROMPT_SECTION_CAPS if caps is None else caps)
+
+        # Static segments, keyed by chat type where the wording differs
+        self.headers = {
+            is_group: (
+                f"You're in a {'Telegram group chat' if is_group else 'one-on-one Telegram conversation'} as {persona_name}.\n\n"
+                f"You are {persona_name}, {persona_role}.\n\n"
+                f"The conversation is about: "
+            )
+            for is_group in (True, False)
+        }
+        self.summary_label = "\n\nEarlier in this conversation:\n"
+        self.recent_label = "\n\nRecent messages:\n"
+        self.hinglish = textwrap.dedent("""
+            IMPORTANT: The person is using Hinglish (Hindi-English mixed language).
+            You can occasionally mix in simple Hindi words in your reply.
+            For example: "Haan, tech industry mein bahut opportunities hain!"
+            Keep it mostly English with just a few Hindi words mixed in.
+            """)
+        self.style = textwrap.dedent("""
+            Generate 1-2 SHORT, natural responses (5-15 words each maximum).
+            Each response should be on its own line, separated by a "|" character.
+
+            Write exactly like a real person texting on their phone:
+            - Casual and conversational
+            - Use contractions (I'm, you're, doesn't)
+            - Occasionally use abbreviations (tbh, lol, etc.)
+            - Sound friendly but not overly enthusiastic
+            - React naturally to what the other person just said
+            - Don't sound like you're following a script
+            - Be adaptive - if they change topics, go with it
+
+            Examples of natural responses:
+            "Yeah, been crazy busy with interviews lately."
+            "Tech jobs are so competitive these days!"
+            "I'm interested in ML. What about you?"
+            "Lol, that's exactly what I thought too"
+
+            Remember: Sound like a real human having a casual conversation.
+            """)
+        self.header_bytes = {
+            is_group: len(header.encode()) + len(self.recent_label)
+            for is_group, header in self.headers.items()
+        }
+        self.static_bytes = {
+            "hinglish": len(self.hinglish.encode()),
+            "style": len(self.style.encode())
+        }
+
+        # Metrics
+        self.builds = 0
+        self.last_sizes = {}
+        self.total_bytes = dict.fromkeys(self.SECTIONS, 0)
+        self.truncated = dict.fromkeys(self.SECTIONS, 0)
+
+    def _slot(self, name, text):
+        """Apply the section's byte cap; chat history keeps its newest end"""
+        data = text.encode()
+        cap = self.caps.get(name)
+        if cap and len(data) > cap:
+            self.truncated[name] += 1
+            data = data[-cap:] if name == "recent_messages" else data[:cap]
+            text = data.decode(errors='ignore')
+        return text, len(data)
+
+    def build(self, is_group_chat, topic, recent_messages, session_context="", guidance="",
+                hinglish=False, learned_insights="", summary=""):
+        """Fill the slots and return the full prompt"""
+        topic, topic_bytes = self._slot("topic", topic)
+        summary, summary_bytes = self._slot("summary", summary)
+        recent_messages, recent_bytes = self._slot("recent_messages", recent_messages)
+        session_context, session_bytes = self._slot("session_context", session_context)
+        guidance, guidance_bytes = self._slot("guidance", guidance)
+        learned_insights, insight_bytes = self._slot("learned_insights", learned_insights)
+
+        parts = [self.headers[bool(is_group_chat)], topic]
+        if summary:
+            parts.extend((self.summary_label, summary))
+        parts.extend((self.recent_label, recent_messages))
+        for section in (session_context, guidance):
+            if section:
+                parts.extend(("\n\n", section))
+        parts.append("\n")
+        if hinglish:
+            parts.append(self.hinglish)
+        if learned_insights:
+            parts.extend(("\n", learned_insights, "\n"))
+        parts.append(self.style)
+
+        sizes = {
+            "header": self.header_bytes[bool(is_group_chat)],
+            "topic": topic_bytes,
+            "summary": summary_bytes + (len(self.summary_label) if summary else 0),
+            "recent_messages": recent_bytes,
+            "session_context": session_bytes,
+            "guidance": guidance_bytes,
+            "hinglish": self.static_bytes["hinglish"] if hinglish else 0,
+            "learned_insights": insight_bytes,
+            "style": self.static_bytes["style"]
+        }
+        self.builds += 1
+        self.last_sizes = sizes
+        for name, size in sizes.items():
+            self.total_bytes[name] += size
+        return "".join(parts)
+
+    def stats(self):
+        """Bytes and estimated tokens per section, for the last and average prompt"""
+        if not self.builds:
+            return {"builds": 0}
+        sections = {}
+        for name in self.SECTIONS:
+            average = self.total_bytes[name] / self.builds
+            sections[name] = {
+                "last_bytes": self.last_sizes.get(name, 0),
+                "avg_bytes": round(average, 1),
+                "avg_tokens": estimate_tokens(int(average)),
+                "truncated": self.truncated[name]
+            }
+        last_total = sum(self.last_sizes.values())
+        return {
+            "builds": self.builds,
+            "last_bytes": last_total,
+            "last_tokens": estimate_tokens(last_total),
+            "sections": sections
+        }
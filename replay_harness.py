@@ -0,0 +1,426 @@
+"""Offline replay harness for the message pipeline
+
+Runs the real TelegramUserbot handlers and GeminiUserbot generation against a
+stand-in Telethon client, feeding recorded (logs/session_*.json) or synthetic
+messages, and reports throughput and event-to-send latency. No Telegram
+account or Gemini key is needed.
+
+    python replay_harness.py logs/session_*.json --rate 5
+    python replay_harness.py --synthetic 200 --rate 0 --model-latency 0.8 --json
+"""
+import argparse
+import asyncio
+import contextvars
+import glob
+import itertools
+import json
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telethon import events
+from telethon.tl.types import Chat, ChatPhotoEmpty, User
+
+import config
+from ai_handler import GeminiAI
+from session_log import SessionLog, load_responses
+from telegram_client import TelegramUserbot
+from userbot import GeminiUserbot
+
+REPLAY_CHAT_ID = 424242
+REPLAY_CONTEXT = "Discuss the latest trends in the tech job market"
+
+SYNTHETIC_SENDERS = ["Aman", "Priya", "Rahul", "Sara", "Vikram", "Neha"]
+SYNTHETIC_MESSAGES = [
+    "hi everyone", "hello", "ok", "nice", "thanks", "lol that's true",
+    "what skills are companies hiring for right now?",
+    "who are you btw?", "kaise ho sab log", "anyone got an interview this week?",
+    "I think AI is overhyped tbh", "remote jobs are drying up",
+    "how do you prepare for system design rounds?", "agree with that",
+    "nah I disagree, cloud is still hot", "gtg, bye", "which companies are still hiring interns?",
+    "salary kitna milta hai freshers ko?", "haha exactly", "Can someone explain what MLOps means?"
+]
+DEFAULT_RESPONSES = [
+    "Yeah, AI's everywhere right now | What are you working on these days?",
+    "Cloud skills still seem super in demand",
+    "Honestly system design practice helps a lot | Have you tried mock interviews?",
+    "Haha fair point | Hiring feels slow everywhere tbh",
+    "Interning at a startup taught me so much",
+    "Depends on the company tbh | Some still pay well for freshers"
+]
+
+
+class ReplayMessage:
+    """Just enough of a Telethon Message for the pipeline"""
+
+    def __init__(self, client, message_id, text, sender, out=False):
+        self.client = client
+        self.id = message_id
+        self.message = text
+        self.text = text
+        self.sender = sender
+        self.sender_id = sender.id if sender else None
+        self.from_id = sender.id if sender else None
+        self.chat_id = client.chat_id
+        self.out = out
+        self.date = datetime.now(timezone.utc)
+        self.sent_at = time.monotonic()
+
+    async def reply(self, text):
+        return await self.client.send_message(self.client.input_peer, text, reply_to=self.id)
+
+
+class ReplayEvent:
+    """Stand-in for events.NewMessage.Event wrapping a ReplayMessage"""
+
+    def __init__(self, message):
+        self.message = message
+        self.arrived_at = time.monotonic()
+
+    def __getattr__(self, name):
+        # Like Telethon's events, unknown attributes come from the message
+        return getattr(self.message, name)
+
+
+class ReplayTelegramClient:
+    """In-memory TelegramClient: records sends and typing instead of talking to Telegram"""
+
+    def __init__(self, chat_id=REPLAY_CHAT_ID, title="Replay chat"):
+        self.chat = Chat(id=chat_id, title=title, photo=ChatPhotoEmpty(),
+                         participants_count=len(SYNTHETIC_SENDERS) + 1, date=None, version=1)
+        self.chat_id = -chat_id
+        self.input_peer = None
+        self.me = User(id=1, is_self=True, first_name="Me")
+        self.users = {}  # name -> User
+        self.handlers = []
+        self.message_ids = itertools.count(1)
+        self.connected = True
+        self.disconnected = asyncio.get_running_loop().create_future()
+
+        # What the pipeline did
+        self.sent = []
+        self.typing_actions = 0
+
+    def add_event_handler(self, callback, event):
+        self.handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        self.handlers = [(cb, ev) for cb, ev in self.handlers
+                         if not (cb == callback and (event is None or ev is event))]
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+        if not self.disconnected.done():
+            self.disconnected.set_result(None)
+
+    async def get_me(self):
+        return self.me
+
+    async def get_entity(self, target):
+        if isinstance(target, int):
+            for user in self.users.values():
+                if user.id == target:
+                    return user
+            if target in (self.chat.id, self.chat_id):
+                return self.chat
+            raise ValueError(f"Unknown entity {target}")
+        return self.chat
+
+    async def __call__(self, request):
+        # Only GetHistoryRequest is used; the replay starts with an empty chat
+        return SimpleNamespace(messages=[], users=[], chats=[])
+
+    def action(self, peer, action):
+        client = self
+
+        class Action:
+            async def __aenter__(self):
+                client.typing_actions += 1
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Action()
+
+    async def send_message(self, peer, text, reply_to=None):
+        message = ReplayMessage(self, next(self.message_ids), text, self.me, out=True)
+        self.sent.append(message)
+        return message
+
+    def new_event(self, sender_name, text):
+        sender = self.users.get(sender_name)
+        if sender is None:
+            sender = User(id=1000 + len(self.users), first_name=sender_name)
+            self.users[sender_name] = sender
+        return ReplayEvent(ReplayMessage(self, next(self.message_ids), text, sender))
+
+    async def dispatch(self, event):
+        """Deliver an incoming message to the NewMessage handlers"""
+        for callback, builder in list(self.handlers):
+            if isinstance(builder, events.NewMessage):
+                await callback(event)
+
+
+class ReplayModel:
+    """Stand-in for genai.GenerativeModel with a fixed (blocking) latency"""
+
+    def __init__(self, latency=0.5, responses=None):
+        self.latency = latency
+        self.responses = responses or DEFAULT_RESPONSES
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False, generation_config=None, **kwargs):
+        self.calls += 1
+        count = (generation_config or {}).get("candidate_count", 1)
+        texts = [random.choice(self.responses) for _ in range(count)]
+        if stream:
+            return ReplayStream(texts[0], self.latency)
+        # Blocks like the real client does
+        time.sleep(self.latency)
+        candidates = [SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)])) for text in texts]
+        return SimpleNamespace(text=texts[0], candidates=candidates)
+
+
+class ReplayStream:
+    """Streamed response: chunks arrive with latency spread over the text"""
+
+    def __init__(self, text, latency, chunk_size=8):
+        self.text = text
+        self.latency = latency
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        chunks = [self.text[i:i + self.chunk_size] for i in range(0, len(self.text), self.chunk_size)]
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield SimpleNamespace(text=chunk)
+
+
+def load_session_messages(paths):
+    """Incoming messages and bot replies from saved session logs"""
+    messages, responses = [], []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            session = json.load(f)
+        for entry in load_responses(session, path):
+            user_message = entry.get('user_message') or ""
+            if ': ' in user_message:
+                sender, text = user_message.split(': ', 1)
+            else:
+                sender, text = entry.get('user') or "User", user_message
+            if text.strip():
+                messages.append((sender, text))
+            if entry.get('bot_responses'):
+                responses.append(" | ".join(entry['bot_responses']))
+    return messages, responses
+
+
+def synthetic_messages(count, seed=None):
+    rng = random.Random(seed)
+    return [(rng.choice(SYNTHETIC_SENDERS), rng.choice(SYNTHETIC_MESSAGES)) for _ in range(count)]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class ReplayRun:
+    """One replay: a bot wired to the stand-in client, plus latency bookkeeping"""
+
+    replying_to = contextvars.ContextVar('replying_to', default=None)
+
+    def __init__(self, args, responses=None):
+        self.args = args
+        self.responses = responses
+        self.pending = deque()  # incoming events not yet answered, in arrival order
+        self.latencies = []
+        self.replies = 0
+        self.max_lag_ms = 0.0
+
+    async def setup(self):
+        args = self.args
+        config.GEMINI_STREAMING = not args.no_streaming
+        if args.unthrottled:
+            config.SEND_CHAT_RATE = config.SEND_ACCOUNT_RATE = 1000.0
+            config.SEND_CHAT_BURST = config.SEND_ACCOUNT_BURST = 1000
+
+        self.client = ReplayTelegramClient()
+        self.model = ReplayModel(args.model_latency, self.responses)
+
+        # Same wiring GeminiUserbot.start() does, minus the network checks
+        self.bot = GeminiUserbot(args.context, REPLAY_CHAT_ID, duration=24 * 60)
+        self.bot.learning_enabled = False  # don't write a session log for a replay
+        # Without --replies-per-minute every message is eligible, so runs measure the pipeline
+        self.bot.set_reply_budget(args.replies_per_minute or 10 ** 6, args.min_reply_score)
+        ai = GeminiAI(super_context=args.context, api_key="offline-replay-key")
+        ai.session_log = SessionLog(args.context, ai.emojis, log_dir=None)  # nothing spilled to logs/
+        for member in ai.key_pool.members:
+            member.model = self.model
+        self.bot.ai_handler = ai
+        self.bot._is_running = True
+
+        userbot = TelegramUserbot(args.context, REPLAY_CHAT_ID, 24 * 60, parent_bot=self.bot)
+        userbot.delay_scale = args.delay_scale
+        userbot.coalesce_quiet_window = args.quiet_window
+        self.bot.telegram_client = userbot
+
+        async def connect():
+            return self.client
+        userbot._connect_new_client = connect
+        await userbot.start()
+        self.client.input_peer = userbot.target_peer
+        self._trace(userbot)
+        self.userbot = userbot
+
+    def _trace(self, userbot):
+        """Attribute each reply to the burst of events it answers"""
+        send_ai_response = userbot.send_ai_response
+        submit = userbot.send_scheduler.submit
+
+        async def traced_send_ai_response(context, event=None):
+            token = self.replying_to.set(event)
+            try:
+                return await send_ai_response(context, event)
+            finally:
+                self.replying_to.reset(token)
+
+        async def traced_submit(chat_key, steps):
+            results = await submit(chat_key, steps)
+            event = self.replying_to.get()
+            if event is not None and results:
+                self._answered(event, results[0].sent_at)
+            return results
+
+        userbot.send_ai_response = traced_send_ai_response
+        userbot.send_scheduler.submit = traced_submit
+
+    def _answered(self, event, sent_at):
+        self.replies += 1
+        # A reply covers its event and everything coalesced before it
+        while self.pending and self.pending[0].id <= event.id:
+            self.latencies.append(sent_at - self.pending.popleft().arrived_at)
+
+    async def _probe_lag(self, interval=0.05):
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            self.max_lag_ms = max(self.max_lag_ms, (time.monotonic() - expected) * 1000)
+
+    async def run(self, messages):
+        await self.setup()
+        probe = asyncio.create_task(self._probe_lag())
+        sends_before = len(self.client.sent)
+        started = time.monotonic()
+
+        for index, (sender, text) in enumerate(messages):
+            event = self.client.new_event(sender, text)
+            self.pending.append(event)
+            await self.client.dispatch(event)
+            if self.args.rate > 0:
+                await asyncio.sleep(max(0, started + (index + 1) / self.args.rate - time.monotonic()))
+            else:
+                await asyncio.sleep(0)
+
+        # Let the last bursts flush and their replies go out
+        deadline = time.monotonic() + self.args.drain
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+
+        probe.cancel()
+        report = self.report(len(messages), len(self.client.sent) - sends_before, elapsed)
+        await self.bot.stop()
+        return report
+
+    def report(self, event_count, sends, elapsed):
+        latencies = sorted(self.latencies)
+        return {
+            "events": event_count,
+            "answered_events": len(latencies),
+            "unanswered_events": len(self.pending),
+            "replies": self.replies,
+            "messages_sent": sends,
+            "typing_actions": self.client.typing_actions,
+            "model_calls": self.model.calls,
+            "elapsed_s": round(elapsed, 3),
+            "events_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0,
+            "sends_per_s": round(sends / elapsed, 2) if elapsed else 0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99": round(percentile(latencies, 0.99) * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1) if latencies else 0
+            },
+            "max_loop_lag_ms": round(self.max_lag_ms, 1),
+            "send_queue": self.userbot.get_send_stats(),
+            "sender_cache": self.userbot.get_cache_stats(),
+            "reply_gate": self.userbot.get_reply_stats()
+        }
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print(f"Events:        {report['events']} ({report['answered_events']} answered, "
+          f"{report['unanswered_events']} unanswered)")
+    print(f"Replies:       {report['replies']} ({report['messages_sent']} messages, "
+          f"{report['typing_actions']} typing actions, {report['model_calls']} model calls)")
+    print(f"Elapsed:       {report['elapsed_s']}s")
+    print(f"Throughput:    {report['events_per_s']} events/s, {report['sends_per_s']} sends/s")
+    print(f"Latency (ms):  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    print(f"Max loop lag:  {report['max_loop_lag_ms']}ms")
+    gate = report["reply_gate"]
+    print(f"Reply gate:    {gate['admitted']} admitted, {gate['dropped_budget']} over budget, "
+          f"{gate['dropped_low_score']} below min score")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay chat traffic through the bot pipeline offline")
+    parser.add_argument('logs', nargs='*', help="session_*.json logs to replay (default: logs/session_*.json)")
+    parser.add_argument('--synthetic', type=int, default=0, help="replay N synthetic messages instead of logs")
+    parser.add_argument('--repeat', type=int, default=1, help="replay the message list this many times")
+    parser.add_argument('--rate', type=float, default=5.0, help="incoming messages per second (0 = as fast as possible)")
+    parser.add_argument('--model-latency', type=float, default=0.5, help="seconds per simulated Gemini call")
+    parser.add_argument('--delay-scale', type=float, default=0.0, help="scale for simulated typing delays (1 = real)")
+    parser.add_argument('--quiet-window', type=float, default=config.COALESCE_QUIET_WINDOW,
+                        help="burst coalescing quiet window (0 disables coalescing)")
+    parser.add_argument('--unthrottled', action='store_true', help="lift the outbound send rate limits")
+    parser.add_argument('--no-streaming', action='store_true', help="wait for the full model response before sending")
+    parser.add_argument('--replies-per-minute', type=int, default=0,
+                        help="reply budget for the chat (0 = unlimited)")
+    parser.add_argument('--min-reply-score', type=float, default=0.0, help="score a message needs for a reply")
+    parser.add_argument('--drain', type=float, default=30.0, help="seconds to wait for outstanding replies")
+    parser.add_argument('--context', default=REPLAY_CONTEXT, help="bot super context")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    responses = None
+    if args.synthetic:
+        messages = synthetic_messages(args.synthetic, args.seed)
+    else:
+        paths = args.logs or sorted(glob.glob("logs/session_*.json"))
+        messages, responses = load_session_messages(paths)
+        if not messages:
+            parser.error("No messages found in the given logs; use --synthetic N")
+    messages = messages * max(1, args.repeat)
+
+    report = asyncio.run(ReplayRun(args, responses).run(messages))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
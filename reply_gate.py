@@ -0,0 +1,118 @@
+import re
+import time
+
+import config
+
+
+class ReplyGate:
+    """Decides which incoming messages are worth a reply, within a per-chat budget
+
+    Each message gets a reply-worthiness score from cheap signals: direct
+    address (a reply to us, an @mention or our persona's name), questions,
+    substance, and how long we've been quiet. Replies are drawn from a
+    budget of `replies_per_minute`; lower-scoring messages need more budget
+    left over, so when the chat is busy the budget goes to messages that
+    matter and the rest are dropped before any model call. Messages
+    addressed to us in a group draw on a separate, larger allowance of
+    `addressed_per_minute`, so 0 turns off unprompted replies only but a
+    flood of mentions still can't run up unbounded model calls. Only
+    private chats are answered without a budget.
+    """
+
+    DIRECT_SCORE = 1.0
+
+    def __init__(self, replies_per_minute=None, min_score=None, reserve=None, persona_name=None,
+                 addressed_per_minute=None):
+        self.replies_per_minute = config.REPLY_BUDGET_PER_MINUTE if replies_per_minute is None else replies_per_minute
+        self.min_score = config.REPLY_MIN_SCORE if min_score is None else min_score
+        self.reserve = config.REPLY_BUDGET_RESERVE if reserve is None else reserve
+        # Being addressed never gets less budget than chiming in unprompted
+        if addressed_per_minute is None:
+            addressed_per_minute = max(config.REPLY_ADDRESSED_PER_MINUTE, self.replies_per_minute)
+        self.addressed_per_minute = addressed_per_minute
+        self.budget = TokenBucket(self.replies_per_minute)
+        self.addressed_budget = TokenBucket(self.addressed_per_minute)
+        self.name_re = None
+        self.set_persona_name(persona_name)
+
+        # Metrics
+        self.scored = 0
+        self.admitted = 0
+        self.dropped_low_score = 0
+        self.dropped_budget = 0
+
+    def set_persona_name(self, name):
+        if name:
+            self.name_re = re.compile(r"(?<!\w)@?" + re.escape(name.lower()) + r"(?!\w)")
+
+    def score(self, text, is_question=False, addressed=False, is_group_chat=True, idle_seconds=0):
+        """Reply-worthiness between 0 and 1"""
+        self.scored += 1
+        if not is_group_chat or addressed:
+            return self.DIRECT_SCORE
+        if self.name_re and self.name_re.search(text.lower()):
+            return self.DIRECT_SCORE
+
+        score = 0.2
+        if is_question:
+            score += 0.35
+        if len(text.split()) >= 4:
+            score += 0.1
+        # The longer we've been quiet, the more natural it is to chime in
+        score += min(0.3, idle_seconds / 600 * 0.3)
+        return min(score, self.DIRECT_SCORE)
+
+    def admit(self, score, private=False):
+        """Spend budget on a reply to a message with this score, or drop it"""
+        # Private chats are a conversation with us - always answered
+        if private:
+            self.admitted += 1
+            return True
+        if score >= self.DIRECT_SCORE:
+            # Mentions and replies to us come out of their own allowance
+            budget, needed = self.addressed_budget, 1
+        elif score < self.min_score:
+            self.dropped_low_score += 1
+            return False
+        else:
+            # Strong messages only need one token; weaker ones leave some for them
+            budget = self.budget
+            needed = min(budget.capacity, 1 + self.reserve * (self.DIRECT_SCORE - score))
+        if not budget.take(needed):
+            self.dropped_budget += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def stats(self):
+        return {
+            "replies_per_minute": self.replies_per_minute,
+            "addressed_per_minute": self.addressed_per_minute,
+            "min_score": self.min_score,
+            "scored": self.scored,
+            "admitted": self.admitted,
+            "dropped_low_score": self.dropped_low_score,
+            "dropped_budget": self.dropped_budget
+        }
+
+
+class TokenBucket:
+    """`per_minute` tokens a minute, up to a minute's worth banked"""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, float(per_minute))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, needed=1):
+        """Spend one token if at least `needed` are left"""
+        if self.per_minute <= 0:
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+        if self.tokens < needed:
+            return False
+        self.tokens -= 1
+        return True
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+logger = logging.getLogger('ResponseCache')
+
+# Emoji (and the joiners/variation selectors around them) to strip before re-decorating
+EMOJI_RE = re.compile("[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200d]+")
+
+# Words that don't change what a question asks
+FILLER_WORDS = {"hey", "hi", "so", "btw", "bro", "guys", "um", "uh", "pls", "please", "yaar", "ok", "okay"}
+
+# Words that don't say what a question is about
+STOPWORDS = {
+    "what", "why", "how", "who", "when", "where", "which", "is", "are", "was", "were", "be", "do", "does",
+    "did", "can", "could", "would", "should", "will", "a", "an", "the", "of", "to", "in", "on", "for",
+    "about", "with", "and", "or", "i", "you", "your", "me", "my", "we", "us", "think", "really", "just"
+}
+
+# Words that point back into the conversation ("what do you mean?", "why is that?")
+ANAPHORIC_WORDS = {
+    "that", "this", "it", "its", "those", "these", "there", "then", "so", "mean", "meant", "he", "she",
+    "they", "them", "him", "her", "one", "same", "also", "else", "more"
+}
+
+
+def normalize_question(message):
+    """Reduce a chat line to the words that identify the question"""
+    content = message.split(': ', 1)[1] if ': ' in message else message
+    words = re.sub(r"[^\w\s]", " ", content.lower()).split()
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+def is_cacheable(message, min_content_words=None):
+    """Whether a question stands on its own, so its answer fits other conversations too"""
+    min_content_words = min_content_words or config.RESPONSE_CACHE_MIN_CONTENT_WORDS
+    content = message.split(': ', 1)[1] if ': ' in message else message
+    if re.search(r"\byou mean\b", content.lower()):
+        return False
+    words = re.sub(r"[^\w\s]", " ", content.lower()).split()
+    content_words = [word for word in words
+                     if word not in FILLER_WORDS and word not in STOPWORDS and word not in ANAPHORIC_WORDS]
+    return len(content_words) >= min_content_words
+
+
+class ResponseCache:
+    """LRU + TTL cache of answers to repeated questions, shared across sessions
+
+    Keys combine the persona (super context), the normalized question and the
+    topic. Each key keeps a few distinct answers so a hit can still vary.
+    """
+
+    def __init__(self, max_size=None, ttl=None, max_variants=None, persist=None):
+        self.max_size = max_size or config.RESPONSE_CACHE_SIZE
+        self.ttl = ttl or config.RESPONSE_CACHE_TTL
+        self.max_variants = max_variants or config.RESPONSE_CACHE_VARIANTS
+        self.entries = OrderedDict()  # key -> {'variants': [[part, ...], ...], 'expires_at': float}
+        self.lock = threading.Lock()  # bots on different loops share one cache
+
+        # Optional Mongo persistence so answers survive restarts
+        self.db_handler = None
+        if persist is None:
+            persist = config.RESPONSE_CACHE_PERSIST
+        if persist:
+            self.db_handler = self._connect_db()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+        self.refreshes = 0
+
+    @staticmethod
+    def _connect_db():
+        if not os.environ.get('MONGO_URI'):
+            return None
+        try:
+            from db_handler import MongoDBHandler
+            handler = MongoDBHandler()
+            return handler if handler.client else None
+        except Exception as e:
+            logger.warning(f"Response cache persistence disabled: {e}")
+            return None
+
+    @staticmethod
+    def make_key(persona, message, topic=""):
+        raw = f"{persona}|{normalize_question(message)}|{(topic or '').lower().strip()[:60]}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key):
+        """Cached answer variants for a key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.time() >= entry['expires_at']:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return list(entry['variants'])
+
+    def put(self, key, parts):
+        """Add an answer (list of message parts) as a variant for key"""
+        parts = [self._strip(part) for part in parts if part]
+        if not parts:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {'variants': []}
+                self.entries[key] = entry
+            if parts not in entry['variants']:
+                entry['variants'].append(parts)
+                del entry['variants'][:-self.max_variants]
+            entry['expires_at'] = time.time() + self.ttl
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return list(entry['variants'])
+
+    async def lookup(self, key):
+        """Variants to answer from, or None to call the model
+
+        A key with fewer than max_variants answers occasionally goes to the
+        model anyway so it collects some variety.
+        """
+        variants = self.get(key)
+        if variants is None and self.db_handler:
+            loop = asyncio.get_running_loop()
+            stored = await loop.run_in_executor(None, self.db_handler.load_cached_response, key)
+            if stored:
+                self.db_hits += 1
+                for parts in stored:
+                    variants = self.put(key, parts)
+
+        if variants is None:
+            self.misses += 1
+            return None
+        if len(variants) < self.max_variants and random.random() < 0.3:
+            self.refreshes += 1
+            return None
+        self.hits += 1
+        return variants
+
+    async def store(self, key, parts):
+        variants = self.put(key, parts)
+        if variants and self.db_handler:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self.db_handler.save_cached_response, key, variants)
+            except Exception as e:
+                logger.warning(f"Error persisting cached response: {e}")
+
+    @staticmethod
+    def _strip(part):
+        return re.sub(r"\s{2,}", " ", EMOJI_RE.sub("", part)).strip()
+
+    def vary(self, variants, emojis):
+        """Pick a variant and decorate it a little differently each time"""
+        parts = list(random.choice(variants))
+        varied = []
+        for part in parts:
+            if random.random() < 0.3 and part[:1].isupper():
+                part = part[0].lower() + part[1:]
+            if random.random() < 0.3 and part.endswith("."):
+                part = part[:-1]
+            varied.append(part)
+        # Same emoji odds as a generated reply
+        if varied and random.random() < 0.45:
+            varied[-1] = f"{varied[-1]} {random.choice(emojis)}"
+        return varied
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.refreshes
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "db_hits": self.db_hits,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0
+        }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """The process-wide response cache (None when disabled)"""
+    global _shared_cache
+    if not config.RESPONSE_CACHE_ENABLED:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache()
+        return _shared_cache
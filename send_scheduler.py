@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import config
+
+logger = logging.getLogger('SendScheduler')
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until one token is available (0 if available now)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+
+async def _iterate(steps):
+    """Iterate a job's steps, whether a list or an async iterator"""
+    if hasattr(steps, '__aiter__'):
+        async for step in steps:
+            yield step
+    else:
+        for step in steps:
+            yield step
+
+
+class OutboundScheduler:
+    """Per-account outbound queue with per-chat and per-account rate limits
+
+    Each job is a list of send steps (callables returning awaitables) that are
+    executed in order, so the parts of a multi-part reply never interleave with
+    another reply to the same chat. A job may also be an async iterator of
+    steps, for replies whose parts are still being generated. A FloodWait
+    pauses only the affected chat.
+    """
+
+    def __init__(self, chat_rate=None, chat_burst=None, account_rate=None, account_burst=None):
+        self.chat_rate = chat_rate or config.SEND_CHAT_RATE
+        self.chat_burst = chat_burst or config.SEND_CHAT_BURST
+        self.account_bucket = TokenBucket(
+            account_rate or config.SEND_ACCOUNT_RATE,
+            account_burst or config.SEND_ACCOUNT_BURST
+        )
+
+        self.queues = {}  # chat_key -> asyncio.Queue of jobs
+        self.workers = {}  # chat_key -> worker task
+        self.chat_buckets = {}  # chat_key -> TokenBucket
+        self.paused_until = {}  # chat_key -> monotonic time the flood wait ends
+        self.pending_steps = {}  # chat_key -> steps queued but not yet sent
+        self.closed = False
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.wait_times = deque(maxlen=500)  # seconds from submit to first send
+
+    async def submit(self, chat_key, steps):
+        """Queue a job for a chat and wait for its results"""
+        # A closed scheduler has no workers left to run the job
+        if self.closed:
+            raise ConnectionError("Send scheduler is closed")
+        if chat_key not in self.queues:
+            self.queues[chat_key] = asyncio.Queue()
+            self.chat_buckets[chat_key] = TokenBucket(self.chat_rate, self.chat_burst)
+            self.pending_steps[chat_key] = 0
+            self.workers[chat_key] = asyncio.create_task(self._worker(chat_key))
+
+        future = asyncio.get_running_loop().create_future()
+        if not hasattr(steps, '__aiter__'):
+            steps = list(steps)
+            self.pending_steps[chat_key] += len(steps)
+        await self.queues[chat_key].put((steps, time.monotonic(), future))
+        return await future
+
+    async def _wait_for_slot(self, chat_key):
+        """Sleep until the chat is unpaused and both buckets have a token"""
+        while True:
+            paused = self.paused_until.get(chat_key, 0) - time.monotonic()
+            delay = max(paused, self.chat_buckets[chat_key].delay(), self.account_bucket.delay())
+            if delay <= 0:
+                self.chat_buckets[chat_key].consume()
+                self.account_bucket.consume()
+                return
+            await asyncio.sleep(delay)
+
+    async def _run_step(self, chat_key, step):
+        """Run one send step, backing off this chat only on flood waits"""
+        while True:
+            await self._wait_for_slot(chat_key)
+            try:
+                return await step()
+            except Exception as e:
+                seconds = getattr(e, 'seconds', None)
+                if seconds is None or type(e).__name__ not in ('FloodWaitError', 'SlowModeWaitError'):
+                    raise
+                self.flood_waits += 1
+                self.paused_until[chat_key] = time.monotonic() + seconds
+                logger.warning(f"Flood wait of {seconds}s on chat {chat_key}; pausing that chat only")
+
+    async def _worker(self, chat_key):
+        queue = self.queues[chat_key]
+        while True:
+            steps, submitted_at, future = await queue.get()
+            streamed = hasattr(steps, '__aiter__')
+            unsent = 0 if streamed else len(steps)  # counted in pending_steps, not yet sent
+            ready_at = submitted_at
+            results = []
+            try:
+                async for step in _iterate(steps):
+                    if streamed:
+                        # Waiting on generation isn't queueing; time from when the step arrived
+                        self.pending_steps[chat_key] += 1
+                        unsent += 1
+                        ready_at = time.monotonic()
+                    if not results:
+                        self.wait_times.append(time.monotonic() - ready_at)
+                    results.append(await self._run_step(chat_key, step))
+                    self.pending_steps[chat_key] -= 1
+                    unsent -= 1
+                    self.sent += 1
+                if not future.done():
+                    future.set_result(results)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                self.pending_steps[chat_key] -= unsent
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
+
+    def metrics(self):
+        """Queue depth and wait-time statistics for tuning"""
+        waits = sorted(self.wait_times)
+        now = time.monotonic()
+        return {
+            "queue_depth": sum(self.pending_steps.values()),
+            "queue_depth_by_chat": dict(self.pending_steps),
+            "paused_chats": [chat for chat, until in self.paused_until.items() if until > now],
+            "sent": self.sent,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "avg_wait_s": round(sum(waits) / len(waits), 3) if waits else 0,
+            "p95_wait_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0,
+            "max_wait_s": round(waits[-1], 3) if waits else 0
+        }
+
+    async def close(self):
+        """Cancel the chat workers and any jobs still queued; later jobs are refused"""
+        self.closed = True
+        for task in self.workers.values():
+            task.cancel()
+        for task in self.workers.values():
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        for queue in self.queues.values():
+            while not queue.empty():
+                _, _, future = queue.get_nowait()
+                if not future.done():
+                    future.cancel()
+        self.workers.clear()
+        self.queues.clear()
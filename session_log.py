@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import re
+from collections import Counter, deque
+from datetime import datetime
+
+import config
+
+logger = logging.getLogger('SessionLog')
+
+
+class SessionLog:
+    """Response log for one session: a bounded in-memory tail plus a JSONL spill file
+
+    Entries are appended to logs/session_<context>_<start>.jsonl as they
+    arrive, so a long session doesn't grow memory and a crash loses
+    nothing. Only the last `tail_size` entries stay in memory; analytics
+    come from running counters, and the full log is read back from the
+    spill file when it's needed (learning, export).
+    """
+
+    def __init__(self, super_context, emojis=(), tail_size=None, log_dir="logs", started_at=None):
+        self.super_context = super_context
+        self.emojis = emojis
+        self.tail = deque(maxlen=tail_size or config.SESSION_LOG_TAIL)
+        self.log_dir = log_dir  # None keeps the log in memory only
+        self.started_at = started_at or datetime.now()
+        self.spill_file = None
+        self.spill_path = None
+        self.spill_failed = False
+        if log_dir:
+            topic_slug = re.sub(r'[^\w]', '_', super_context)[:20]
+            self.spill_path = os.path.join(log_dir, f"session_{topic_slug}_{self.started_at.strftime('%Y%m%d_%H%M%S')}.jsonl")
+
+        # Running totals for analytics
+        self.total = 0
+        self.response_types = Counter()
+        self.topics = Counter()
+        self.users = set()
+        self.total_words = 0
+        self.with_emoji = 0
+
+    def __len__(self):
+        return self.total
+
+    def append(self, entry):
+        self.tail.append(entry)
+        self.total += 1
+        self.response_types[entry["response_type"]] += 1
+        self.topics[entry["topic"]] += 1
+        self.users.add(entry["user"])
+        self.total_words += sum(len(response.split()) for response in entry["bot_responses"])
+        if any(emoji in response for response in entry["bot_responses"] for emoji in self.emojis):
+            self.with_emoji += 1
+        self._spill(entry)
+
+    def _spill(self, entry):
+        if not self.spill_path:
+            return
+        try:
+            if self.spill_file is None:
+                os.makedirs(self.log_dir, exist_ok=True)
+                self.spill_file = open(self.spill_path, 'a', encoding='utf-8')
+            self.spill_file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            self.spill_file.flush()
+        except OSError as e:
+            # Keep going with the in-memory tail rather than fail the reply
+            logger.error(f"Error writing session log to {self.spill_path}: {e}")
+            self.spill_path = None
+            self.spill_failed = True
+
+    def entries(self):
+        """Every entry of the session, oldest first"""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            if self.spill_failed or (self.spill_path and self.total):
+                logger.warning(f"Session log file unavailable; only the last {len(self.tail)} "
+                               f"of {self.total} entries can be read back")
+            yield from list(self.tail)
+            return
+        if self.spill_file is not None:
+            self.spill_file.flush()
+        yield from read_spill(self.spill_path)
+
+    def close(self):
+        """Close the spill file; a later append reopens it"""
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+def read_spill(path):
+    """Entries of a JSONL spill file; a line cut short by a crash is skipped"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def load_responses(log_data, log_path=None):
+    """The responses of a saved session log, inline or from its spill file"""
+    if "responses" in log_data:
+        return log_data["responses"]
+    responses_file = log_data.get("responses_file")
+    if not responses_file:
+        return []
+    # The spill file sits next to the session log
+    if log_path and not os.path.isabs(responses_file):
+        responses_file = os.path.join(os.path.dirname(log_path), responses_file)
+    if not os.path.exists(responses_file):
+        return []
+    return read_spill(responses_file)
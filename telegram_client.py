@@ -6,14 +6,25 @@ import asyncio
 import logging
 import platform
 import socket
-from telethon import TelegramClient, events, connection
+from collections import deque
+from datetime import datetime, timezone
+from telethon import TelegramClient, events, connection, utils
 from telethon.tl.functions.messages import GetHistoryRequest
 from telethon.tl.types import Channel, User, Chat
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, ChatIdInvalidError, PeerIdInvalidError
 from telethon.sessions import StringSession, SQLiteSession
+from message_cache import ChatHistoryBuffer, SenderCache, display_name
+from send_scheduler import OutboundScheduler
+from client_pool import AccountClientPool
+from reply_gate import ReplyGate
+from timer_service import TimerService
 
 # Configure logging
 logger = logging.getLogger('TelegramUserbot')
 
+# Errors meaning our cached peer for the target chat is no longer usable
+STALE_PEER_ERRORS = (ChannelInvalidError, ChannelPrivateError, ChatIdInvalidError, PeerIdInvalidError)
+
 class TelegramUserbot:
     def __init__(self, super_context, target_group, duration, user_id=None, parent_bot=None):
         # Get dynamic config for this user
@@ -29,6 +40,56 @@ class TelegramUserbot:
         self.session_start_timestamp = None
         self.is_group_chat = None  # Will be set during connection
         self.client = None  # We'll initialize this in the start method
+        self.stopped = None  # asyncio.Event created on the hosting loop in start()
+        
+        # Rolling history of the target chat, seeded once and then kept
+        # current from the update stream so replies need no history RPCs
+        self.history_limit = 20
+        self.history = ChatHistoryBuffer(maxlen=self.history_limit)
+        self.target_chat_id = None
+        self.target_entity = None  # Resolved once in start()
+        self.target_peer = None    # InputPeer used by every history/typing/send call
+        self.me_name = "Me"
+        
+        # Per-chat burst coalescing: chat_id -> pending burst state
+        self.coalesce_quiet_window = config.COALESCE_QUIET_WINDOW
+        self.coalesce_max_wait = config.COALESCE_MAX_WAIT
+        self.pending_bursts = {}
+        self.reply_tasks = set()  # uncoalesced replies in flight (cancelled on stop)
+        
+        # Which messages get a reply, within the bot's replies-per-minute budget
+        self.reply_gate = ReplyGate(
+            replies_per_minute=getattr(parent_bot, 'replies_per_minute', None),
+            min_score=getattr(parent_bot, 'min_reply_score', None)
+        )
+        self.sent_ids = deque(maxlen=200)  # our recent message ids, to spot replies to us
+        self.last_sent_at = None
+        
+        # Timers on the shared per-loop timer service (armed in start())
+        self.timers = None
+        self.stop_timer = None
+        self.idle_timer = None
+        self.idle_timeout = config.BOT_IDLE_TIMEOUT
+        
+        # Show typing while the model generates and count that time
+        # against the simulated typing delay
+        self.pipelined_typing = config.PIPELINED_TYPING
+        
+        # Multiplier for the simulated human delays (the replay harness sets 0)
+        self.delay_scale = 1.0
+        
+        # Outbound queue for this account: rate limits, flood waits, ordering.
+        # Replaced by the account's shared queue once start() acquires the client
+        self.send_scheduler = OutboundScheduler()
+        
+        # Sender id -> display name, shared by every history helper below
+        self.sender_cache = SenderCache()
+        
+        # Shared per-account client (see client_pool.py) and our handlers on it
+        self.account_pool = None
+        self.account_key = None
+        self.account_session = None
+        self.handlers = []
         
         # Store reference to parent bot to access AI handler
         self.parent_bot = parent_bot
@@ -42,8 +103,8 @@ class TelegramUserbot:
         self.session_file_exists = os.path.exists(f"{self.config_instance.SESSION_FILE}.session")
         
         # Get API credentials
-        self.api_id = int(self.config_instance.TELEGRAM_API_ID)
-        self.api_hash = self.config_instance.TELEGRAM_API_HASH
+        self.api_id = int(self.config_instance.API_ID) if self.config_instance.API_ID else None
+        self.api_hash = self.config_instance.API_HASH
         
         # Set up better connection parameters for Windows systems
         self.connection_retries = 8  # Increased from 5
@@ -79,10 +140,34 @@ class TelegramUserbot:
                 self.connection_types = [connection.ConnectionTcpFull]
                 self.current_connection_type = 0
     
+    async def _resolve_target(self, refresh=False):
+        """Resolve the target chat once and cache its InputPeer"""
+        if self.target_peer is not None and not refresh:
+            return self.target_peer
+        
+        entity = await self.client.get_entity(self.target_group)
+        self.target_entity = entity
+        self.target_peer = utils.get_input_peer(entity)
+        self.target_chat_id = utils.get_peer_id(entity)
+        if refresh:
+            logger.info(f"Re-resolved target {self.target_group}")
+        return self.target_peer
+    
+    async def _call_with_peer(self, func):
+        """Run func(peer) with the cached peer, re-resolving once if it went stale"""
+        peer = await self._resolve_target()
+        try:
+            return await func(peer)
+        except STALE_PEER_ERRORS as e:
+            logger.warning(f"Cached peer for {self.target_group} is stale ({e}), refreshing")
+            peer = await self._resolve_target(refresh=True)
+            return await func(peer)
+    
     async def _check_chat_type(self):
         """Determine if we're in a group chat or individual conversation"""
         try:
-            entity = await self.client.get_entity(self.target_group)
+            await self._resolve_target()
+            entity = self.target_entity
             self.is_group_chat = isinstance(entity, (Channel, Chat))
             if not self.is_group_chat:
                 print(f"Target {self.target_group} is a private conversation with {entity.first_name}")
@@ -95,38 +180,125 @@ class TelegramUserbot:
             self.is_group_chat = True  # Default to group chat if we can't determine
             return self.is_group_chat
     
+    async def _fetch_history_entries(self, limit=20):
+        """Fetch recent messages from the group as (message_id, line) pairs"""
+        history = await self._call_with_peer(lambda peer: self.client(GetHistoryRequest(
+            peer=peer,
+            limit=limit,
+            offset_date=None,
+            offset_id=0,
+            max_id=0,
+            min_id=0,
+            add_offset=0,
+            hash=0
+        )))
+        
+        # The response already carries every sender we need
+        self.sender_cache.prefill(history.users)
+        self.sender_cache.prefill(history.chats)
+        
+        entries = []
+        for message in reversed(history.messages):
+            if message.message:
+                sender_id = utils.get_peer_id(message.from_id) if message.from_id else None
+                sender_name = await self._get_sender_name(sender_id) if sender_id else "Unknown"
+                entries.append((message.id, self._format_message(sender_name, message.message)))
+        return entries
+    
     async def get_recent_messages(self, limit=20):
         """Get recent messages from the group for context"""
         if not self.client:
             return []
             
         try:
-            entity = await self.client.get_entity(self.target_group)
-            history = await self.client(GetHistoryRequest(
-                peer=entity,
-                limit=limit,
-                offset_date=None,
-                offset_id=0,
-                max_id=0,
-                min_id=0,
-                add_offset=0,
-                hash=0
-            ))
-            messages = []
-            for message in reversed(history.messages):
-                if message.message:
-                    try:
-                        sender = await self.client.get_entity(message.from_id) if message.from_id else None
-                        sender_name = f"{sender.first_name}" if sender else "Unknown"
-                        messages.append(f"{sender_name}: {message.message}")
-                    except Exception as e:
-                        print(f"Error getting sender: {e}")
-                        messages.append(f"User: {message.message}")
-            return messages
+            return [line for _, line in await self._fetch_history_entries(limit)]
         except Exception as e:
             print(f"Error getting recent messages: {e}")
             return []
     
+    async def _seed_history(self):
+        """Fill the history buffer once from the server at startup"""
+        try:
+            await self._resolve_target()
+            me = await self.client.get_me()
+            if me and me.first_name:
+                self.me_name = me.first_name
+            entries = await self._fetch_history_entries(self.history_limit)
+            self.history.seed(self.target_chat_id, entries)
+            logger.info(f"Seeded history buffer with {len(entries)} messages")
+            return True
+        except Exception as e:
+            logger.error(f"Error seeding history buffer: {e}")
+            return False
+    
+    def _format_message(self, sender_name, text):
+        """Format a message the way the AI handler expects it"""
+        return f"{sender_name}: {text}"
+    
+    def _record_sent(self, message):
+        """Add a message we sent to the history buffer"""
+        if message is None:
+            return
+        self.sent_ids.append(message.id)
+        self.last_sent_at = time.time()
+        if getattr(message, 'message', None) and self.target_chat_id is not None:
+            self.history.append(self.target_chat_id, message.id, self._format_message(self.me_name, message.message))
+    
+    async def _get_sender_name(self, sender_id, sender=None):
+        """Resolve a sender's display name through the cache"""
+        found, name = self.sender_cache.lookup(sender_id)
+        if found:
+            return name or "User"
+        
+        # Entities attached to the update avoid a round trip entirely
+        if sender is None:
+            try:
+                self.sender_cache.rpc_lookups += 1
+                sender = await self.client.get_entity(sender_id)
+            except Exception as e:
+                logger.warning(f"Error getting sender {sender_id}: {e}")
+                self.sender_cache.put_missing(sender_id)
+                return "User"
+        
+        name = display_name(sender)
+        self.sender_cache.put(sender_id, name)
+        return name or "User"
+    
+    async def _event_sender_name(self, event):
+        """Get a display name for the sender of an update"""
+        if event.sender_id is None:
+            return "User"
+        return await self._get_sender_name(event.sender_id, sender=event.sender)
+    
+    def get_cache_stats(self):
+        """Hit/miss counters for the sender cache"""
+        return self.sender_cache.stats()
+    
+    def get_send_stats(self):
+        """Queue depth and wait-time metrics for outbound messages"""
+        return self.send_scheduler.metrics()
+    
+    def get_reply_stats(self):
+        """How many messages were scored, replied to or dropped"""
+        return self.reply_gate.stats()
+    
+    async def edit_handler(self, event):
+        """Keep buffered messages in sync with edits"""
+        try:
+            if not event.message.text:
+                return
+            sender_name = await self._event_sender_name(event)
+            self.history.edit(event.chat_id, event.message.id, self._format_message(sender_name, event.message.text))
+        except Exception as e:
+            logger.error(f"Error handling edit: {e}")
+    
+    async def delete_handler(self, event):
+        """Drop deleted messages from the history buffer"""
+        try:
+            self.history.delete(event.deleted_ids, chat_id=event.chat_id)
+        except Exception as e:
+            logger.error(f"Error handling delete: {e}")
+    
     async def send_ai_response(self, context, event=None):
         """Generate and send AI response with error handling"""
         try:
@@ -135,36 +307,129 @@ class TelegramUserbot:
                 print("AI handler not initialized yet. Cannot generate response.")
                 return False
             
+            # In pipelined mode the typing indicator runs while the model works,
+            # and stays up until the first part is sent
+            typing_started_at = None
+            typing_done = asyncio.Event()
+            typing_task = None
+            
+            def start_typing():
+                nonlocal typing_started_at, typing_task
+                # Only once the model is called; ignored and local replies don't "type" early
+                if self.pipelined_typing and typing_task is None:
+                    typing_started_at = time.monotonic()
+                    typing_task = asyncio.create_task(self._typing_until(typing_done))
+            
+            # All parts go out as one job, in order; each is queued as soon as
+            # it's generated, so the first can be sent while the rest streams in
+            parts = asyncio.Queue()
+            send_job = None
+            
+            async def steps():
+                index = 0
+                while True:
+                    item = await parts.get()
+                    if item is None:
+                        return
+                    message, should_reply = item
+                    # The first part takes over the typing shown during generation
+                    held = index == 0 and typing_task is not None
+                    yield self._make_send_step(
+                        message,
+                        reply_to=event if should_reply else None,
+                        pause_before=index > 0,
+                        typing_started_at=typing_started_at if held else None,
+                        typing_done=typing_done if held else None
+                    )
+                    index += 1
+            
+            def queue_part(message, should_reply):
+                nonlocal send_job
+                parts.put_nowait((message, should_reply))
+                # Take a place in the chat's send queue only once there's something
+                # to send, so replies behind this one aren't held up by its generation
+                if send_job is None:
+                    send_job = asyncio.create_task(self.send_scheduler.submit(self.target_chat_id or self.target_group, steps()))
+            
             # Generate response using the parent bot's AI handler
             message_id = event.id if event else None
-            response_data = await self.parent_bot.generate_ai_response(
-                context, 
-                is_group_chat=self.is_group_chat,
-                message_id_to_reply=message_id
-            )
-            
-            # Send message(s)
-            for message in response_data['messages']:
-                # Add typing simulation
-                async with self.client.action(self.target_group, 'typing'):
-                    # Random delay to simulate human typing
-                    delay = min(0.1 * len(message), 5.0)
-                    await asyncio.sleep(delay)
-                
-                if response_data.get('should_reply') and event:
-                    await event.reply(message)
-                else:
-                    await self.client.send_message(self.target_group, message)
-                
-                # Sleep between multiple messages
-                if len(response_data['messages']) > 1:
-                    await asyncio.sleep(random.uniform(1.5, 3.0))
+            try:
+                try:
+                    response_data = await self.parent_bot.generate_ai_response(
+                        context, 
+                        is_group_chat=self.is_group_chat,
+                        message_id_to_reply=message_id,
+                        on_part=queue_part,
+                        on_generate=start_typing
+                    )
                     
+                    # Queue whatever wasn't streamed
+                    for message in response_data['messages'][response_data.get('streamed', 0):]:
+                        queue_part(message, response_data.get('should_reply'))
+                finally:
+                    parts.put_nowait(None)
+                
+                if send_job is not None:
+                    await send_job
+            finally:
+                # Nothing to send, or the send failed
+                typing_done.set()
             return True
         except Exception as e:
             print(f"Error sending AI response: {e}")
             return False
     
+    async def _typing_until(self, done):
+        """Show the typing indicator until `done` is set"""
+        async def hold(peer):
+            async with self.client.action(peer, 'typing'):
+                await done.wait()
+        
+        try:
+            await self._call_with_peer(hold)
+        except Exception as e:
+            logger.warning(f"Error showing typing indicator: {e}")
+    
+    def _make_send_step(self, message, reply_to=None, pause_before=False, typing_started_at=None, typing_done=None):
+        """Build a send step for the outbound scheduler
+
+        typing_done is for a typing indicator that's already showing (see
+        _typing_until): the step keeps it up instead of starting its own,
+        and sets typing_done once the message is out.
+        """
+        async def send(peer):
+            # Random delay to simulate human typing, minus any typing time
+            # already shown while the response was being generated
+            delay = min(0.1 * len(message), 5.0) * self.delay_scale
+            if typing_started_at is not None:
+                delay -= time.monotonic() - typing_started_at
+            
+            # Add typing simulation
+            if typing_done is not None:
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif delay > 0:
+                async with self.client.action(peer, 'typing'):
+                    await asyncio.sleep(delay)
+            
+            try:
+                if reply_to is not None:
+                    return await reply_to.reply(message)
+                return await self.client.send_message(peer, message)
+            finally:
+                if typing_done is not None:
+                    typing_done.set()
+        
+        async def step():
+            # Sleep between multiple messages
+            if pause_before:
+                await asyncio.sleep(random.uniform(1.5, 3.0) * self.delay_scale)
+            
+            sent = await self._call_with_peer(send)
+            self._record_sent(sent)
+            return sent
+        return step
+    
     async def _post_initial_message(self):
         """Send an initial message to start the conversation"""
         try:
@@ -177,9 +442,17 @@ class TelegramUserbot:
             initial_message = await self.parent_bot.generate_initial_message()
             
             # Send initial message with typing simulation
-            async with self.client.action(self.target_group, 'typing'):
-                await asyncio.sleep(random.uniform(1.5, 3.0))
-                await self.client.send_message(self.target_group, initial_message)
+            async def send(peer):
+                async with self.client.action(peer, 'typing'):
+                    await asyncio.sleep(random.uniform(1.5, 3.0) * self.delay_scale)
+                    return await self.client.send_message(peer, initial_message)
+            
+            async def step():
+                sent = await self._call_with_peer(send)
+                self._record_sent(sent)
+                return sent
+            
+            await self.send_scheduler.submit(self.target_chat_id or self.target_group, [step])
             
             print(f"Sent initial message: {initial_message}")
             return True
@@ -299,8 +572,14 @@ class TelegramUserbot:
             logger.error(f"Error creating client with {conn_type.__name__}: {e}")
             return None
 
-    async def start(self):
-        """Start the userbot with improved error handling for WinError 64 issues"""
+    async def wait_until_stopped(self):
+        """Wait until the session ends (duration expired or stop() called)"""
+        if self.stopped is None:
+            return
+        await self.stopped.wait()
+    
+    async def _connect_new_client(self):
+        """Create, connect and authorize a TelegramClient for this account"""
         # Clean up any corrupted session files
         await self.check_and_clean_sessions()
         
@@ -315,12 +594,12 @@ class TelegramUserbot:
             try:
                 # Create client with current connection type
                 if self.is_windows:
-                    self.client = await self.create_client_with_connection_type(
+                    client = await self.create_client_with_connection_type(
                         self.current_connection_type % len(self.connection_types)
                     )
                 else:
                     # Standard client creation for non-Windows
-                    self.client = TelegramClient(
+                    client = TelegramClient(
                         self.session_path,
                         self.api_id,
                         self.api_hash,
@@ -329,45 +608,26 @@ class TelegramUserbot:
                         auto_reconnect=True
                     )
                 
-                if not self.client:
+                if not client:
                     raise ConnectionError(f"Failed to create client with connection type {self.current_connection_type}")
                 
-                # Add handlers
-                self.client.add_event_handler(
-                    self.message_handler,
-                    events.NewMessage(chats=self.target_group)
-                )
-                
                 # Connect with a timeout
                 try:
                     # Use the recommended approach for Windows to connect
                     if self.is_windows:
                         logger.info("Using special Windows connection approach...")
                         # Set a timeout for connection
-                        await asyncio.wait_for(self.client.connect(), timeout=45)
+                        await asyncio.wait_for(client.connect(), timeout=45)
                     else:
-                        await self.client.connect()
+                        await client.connect()
                     
                     # If we got here, connection succeeded
-                    if await self.client.is_user_authorized():
+                    if await client.is_user_authorized():
                         logger.info("Successfully connected and authorized!")
-                        self.running = True
-                        self.session_start_timestamp = datetime.now()
-                        
-                        # Check chat type
-                        await self._check_chat_type()
-                        
-                        # Send initial message
-                        await self._post_initial_message()
-                        
-                        # Schedule stop
-                        asyncio.create_task(self._schedule_stop())
                         
                         # Reset connection errors counter
                         self.connection_errors = 0
-                        
-                        # Keep client running
-                        return
+                        return client
                     else:
                         raise ConnectionError("User is not authorized. Please verify Telegram credentials.")
                 except asyncio.TimeoutError:
@@ -380,6 +640,10 @@ class TelegramUserbot:
                 except Exception as e:
                     logger.error(f"Error during connection: {str(e)}")
                 
+                # Don't leave a half-open client holding the session file
+                if client.is_connected():
+                    await client.disconnect()
+                
                 # If we reach here, connection failed, increment attempts and try again
                 connection_attempts += 1
                 
@@ -423,75 +687,258 @@ class TelegramUserbot:
         # If we get here without returning, it means we couldn't connect
         raise ConnectionError("Failed to establish a connection to Telegram servers after all attempts")
     
+    def _add_handlers(self):
+        """Register this bot's chat-filtered handlers on the shared client"""
+        self.handlers = [
+            (self.message_handler, events.NewMessage(chats=self.target_group)),
+            (self.edit_handler, events.MessageEdited(chats=self.target_group)),
+            (self.delete_handler, events.MessageDeleted(chats=self.target_group))
+        ]
+        for callback, event in self.handlers:
+            self.client.add_event_handler(callback, event)
+    
+    def _remove_handlers(self):
+        """Take this bot's handlers off the shared client"""
+        for callback, event in self.handlers:
+            self.client.remove_event_handler(callback, event)
+        self.handlers = []
+    
+    async def start(self):
+        """Start the userbot on its account's shared Telegram client"""
+        self.stopped = asyncio.Event()
+        
+        # Every bot of the same account shares one connection and session file
+        self.account_pool = AccountClientPool.for_loop()
+        self.account_key = self.user_id or self.session_path
+        session = await self.account_pool.acquire(self.account_key, self._connect_new_client)
+        self.account_session = session
+        self.client = session.client
+        self.send_scheduler = session.send_scheduler
+        self.sender_cache = session.sender_cache
+        
+        try:
+            # Add handlers
+            self._add_handlers()
+            
+            self.running = True
+            self.session_start_timestamp = datetime.now(timezone.utc)
+            
+            # Check chat type
+            await self._check_chat_type()
+            
+            # Seed the history buffer once; updates keep it current
+            await self._seed_history()
+            
+            # Messages naming the persona count as addressed to us
+            if self.parent_bot and self.parent_bot.ai_handler:
+                self.reply_gate.set_persona_name(self.parent_bot.ai_handler.persona_name)
+            
+            # Send initial message
+            await self._post_initial_message()
+            
+            # Schedule stop and watch for disconnects
+            self._schedule_stop()
+        except BaseException:
+            # A failed or timed-out start is retried by GeminiUserbot; don't leave
+            # our handlers on the shared client or keep our reference to it
+            await self.stop()
+            raise
+    
     async def message_handler(self, event):
         """Handle incoming messages"""
         try:
+            # Get message text
+            message_text = event.message.text
+            if not message_text:
+                return  # Skip empty or non-text messages
+            
+            # Record every message (ours included) in the history buffer
+            sender_name = await self._event_sender_name(event)
+            self.history.append(event.chat_id, event.message.id, self._format_message(sender_name, message_text))
+            
             # Skip messages from ourselves
-            if event.from_id == 'me':
+            if event.out or event.from_id == 'me':
                 return
                 
             # Skip messages older than our start time
             if self.session_start_timestamp and event.date < self.session_start_timestamp:
                 return
             
-            # Get message text
-            message_text = event.message.text
-            if not message_text:
-                return  # Skip empty or non-text messages
+            self._reset_idle_timer()
+            
+            # Fold the message into the chat's pending burst
+            self._queue_burst(event, self._reply_score(event, message_text))
             
-            # Get recent messages for context
-            recent_messages = await self.get_recent_messages()
+        except Exception as e:
+            logger.error(f"Error handling message: {e}")
+    
+    def _reply_score(self, event, text):
+        """Reply-worthiness of an incoming message (see ReplyGate)"""
+        message = event.message
+        addressed = bool(getattr(message, 'mentioned', False)) or getattr(message, 'reply_to_msg_id', None) in self.sent_ids
+        ai_handler = self.parent_bot.ai_handler if self.parent_bot else None
+        is_question = text.rstrip().endswith('?') or bool(ai_handler and ai_handler.lexicon.has(text, 'question'))
+        quiet_since = self.last_sent_at or self.start_time or time.time()
+        return self.reply_gate.score(text, is_question=is_question, addressed=addressed,
+                                     is_group_chat=self.is_group_chat is not False,
+                                     idle_seconds=time.time() - quiet_since)
+    
+    def _queue_burst(self, event, score=ReplyGate.DIRECT_SCORE):
+        """Add a message to its chat's burst and (re)arm the quiet timer"""
+        chat_id = event.chat_id
+        now = time.time()
+        
+        # Coalescing disabled - reply to every message straight away
+        if self.coalesce_quiet_window <= 0:
+            task = asyncio.create_task(self._reply_to_burst(chat_id, event, 1, score))
+            self.reply_tasks.add(task)
+            task.add_done_callback(self.reply_tasks.discard)
+            return
+        
+        burst = self.pending_bursts.get(chat_id)
+        if burst is None:
+            burst = {'first_at': now, 'count': 0, 'task': None, 'score': 0}
+            self.pending_bursts[chat_id] = burst
+        elif burst['task']:
+            burst['task'].cancel()
+        
+        burst['event'] = event
+        burst['count'] += 1
+        # A burst is as worth answering as its best message
+        burst['score'] = max(burst['score'], score)
+        
+        # Wait for a quiet window, but never past the burst's max wait
+        remaining = self.coalesce_max_wait - (now - burst['first_at'])
+        delay = max(0, min(self.coalesce_quiet_window, remaining))
+        burst['task'] = asyncio.create_task(self._flush_burst(chat_id, delay))
+    
+    async def _flush_burst(self, chat_id, delay):
+        """Reply once to a burst after its quiet window expires"""
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+        
+        burst = self.pending_bursts.pop(chat_id, None)
+        if not burst or not self.running:
+            return
+        
+        # No longer a pending burst, but still cancelled on stop until the reply is out
+        task = asyncio.current_task()
+        self.reply_tasks.add(task)
+        task.add_done_callback(self.reply_tasks.discard)
+        
+        await self._reply_to_burst(chat_id, burst['event'], burst['count'], burst['score'])
+    
+    async def _reply_to_burst(self, chat_id, event, count, score=ReplyGate.DIRECT_SCORE):
+        """Generate one response over the merged context of a burst"""
+        try:
+            # Out of budget for a message this unimportant - drop it before any model call
+            if not self.reply_gate.admit(score, private=self.is_group_chat is False):
+                logger.debug(f"Skipping reply (score {score:.2f}) in chat {chat_id}")
+                return
+            
+            if count > 1:
+                logger.info(f"Coalesced {count} messages into one reply")
+            
+            # Recent messages for context come straight from the buffer
+            entries = self.history.entries(chat_id)
             
             # Prepare context for AI
             context = {
-                'message': message_text,
-                'recent_messages': recent_messages,
-                'is_group_chat': self.is_group_chat
+                'message': event.message.text,
+                'recent_messages': [line for _, line in entries],
+                'message_ids': [message_id for message_id, _ in entries],
+                'is_group_chat': self.is_group_chat,
+                'burst_size': count
             }
             
             # Generate and send response
             await self.send_ai_response(context, event)
-            
         except Exception as e:
-            logger.error(f"Error handling message: {e}")
+            logger.error(f"Error replying to burst: {e}")
+    
+    def _cancel_pending_bursts(self):
+        """Drop any bursts still waiting for their quiet window, and uncoalesced replies"""
+        for burst in self.pending_bursts.values():
+            if burst['task']:
+                burst['task'].cancel()
+        self.pending_bursts.clear()
+        for task in list(self.reply_tasks):
+            task.cancel()
+        self.reply_tasks.clear()
     
-    async def _schedule_stop(self):
-        """Schedule the bot to stop after the specified duration"""
+    def _schedule_stop(self):
+        """Arm session expiry (and idle timeout) on the shared timer service"""
         self.start_time = time.time()
-        
-        # Keep running until duration expires
-        while self.running and (time.time() - self.start_time < self.duration):
-            await asyncio.sleep(5)  # Check every 5 seconds
-            
-            # Check if connection is still valid
-            if self.client and not self.client.is_connected():
-                logger.warning("Connection lost, attempting to reconnect...")
-                try:
-                    await self.client.connect()
-                except Exception as e:
-                    logger.error(f"Reconnection failed: {e}")
-                    
-        # Stop the bot after duration
+        self.timers = TimerService.for_loop()
+        self.stop_timer = self.timers.schedule(self.duration, self._on_session_expired, kind="session_expiry")
+        self._reset_idle_timer()
+        self.account_session.subscribe(self._on_connection_change)
+    
+    def _reset_idle_timer(self):
+        """Push the idle deadline back after activity in the chat"""
+        if not self.timers or self.idle_timeout <= 0:
+            return
+        self.timers.cancel(self.idle_timer)
+        self.idle_timer = self.timers.schedule(self.idle_timeout, self._on_idle_timeout, kind="idle_timeout")
+    
+    async def _on_session_expired(self):
+        """Stop the bot exactly when its duration runs out"""
         if self.running:
             logger.info(f"Bot session duration ({self.duration/60:.1f} minutes) completed")
-            self.running = False
             await self.stop()
     
+    async def _on_idle_timeout(self):
+        """Stop the bot after a long stretch with no chat activity"""
+        if self.running:
+            logger.info(f"No activity for {self.idle_timeout/60:.1f} minutes, stopping bot")
+            await self.stop()
+    
+    def _on_connection_change(self, connected):
+        """The account's shared client dropped or came back (reconnecting is AccountSession's job)"""
+        if not self.running:
+            return
+        if connected:
+            logger.info("Reconnected to Telegram")
+        else:
+            logger.warning("Connection lost, waiting for the account's client to reconnect...")
+    
+    def _cancel_timers(self):
+        if not self.timers:
+            return
+        for timer in (self.stop_timer, self.idle_timer):
+            self.timers.cancel(timer)
+        self.stop_timer = self.idle_timer = None
+    
     async def stop(self):
-        """Stop the Telegram client with improved cleanup"""
+        """Stop this bot and release its share of the account's client"""
         self.running = False
+        self._cancel_timers()
+        self._cancel_pending_bursts()
+        if self.account_session:
+            self.account_session.unsubscribe(self._on_connection_change)
+            self.account_session = None
         
-        # Disconnect client if it exists
+        # Other bots may still be using the client, so only detach from it;
+        # the pool disconnects once the last bot of the account has stopped
         if self.client:
             try:
-                # Proper disconnection sequence
-                if self.client.is_connected():
-                    logger.info("Properly disconnecting client...")
+                self._remove_handlers()
+                if self.account_pool:
+                    await self.account_pool.release(self.account_key)
+                    self.account_pool = None
+                elif self.client.is_connected():
                     await self.client.disconnect()
-                else:
-                    logger.info("Client already disconnected")
                     
                 # Cleanup
                 self.client = None
+                self.history.clear()
+                self.target_peer = None
+                self.target_entity = None
             except Exception as e:
-                logger.error(f"Error disconnecting Telegram client: {e}")
\ No newline at end of file
+                logger.error(f"Error disconnecting Telegram client: {e}")
+        
+        # Wake anyone waiting on the session to end
+        if self.stopped is not None:
+            self.stopped.set()
\ No newline at end of file
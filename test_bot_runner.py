@@ -0,0 +1,37 @@
+import multiprocessing
+import time
+
+import pytest
+
+from bot_runner import LocalBotRunner, WorkerHandle
+
+
+def fake_start(self, bot_config, user):
+    # Stands in for a hosted bot; only the runner's bookkeeping matters here
+    self.owners[str(bot_config['_id'])] = user['id']
+    return True, "started"
+
+
+def slow_metrics(self):
+    time.sleep(2)
+    return {"slow": True}
+
+
+def test_slow_metrics_leaves_running_bots_alive(monkeypatch):
+    monkeypatch.setattr(LocalBotRunner, 'start', fake_start)
+    monkeypatch.setattr(LocalBotRunner, 'metrics', slow_metrics)
+    # Forked so the worker gets the patched runner
+    worker = WorkerHandle(0, multiprocessing.get_context('fork'))
+    try:
+        assert worker.request('start', {'_id': 'bot-1'}, {'id': 'user-1'}) == (True, "started")
+        pid = worker.process.pid
+
+        with pytest.raises(TimeoutError):
+            worker.request('metrics', timeout=0.5)
+
+        # Same process, bot still there, and the late metrics reply isn't mistaken for this one
+        assert worker.process.pid == pid
+        assert worker.restarts == 0
+        assert worker.request('running_bot_ids', None) == {'bot-1'}
+    finally:
+        worker.shutdown()
@@ -0,0 +1,50 @@
+import asyncio
+
+from conversation_context import RollingContext
+
+
+def make_context():
+    folded = []
+
+    async def summarize(summary, lines):
+        folded.extend(lines)
+        return "summary"
+
+    return RollingContext(summarize=summarize, verbatim_messages=2, summary_every=1), folded
+
+
+async def observe(context, history):
+    context.observe([line for _, line in history], [message_id for message_id, _ in history])
+    if context.refresh_task:
+        await context.refresh_task
+
+
+def test_edit_after_fold_is_not_folded_again():
+    async def run():
+        context, folded = make_context()
+        history = [(1, "A: one"), (2, "B: two"), (3, "A: three")]
+        await observe(context, history)
+        assert folded == ["A: one"]
+
+        # Editing a message already seen doesn't make it (or those after it) new
+        history[1] = (2, "B: two (edited)")
+        await observe(context, history)
+        assert folded == ["A: one"]
+
+        await observe(context, history + [(4, "B: four")])
+        assert folded == ["A: one", "B: two"]
+    asyncio.run(run())
+
+
+def test_delete_after_fold_is_not_folded_again():
+    async def run():
+        context, folded = make_context()
+        history = [(1, "A: one"), (2, "B: two"), (3, "A: three")]
+        await observe(context, history)
+
+        # The deleted line leaves a history whose tail no longer matches
+        del history[1]
+        await observe(context, history + [(4, "B: four")])
+        assert folded == ["A: one", "B: two"]
+        assert context.recent == ["A: three", "B: four"]
+    asyncio.run(run())
@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import weakref
+
+logger = logging.getLogger('TimerService')
+
+
+class Timer:
+    """Handle for a scheduled callback; cancel() is cheap and idempotent"""
+
+    __slots__ = ('deadline', 'seq', 'callback', 'args', 'kind', 'cancelled', 'fired')
+
+    def __init__(self, deadline, seq, callback, args, kind):
+        self.deadline = deadline
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.kind = kind
+        self.cancelled = False
+        self.fired = False
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class TimerService:
+    """One heap of deadlines per event loop, shared by every bot on that loop
+
+    Only the earliest deadline is armed on the loop at any time, so a fleet of
+    bots costs one wakeup per actual expiry instead of periodic polling.
+    """
+
+    _instances = weakref.WeakKeyDictionary()  # loop -> TimerService
+
+    @classmethod
+    def for_loop(cls, loop=None):
+        """Get the shared timer service for a loop (the running one by default)"""
+        loop = loop or asyncio.get_running_loop()
+        service = cls._instances.get(loop)
+        if service is None:
+            service = cls(loop)
+            cls._instances[loop] = service
+        return service
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.heap = []
+        self.counter = itertools.count()
+        self.armed_handle = None
+        self.armed_deadline = None
+        self.cancelled_in_heap = 0
+
+        # Metrics
+        self.fired = 0
+        self.max_lateness_ms = 0.0
+
+    def schedule(self, delay, callback, *args, kind="timer"):
+        """Run callback(*args) after delay seconds; coroutine functions become tasks"""
+        timer = Timer(time.monotonic() + max(0.0, delay), next(self.counter), callback, args, kind)
+        heapq.heappush(self.heap, timer)
+        self._arm()
+        return timer
+
+    def cancel(self, timer):
+        if timer and not timer.cancelled and not timer.fired:
+            timer.cancel()
+            self.cancelled_in_heap += 1
+            # Rebuild once cancelled entries dominate the heap
+            if self.cancelled_in_heap > 64 and self.cancelled_in_heap * 2 > len(self.heap):
+                self.heap = [t for t in self.heap if not t.cancelled]
+                heapq.heapify(self.heap)
+                self.cancelled_in_heap = 0
+
+    def _arm(self):
+        """Make sure the loop wakes exactly at the earliest live deadline"""
+        while self.heap and self.heap[0].cancelled:
+            heapq.heappop(self.heap)
+            self.cancelled_in_heap = max(0, self.cancelled_in_heap - 1)
+
+        if not self.heap:
+            if self.armed_handle:
+                self.armed_handle.cancel()
+            self.armed_handle = None
+            self.armed_deadline = None
+            return
+
+        deadline = self.heap[0].deadline
+        if self.armed_handle and self.armed_deadline <= deadline:
+            return
+        if self.armed_handle:
+            self.armed_handle.cancel()
+
+        # Convert our monotonic deadline to the loop's clock
+        when = self.loop.time() + (deadline - time.monotonic())
+        self.armed_handle = self.loop.call_at(when, self._fire)
+        self.armed_deadline = deadline
+
+    def _fire(self):
+        self.armed_handle = None
+        self.armed_deadline = None
+        now = time.monotonic()
+
+        while self.heap and self.heap[0].deadline <= now:
+            timer = heapq.heappop(self.heap)
+            if timer.cancelled:
+                self.cancelled_in_heap = max(0, self.cancelled_in_heap - 1)
+                continue
+            timer.fired = True
+            self.fired += 1
+            self.max_lateness_ms = max(self.max_lateness_ms, (now - timer.deadline) * 1000)
+            try:
+                if asyncio.iscoroutinefunction(timer.callback):
+                    self.loop.create_task(timer.callback(*timer.args))
+                else:
+                    timer.callback(*timer.args)
+            except Exception as e:
+                logger.error(f"Error in {timer.kind} timer callback: {e}")
+
+        self._arm()
+
+    def metrics(self):
+        pending = [t for t in self.heap if not t.cancelled]
+        kinds = {}
+        for timer in pending:
+            kinds[timer.kind] = kinds.get(timer.kind, 0) + 1
+        return {
+            "pending": len(pending),
+            "pending_by_kind": kinds,
+            "fired": self.fired,
+            "max_lateness_ms": round(self.max_lateness_ms, 2)
+        }
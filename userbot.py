@@ -14,11 +14,16 @@ logging.basicConfig(level=logging.INFO,
 logger = logging.getLogger('GeminiUserbot')
 
 class GeminiUserbot:
-    def __init__(self, super_context, target_group, duration=30, user_id=None):
+    def __init__(self, super_context, target_group, duration=30, user_id=None, api_keys=None):
         self.super_context = super_context
         self.target_group = target_group
         self.duration = duration
         self.user_id = user_id
+        self.api_keys = api_keys or []  # the user's other stored Gemini keys
+        
+        # Reply budget for the chat (None uses the config defaults)
+        self.replies_per_minute = None
+        self.min_reply_score = None
         self.learning_enabled = True
         self._is_running = False
         
@@ -36,12 +41,18 @@ class GeminiUserbot:
         self.connection_attempts = 0
         self.max_attempts = 5  # Increased from 3 to 5
     
-    async def generate_ai_response(self, context, is_group_chat=True, message_id_to_reply=None):
+    async def generate_ai_response(self, context, is_group_chat=True, message_id_to_reply=None, on_part=None,
+                                   on_generate=None):
         """Generate response using the AI handler"""
         if not self.ai_handler:
             raise Exception("AI handler not initialized. Please start the bot first.")
         
-        return await self.ai_handler.generate_response(context, is_group_chat, message_id_to_reply)
+        # The Telegram client passes a context dict; the AI handler wants the message list
+        message_history = context.get('recent_messages', []) if isinstance(context, dict) else context
+        message_ids = context.get('message_ids') if isinstance(context, dict) else None
+        return await self.ai_handler.generate_response(message_history, is_group_chat, message_id_to_reply,
+                                                       on_part=on_part, on_generate=on_generate,
+                                                       message_ids=message_ids)
     
     async def generate_initial_message(self):
         """Generate an initial message to start the conversation"""
@@ -121,7 +132,8 @@ class GeminiUserbot:
             self.ai_handler = GeminiAI(
                 super_context=self.super_context,
                 api_key=gemini_api_key,
-                user_id=self.user_id  # Pass user_id for usage tracking
+                user_id=self.user_id,  # Pass user_id for usage tracking
+                api_keys=self.api_keys
             )
             
             # Verify API key is valid and check free tier status
@@ -184,11 +196,20 @@ class GeminiUserbot:
             self.log.error(f"Error starting GeminiUserbot: {str(e)}")
             raise
     
+    async def wait_until_stopped(self):
+        """Wait until the Telegram session ends"""
+        if self.telegram_client:
+            await self.telegram_client.wait_until_stopped()
+    
     async def stop(self):
         """Stop the userbot"""
         self.log.info("Stopping Telegram Gemini Userbot...")
         self._is_running = False
         
+        # Don't wait for (or pay for) replies that will never be sent
+        if self.ai_handler:
+            self.ai_handler.cancel_pending_calls()
+        
         # Stop the Telegram client
         if self.telegram_client:
             try:
@@ -197,13 +218,17 @@ class GeminiUserbot:
             except Exception as e:
                 self.log.error(f"Error stopping Telegram client: {str(e)}")
         
-        # Save AI session logs if enabled
+        # Save AI session logs if enabled (off the loop - it reads the whole log file)
         if self.ai_handler and self.learning_enabled:
             try:
-                self.ai_handler.save_session_log()
+                await asyncio.get_running_loop().run_in_executor(None, self.ai_handler.save_session_log)
                 self.log.info("AI session logs saved successfully")
             except Exception as e:
                 self.log.error(f"Error saving AI session log: {str(e)}")
+        
+        # Close the session's log file whether or not it was saved
+        if self.ai_handler:
+            self.ai_handler.session_log.close()
     
     async def add_resource(self, resource_path, description=None):
         """Add a resource for the AI handler to use"""
@@ -223,6 +248,29 @@ class GeminiUserbot:
             return {"status": "Bot not initialized", "total_responses": 0}
         return self.ai_handler.get_session_analytics()
     
+    def get_cache_stats(self):
+        """Get sender cache hit/miss counters from the Telegram client"""
+        if not self.telegram_client:
+            return {}
+        return self.telegram_client.get_cache_stats()
+    
+    def get_send_stats(self):
+        """Get outbound queue metrics from the Telegram client"""
+        if not self.telegram_client:
+            return {}
+        return self.telegram_client.get_send_stats()
+    
+    def get_reply_stats(self):
+        """Get reply-worthiness gate counters from the Telegram client"""
+        if not self.telegram_client:
+            return {}
+        return self.telegram_client.get_reply_stats()
+    
+    def set_reply_budget(self, replies_per_minute=None, min_score=None):
+        """Set how many replies per minute the bot may send, and the score a message needs"""
+        self.replies_per_minute = replies_per_minute
+        self.min_reply_score = min_score
+    
     def set_learning_enabled(self, enabled=True):
         """Enable or disable learning"""
         self.learning_enabled = enabled
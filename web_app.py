@@ -7,12 +7,11 @@ from bson.objectid import ObjectId
 import os
 import json
 import asyncio
-import threading
 import sys
 from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv
 import config
-from userbot import GeminiUserbot
+from bot_runner import create_bot_runner
 from telegram_auth import TelegramAuthHandler
 
 # Load environment variables
@@ -76,9 +75,9 @@ github = oauth.register(
     client_kwargs={'scope': 'user:email'},
 )
 
-# Active bot instances
-active_bots = {}
-bot_threads = {}
+# Runs every bot, either on in-process event loops or on a pool of worker
+# processes (see BOT_WORKER_PROCESSES); created after the log helper below
+bot_runner = None
 
 # User model
 class User(UserMixin):
@@ -89,6 +88,8 @@ class User(UserMixin):
         self.telegram_api_id = user_data.get('telegram_api_id', '')
         self.telegram_api_hash = user_data.get('telegram_api_hash', '')
         self.gemini_api_key = user_data.get('gemini_api_key', '')
+        self.api_keys = [key['api_key'] for key in user_data.get('api_keys', [])
+                         if key.get('provider', 'gemini') == 'gemini' and key.get('api_key')]
         self.dark_mode = user_data.get('dark_mode', False)
         self.profile_pic = user_data.get('profile_pic', '')
         self.auth_provider = user_data.get('auth_provider', 'local')
@@ -287,9 +288,8 @@ def register():
 def logout():
     # Stop any running bots for this user
     user_id = current_user.id
-    for bot_id in list(active_bots.keys()):
-        if active_bots[bot_id].get('user_id') == user_id:
-            stop_bot(bot_id)
+    for bot_id in bot_runner.running_bot_ids(user_id):
+        stop_bot(bot_id)
     
     logout_user()
     return redirect(url_for('index'))
@@ -299,13 +299,14 @@ def get_user_bots(user_id):
     """Get all bots for a user with additional status information"""
     bots_cursor = mongo.db.bots.find({'user_id': user_id})
     bots = []
+    running_bot_ids = bot_runner.running_bot_ids(user_id)
     
     for bot in bots_cursor:
         # Convert ObjectId to string for serialization
         bot['_id'] = str(bot['_id'])
         
         # Add active status
-        bot['status'] = 'active' if bot['_id'] in active_bots else 'inactive'
+        bot['status'] = 'active' if bot['_id'] in running_bot_ids else 'inactive'
         
         # Get response count from logs
         response_count = mongo.db.logs.count_documents({
@@ -462,6 +463,16 @@ def profile():
         is_telegram_verified=is_telegram_verified
     )
 
+def _form_number(name, cast, default, low, high):
+    """A numeric form field: the default only when it's left empty, otherwise clamped to [low, high]"""
+    value = (request.form.get(name) or '').strip()
+    if not value:
+        return default
+    try:
+        return min(high, max(low, cast(value)))
+    except ValueError:
+        return default
+
 @app.route('/bot/create', methods=['GET', 'POST'])
 @login_required
 def create_bot():
@@ -470,6 +481,8 @@ def create_bot():
         target_group = request.form.get('target_group')
         duration = int(request.form.get('duration'))
         learning_enabled = True if request.form.get('learning_enabled') == 'on' else False
+        replies_per_minute = _form_number('replies_per_minute', int, config.REPLY_BUDGET_PER_MINUTE, 0, 30)
+        min_reply_score = _form_number('min_reply_score', float, config.REPLY_MIN_SCORE, 0.0, 1.0)
         context = request.form.get('context')
         
         # Validation
@@ -484,6 +497,8 @@ def create_bot():
             'context': context,
             'duration': duration,
             'learning_enabled': learning_enabled,
+            'replies_per_minute': replies_per_minute,
+            'min_reply_score': min_reply_score,
             'user_id': current_user.id,
             'date_created': datetime.utcnow(),
             'date_updated': datetime.utcnow()
@@ -505,7 +520,7 @@ def view_bot(bot_id):
         return redirect(url_for('dashboard'))
     
     # Add is_active flag
-    bot['is_active'] = str(bot['_id']) in active_bots
+    bot['is_active'] = bot_runner.is_running(str(bot['_id']))
     
     # Get logs for this bot
     logs = list(mongo.db.logs.find({'bot_id': str(bot['_id'])}).sort('timestamp', -1).limit(50))
@@ -521,7 +536,7 @@ def edit_bot(bot_id):
         flash('Bot not found', 'danger')
         return redirect(url_for('dashboard'))
     
-    if str(bot['_id']) in active_bots:
+    if bot_runner.is_running(str(bot['_id'])):
         flash('Cannot edit a running bot. Please stop the bot first.', 'warning')
         return redirect(url_for('view_bot', bot_id=bot_id))
     
@@ -531,6 +546,8 @@ def edit_bot(bot_id):
         context = request.form.get('context')
         duration = int(request.form.get('duration'))
         learning_enabled = True if request.form.get('learning_enabled') == 'on' else False
+        replies_per_minute = _form_number('replies_per_minute', int, config.REPLY_BUDGET_PER_MINUTE, 0, 30)
+        min_reply_score = _form_number('min_reply_score', float, config.REPLY_MIN_SCORE, 0.0, 1.0)
         
         # Validation
         if not name or not target_group or not context:
@@ -546,6 +563,8 @@ def edit_bot(bot_id):
                 'context': context,
                 'duration': duration,
                 'learning_enabled': learning_enabled,
+                'replies_per_minute': replies_per_minute,
+                'min_reply_score': min_reply_score,
                 'date_updated': datetime.utcnow()
             }}
         )
@@ -564,6 +583,7 @@ class SerializableUser:
         # Remove telegram API credentials and add phone instead
         self.telegram_phone = getattr(user, 'telegram_phone', '')
         self.gemini_api_key = user.gemini_api_key
+        self.api_keys = list(getattr(user, 'api_keys', []))
 
 @app.route('/bot/<bot_id>/start')
 @login_required
@@ -575,7 +595,7 @@ def start_bot_route(bot_id):
         return redirect(url_for('dashboard'))
     
     # Check if bot is already running
-    if str(bot['_id']) in active_bots:
+    if bot_runner.is_running(str(bot['_id'])):
         flash('Bot is already running', 'warning')
         return redirect(url_for('view_bot', bot_id=bot_id))
     
@@ -626,7 +646,7 @@ def stop_bot_route(bot_id):
         return redirect(url_for('dashboard'))
     
     # Check if bot is running
-    if str(bot['_id']) not in active_bots:
+    if not bot_runner.is_running(str(bot['_id'])):
         flash('Bot is not running', 'warning')
         return redirect(url_for('view_bot', bot_id=bot_id))
     
@@ -646,7 +666,7 @@ def delete_bot(bot_id):
         return redirect(url_for('dashboard'))
     
     # Check if bot is running
-    if str(bot['_id']) in active_bots:
+    if bot_runner.is_running(str(bot['_id'])):
         stop_bot(str(bot['_id']))
     
     # Delete bot
@@ -666,9 +686,9 @@ def view_analytics(bot_id):
         
     # Get analytics data
     analytics = {}
-    if str(bot['_id']) in active_bots:
+    if bot_runner.is_running(str(bot['_id'])):
         # Get analytics from running bot
-        analytics = active_bots[str(bot['_id'])]['bot'].get_session_analytics()
+        analytics = bot_runner.analytics(str(bot['_id']))
     else:
         # Get the latest session log from database
         log = mongo.db.session_logs.find_one(
@@ -721,127 +741,20 @@ def toggle_theme():
     return redirect(request.referrer or url_for('dashboard'))
 
 # Helper functions for bot control
-def run_bot(loop, bot_config, user):
-    """Run a bot in a separate thread with proper user context"""
-    bot_id = str(bot_config['_id'])
-    
+def log_bot_event(bot_id, user_id, log_type, message):
+    """Insert a bot log entry, never letting a logging failure escape"""
     try:
-        # Check if user object is valid to avoid NoneType errors
-        if not user or not hasattr(user, 'id'):
-            print(f"Error: Invalid user object for bot {bot_id}")
-            return
-            
-        user_id = user.id  # Store user id in a local variable to prevent reference issues
-        
-        # Record start
-        log_entry = {
+        mongo.db.logs.insert_one({
             'bot_id': bot_id,
             'user_id': user_id,
-            'type': 'start',
+            'type': log_type,
             'timestamp': datetime.now(),
-            'message': f"Started bot {bot_config['name']}"
-        }
-        mongo.db.logs.insert_one(log_entry)
-        
-        # Run bot
-        try:
-            # Set this thread's event loop
-            asyncio.set_event_loop(loop)
-            
-            # Get bot instance from active_bots
-            bot = active_bots[bot_id]['bot']
-            
-            # Run the async start method with connection error handling
-            max_retries = 3
-            retry_count = 0
-            
-            while retry_count < max_retries:
-                try:
-                    loop.run_until_complete(bot.start())
-                    break  # If successful, exit the retry loop
-                except ConnectionError as conn_err:
-                    retry_count += 1
-                    error_msg = f"Connection error (attempt {retry_count}/{max_retries}): {str(conn_err)}"
-                    print(error_msg)
-                    
-                    # Log connection error
-                    conn_log = {
-                        'bot_id': bot_id,
-                        'user_id': user_id,
-                        'type': 'warning',
-                        'timestamp': datetime.now(),
-                        'message': error_msg
-                    }
-                    mongo.db.logs.insert_one(conn_log)
-                    
-                    if retry_count >= max_retries:
-                        raise  # Re-raise if max retries reached
-                    
-                    # Wait before retrying (incremental backoff)
-                    time.sleep(2 * retry_count)
-            
-            # Add a log message indicating successful initialization
-            success_log = {
-                'bot_id': bot_id,
-                'user_id': user_id,
-                'type': 'info',
-                'timestamp': datetime.now(),
-                'message': f"Bot initialized and running in group {bot_config['target_group']}"
-            }
-            mongo.db.logs.insert_one(success_log)
-        except ConnectionError as e:
-            # Handle connection errors specifically
-            error_msg = f"Network connection error: {str(e)}. Please check your internet connection and Telegram service status."
-            log_entry = {
-                'bot_id': bot_id,
-                'user_id': user_id,
-                'type': 'error',
-                'timestamp': datetime.now(),
-                'message': error_msg
-            }
-            mongo.db.logs.insert_one(log_entry)
-            print(f"Bot connection error: {error_msg}")
-        except Exception as e:
-            # Log other errors
-            error_msg = str(e)
-            log_entry = {
-                'bot_id': bot_id,
-                'user_id': user_id,
-                'type': 'error',
-                'timestamp': datetime.now(),
-                'message': f"Error: {error_msg}"
-            }
-            mongo.db.logs.insert_one(log_entry)
-            print(f"Bot error: {error_msg}")
-    except Exception as outer_e:
-        print(f"Error in run_bot thread: {outer_e}")
-    finally:
-        # Record stop
-        try:
-            # Only log stop if user object is valid
-            if user and hasattr(user, 'id'):
-                stop_log = {
-                    'bot_id': bot_id,
-                    'user_id': user.id,
-                    'type': 'stop',
-                    'timestamp': datetime.now(),
-                    'message': f"Bot {bot_config['name']} stopped"
-                }
-                mongo.db.logs.insert_one(stop_log)
-        except Exception as e:
-            print(f"Error in run_bot cleanup: {e}")
-        
-        # Remove from active bots
-        if bot_id in active_bots:
-            del active_bots[bot_id]
-        
-        # Close the loop properly
-        try:
-            if hasattr(loop, 'shutdown_asyncgens'):
-                loop.run_until_complete(loop.shutdown_asyncgens())
-            loop.close()
-        except Exception as e:
-            print(f"Error closing event loop: {e}")
+            'message': message
+        })
+    except Exception as e:
+        print(f"Error writing bot log: {e}")
+
+bot_runner = create_bot_runner(log_fn=log_bot_event)
 
 def start_bot(bot_config, user):
     """Start a new bot instance"""
@@ -862,82 +775,20 @@ def start_bot(bot_config, user):
             print(f"Error updating user config for user {user.id}")
             return False, "Failed to update configuration"
         
-        # Create bot instance
-        bot = GeminiUserbot(
-            bot_config['context'],
-            bot_config['target_group'],
-            bot_config['duration'],
-            user.id
-        )
-        
-        # Set learning mode
-        if hasattr(bot, 'set_learning_enabled'):
-            bot.set_learning_enabled(bot_config.get('learning_enabled', True))
-        
-        # Start bot in a separate thread with its own event loop
-        loop = asyncio.new_event_loop()
-        
-        # Store bot instance and create thread
-        active_bots[bot_id] = {
-            'bot': bot,
-            'loop': loop,
-            'user_id': user.id,
-            'start_time': datetime.now()
-        }
-        
-        thread = threading.Thread(
-            target=run_bot,
-            args=(loop, bot_config, user)
-        )
-        thread.daemon = True
-        thread.start()
-        
-        # Store thread reference
-        active_bots[bot_id]['thread'] = thread
-        
-        return True, f"Bot {bot_config['name']} started successfully"
+        # Hand the bot to the runner (plain dict so it can cross processes)
+        return bot_runner.start(bot_config, {
+            'id': user.id,
+            'gemini_api_key': user.gemini_api_key,
+            'api_keys': getattr(user, 'api_keys', []),
+            'telegram_phone': getattr(user, 'telegram_phone', '')
+        })
     except Exception as e:
-        print(f"Error starting bot: {e}")
-        # If there was an error, make sure we clean up any partial initialization
-        if bot_id in active_bots:
-            del active_bots[bot_id]
+        print(f"Error starting bot {bot_id}: {e}")
         return False, f"Error starting bot: {str(e)}"
 
 def stop_bot(bot_id):
     """Stop a running bot"""
-    if bot_id not in active_bots:
-        return False, "Bot is not running"
-    
-    # Get bot instance
-    bot_instance = active_bots[bot_id]['bot']
-    
-    # Run stop method in a new thread
-    def stop_thread():
-        # Create new event loop for this thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(bot_instance.stop())
-        except Exception as e:
-            print(f"Error stopping bot: {e}")
-        finally:
-            # Proper cleanup of the event loop
-            if hasattr(loop, 'shutdown_asyncgens'):
-                loop.run_until_complete(loop.shutdown_asyncgens())
-            loop.close()
-    
-    stop_thread = threading.Thread(target=stop_thread)
-    stop_thread.daemon = True
-    stop_thread.start()
-    
-    # Wait for thread to finish (with timeout)
-    stop_thread.join(timeout=5)
-    
-    # Remove from active bots
-    if bot_id in active_bots:
-        del active_bots[bot_id]
-    
-    return True, "Bot stopped successfully"
+    return bot_runner.stop(bot_id, timeout=5)
 
 @app.route("/help")
 def help_center():
@@ -1027,15 +878,15 @@ def test_api_key():
     
     try:
         # Import here to avoid circular imports
-        from ai_handler import GeminiAI
+        from ai_handler import validate_api_key
         
-        # Test the API key using GeminiAI's validation method
-        test_handler = GeminiAI(super_context="Test", api_key=api_key)
+        # Test the API key (cached, so repeat checks don't call Gemini)
+        valid = validate_api_key(api_key)
         
         # Return result
         return jsonify({
-            'valid': test_handler.api_key_valid,
-            'message': 'API key is valid' if test_handler.api_key_valid else 'Invalid API key'
+            'valid': valid,
+            'message': 'API key is valid' if valid else 'Invalid API key'
         })
     
     except Exception as e:
@@ -1050,6 +901,15 @@ def inject_theme():
     dark_mode = session.get('dark_mode', False)
     return {'dark_mode': dark_mode}
 
+# Bot runner metrics (workers, bots and tasks per loop, loop lag) for troubleshooting
+@app.route('/bot-host-status')
+@login_required
+def bot_host_status():
+    # Host-wide, including other users' accounts - admins only
+    if current_user.id not in config.ADMIN_USER_IDS:
+        abort(403)
+    return jsonify(bot_runner.metrics())
+
 # MongoDB connection status endpoint for troubleshooting
 @app.route('/mongo-status')
 def mongo_status():